@@ -1,52 +1,323 @@
 import customthreads as ct
 import audiostreamer as ast
+import audioblock as ab
+import fftbackend
+import instrumentation
+import sharedring
+import ringbuffer
+import spectrumkernels
 import multiprocessing
-import queue
-import collections
+import threading
 import numpy as np
 
 
-class AudioAnalyzer(ct.StoppableProcess, ct.DispatcherProcess):
-    def __init__(self, blocksize=4096, overlap=1024, channel=1, *args, **kwargs):
+class STFT(object):
+    '''Windowed rfft of the latest block of every channel in one batched call.
+
+    Samples are kept in a mirrored (channel x samples) RingBuffer, so the
+    newest history_len samples are always one contiguous slice and never
+    need unwrapping. The transform is planned up front (see
+    fftbackend), not on the first frame.
+    '''
+
+    def __init__(self, blocksize, overlap, channel, backend=None,
+                 dtype=np.float64, backend_options=None):
+        if(backend_options is None):
+            backend_options = {}
+        self.backend = fftbackend.get_backend(backend, **backend_options)
+        self.blocksize = blocksize
+        self.overlap = overlap
+        self.channel = channel
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = np.result_type(self.dtype, np.complex64)
+        self.history_len = self.blocksize + self.overlap
+        self.history = ringbuffer.RingBuffer(self.history_len, self.channel,
+                                             self.dtype, mirrored=True)
+
+        self.window = np.hanning(self.blocksize).astype(self.dtype)
+        '''zero padded to twice the blocksize, the tail is never written'''
+        self.frame = np.zeros((self.channel, 2 * self.blocksize),
+                              dtype=self.dtype)
+        self.spectrum = np.zeros((self.channel, self.blocksize + 1),
+                                 dtype=self.complex_dtype)
+        self.prepare()
+
+    def prepare(self):
+        self.backend.prepare(self.frame.shape, self.dtype)
+
+    def push(self, planar):
+        '''append a (channel x n) block of samples to the history'''
+        self.history.extend(planar)
+
+    def compute(self):
+        '''spectrum of the latest block; the returned array is reused'''
+        start = self.overlap // 2
+        block = self.history.latest(self.history_len)[:, start:start + self.blocksize]
+        np.multiply(block, self.window, out=self.frame[:, :self.blocksize])
+        self.backend.rfft(self.frame, out=self.spectrum)
+        return self.spectrum[:, :self.blocksize]
+
+
+class ShardedSTFT(STFT):
+    '''STFT whose transform is split by channel across worker processes.
+
+    The history and the spectrum live in shared memory. push() still runs
+    in the analyzer; on compute() every worker windows and transforms its
+    own slice of channel rows in place, and the analyzer waits for all of
+    them before returning the (channel-ordered) spectrum.
+
+    Workers are started from the process that owns the analyzer, since a
+    daemonic analyzer process may not have children of its own.
+    '''
+
+    def __init__(self, blocksize, overlap, channel, workers, backend=None,
+                 dtype=np.float64, backend_options=None):
+        self.workers = min(workers, channel)
+        self.bounds = np.linspace(0, channel, self.workers + 1).astype(int)
+        super(ShardedSTFT, self).__init__(blocksize, overlap, channel,
+                                          backend=backend, dtype=dtype,
+                                          backend_options=backend_options)
+        self.shared = {'history': sharedring.SharedArray(self.history.data.shape,
+                                                         self.dtype),
+                       'spectrum': sharedring.SharedArray(self.spectrum.shape,
+                                                          self.spectrum.dtype),
+                       'write_pos': sharedring.SharedArray((1,), np.int64)}
+        self._bind_shared()
+
+        self.start_barrier = multiprocessing.Barrier(self.workers + 1)
+        self.done_barrier = multiprocessing.Barrier(self.workers + 1)
+        self.pool = [_ShardWorker(self, self.bounds[i], self.bounds[i + 1],
+                                  daemon=True)
+                     for i in range(self.workers)]
+
+    def prepare(self):
+        '''plan the transforms of the workers' shards, which they carry
+        along to their processes'''
+        for rows in set(np.diff(self.bounds)):
+            self.backend.prepare((int(rows), 2 * self.blocksize), self.dtype)
+
+    def _bind_shared(self):
+        self.history = ringbuffer.RingBuffer(self.history_len, self.channel,
+                                             self.dtype, mirrored=True,
+                                             data=self.shared['history'].array)
+        self.spectrum = self.shared['spectrum'].array
+        self.shared_write_pos = self.shared['write_pos'].array
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('history', 'spectrum', 'shared_write_pos', 'pool'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pool = []
+        self._bind_shared()
+
+    def start(self):
+        for worker in self.pool:
+            worker.start()
+
+    def stop(self):
+        for worker in self.pool:
+            worker.stop()
+        self.start_barrier.abort()
+        self.done_barrier.abort()
+
+    def join(self):
+        for worker in self.pool:
+            worker.join()
+        for shared in self.shared.values():
+            shared.close()
+            shared.unlink()
+
+    def compute(self):
+        self.shared_write_pos[0] = self.history.write_pos
+        self.start_barrier.wait()
+        self.done_barrier.wait()
+        return self.spectrum[:, :self.blocksize]
+
+    def compute_rows(self, lo, hi, frame):
+        '''window and transform channel rows lo:hi into the shared spectrum'''
+        start = int(self.shared_write_pos[0]) + self.overlap // 2
+        block = self.history.data[lo:hi, start:start + self.blocksize]
+        np.multiply(block, self.window, out=frame[:, :self.blocksize])
+        self.backend.rfft(frame, out=self.spectrum[lo:hi])
+
+
+class _ShardWorker(ct.StoppableProcess):
+    def __init__(self, stft, lo, hi, *args, **kwargs):
+        super(_ShardWorker, self).__init__(*args, **kwargs)
+        self.stft = stft
+        self.lo = lo
+        self.hi = hi
+
+    def run(self):
+        frame = np.zeros((self.hi - self.lo, 2 * self.stft.blocksize),
+                         dtype=self.stft.dtype)
+        try:
+            while(self.is_stopped() is False):
+                self.stft.start_barrier.wait()
+                if(self.is_stopped()):
+                    break
+                self.stft.compute_rows(self.lo, self.hi, frame)
+                self.stft.done_barrier.wait()
+        except threading.BrokenBarrierError:
+            '''the analyzer is shutting down'''
+            pass
+
+
+class AudioAnalyzer(ct.QueueConsumer, ct.StoppableProcess, ct.DispatcherProcess):
+    '''Dispatches one spectrum every hop_size samples (per channel).
+
+    hop_size defaults to the blocksize; a smaller hop gives overlapping
+    frames and a higher, fixed frame rate (samplerate / hop_size) at the
+    cost of more FFTs. Every frame is an AudioBlock whose sample_index is
+    the number of samples per channel consumed when it was computed.
+
+    fft_backend is a fftbackend name ('numpy', 'scipy', 'pyfftw'), a backend
+    instance, or None for the fastest one installed; fft_options are passed
+    to a named one, e.g. {'workers': 4} for 'scipy' or {'planner_effort':
+    'FFTW_PATIENT'} for 'pyfftw'. The transform is planned when the
+    analyzer is built, before its process starts. With workers > 1 the
+    channels are sharded across that many worker processes (see ShardedSTFT).
+
+    dtype is the real compute dtype; np.float32 halves the size of the
+    dispatched (complex64) spectra. Samples are cast into it once, when they
+    enter the history; normalizing them is the streamer's job
+    (AudioStreamer(compute_dtype=...)).
+
+    layout is the layout of the dispatched spectra: 'interleaved' like the
+    samples, or 'planar' (channel x blocksize), which saves interleaving
+    them for subscribers that split them up again, e.g. the plots. Input
+    blocks may come in either layout.
+
+    post_process, e.g. a spectrumkernels.Chain, turns each (channel x
+    blocksize) complex spectrum into what is dispatched instead, once for
+    all subscribers; it may return a reused buffer. A bare kernel
+    allocates its result on every frame, a Chain of it reuses one.
+
+    bands reduces every spectrum to the mean power in up to that many
+    log-spaced bands, or in 'octave' / 'third-octave' bands (see
+    spectrumkernels.reduction_bands; needs the samplerate), before
+    post_process: frames shrink from blocksize complex values to a few
+    hundred floats per channel. Their center frequencies are in
+    band_centers, one per dispatched value.
+    '''
+    def __init__(self, blocksize=4096, overlap=1024, channel=1, hop_size=None,
+                 fft_backend=None, workers=1, dtype=np.float64,
+                 queue_size=ct.QUEUE_SIZE, layout='interleaved',
+                 post_process=None, samplerate=None, bands=None,
+                 fft_options=None, *args, **kwargs):
         super(AudioAnalyzer, self).__init__(*args, **kwargs)
-        self.in_queue = multiprocessing.Queue()
-        self.max_value = np.finfo(np.complex128).max
+        self.in_queue = multiprocessing.Queue(queue_size)
+        self.dtype = np.dtype(dtype)
+        self.max_value = np.finfo(np.result_type(self.dtype, np.complex64)).max
         self.channel = channel
+        if(layout not in ast.LAYOUTS):
+            raise ValueError("unknown channel layout %r" % (layout,))
+        self.layout = layout
+        self.post_process = post_process
+        self.samplerate = samplerate
+        self.reduction = None
+        self.band_centers = None
+        if(bands is not None):
+            if(samplerate is None):
+                raise ValueError("band reduction needs the samplerate")
+            self.reduction, self.band_centers = spectrumkernels.band_reduction(
+                bands, blocksize, samplerate)
 
         self.blocksize_single = blocksize
         self.overlapsize = overlap
         self.blocksize_total = self.blocksize_single * self.channel
-        self.accumulated_samples = 0
-        queue_length = self.blocksize_single + self.overlapsize
-        self.deque_list = [collections.deque(maxlen=queue_length) for i in range(self.channel)]
-        for dq in self.deque_list:
-            dq.extend([0] * queue_length)
-        self.extended_block = [0 for i in range((self.blocksize_single * 2))]
-        self.window = np.hanning(self.blocksize_single)
+        self.hop_size = hop_size
+        if(self.hop_size is None):
+            self.hop_size = self.blocksize_single
+        if((isinstance(self.hop_size, (int, np.integer)) is False) or
+           (self.hop_size <= 0)):
+            raise ValueError("hop_size must be a positive int, not %r"
+                             % (hop_size,))
+        self.sample_index = 0
+        self.samples_since_hop = 0
+        self.stage_stats = instrumentation.StageStats('analyzer')
+        self.workers = min(workers, self.channel)
+        if(self.workers > 1):
+            self.stft = ShardedSTFT(self.blocksize_single, self.overlapsize,
+                                    self.channel, self.workers,
+                                    backend=fft_backend, dtype=self.dtype,
+                                    backend_options=fft_options)
+        else:
+            self.stft = STFT(self.blocksize_single, self.overlapsize,
+                             self.channel, backend=fft_backend,
+                             dtype=self.dtype, backend_options=fft_options)
+
+    def start(self):
+        if(self.workers > 1):
+            self.stft.start()
+        super(AudioAnalyzer, self).start()
+
+    def stop(self):
+        super(AudioAnalyzer, self).stop()
+        if(self.workers > 1):
+            self.stft.stop()
+
+    def join(self, timeout=None):
+        super(AudioAnalyzer, self).join(timeout)
+        if((self.workers > 1) and (self.is_alive() is False)):
+            self.stft.join()
+
+    def process(self, data):
+        '''push an interleaved block, dispatching a frame for every hop it
+        completes; frames carry seq and timestamp of the block that
+        completed them'''
+        planar = ast.as_planar(data, self.channel)
+        length = planar.shape[1]
+        pos = 0
+        while(pos < length):
+            take = min(length - pos, self.hop_size - self.samples_since_hop)
+            self.stft.push(planar[:, pos:pos + take])
+            pos += take
+            self.sample_index += take
+            self.samples_since_hop += take
+
+            if(self.samples_since_hop == self.hop_size):
+                self.samples_since_hop = 0
+                self.dispatch(ab.AudioBlock(self.frame(self.spectrum()),
+                                            sample_index=self.sample_index,
+                                            seq=getattr(data, 'seq', None),
+                                            timestamp=getattr(data, 'timestamp', None)))
+
+    def transform(self, spectrum):
+        '''band reduction and post_process, where configured'''
+        if(self.reduction is not None):
+            spectrum = self.reduction(spectrum)
+        if(self.post_process is not None):
+            spectrum = self.post_process(spectrum)
+        return spectrum
+
+    def spectrum(self):
+        return self.transform(self.stft.compute())
+
+    def frame(self, spectrum):
+        '''a copy of the (reused) spectrum in the dispatch layout'''
+        if(self.layout == 'planar'):
+            return np.array(spectrum)
+        return ast.merge_channel(spectrum, out=np.empty(spectrum.size,
+                                                        spectrum.dtype))
+
+    def frame_template(self):
+        '''a zero frame of the size and dtype of the dispatched ones'''
+        spectrum = np.zeros((self.channel, self.blocksize_single),
+                            dtype=self.stft.complex_dtype)
+        return self.frame(self.transform(spectrum))
 
     def run(self):
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                for i in range(self.channel):
-                    self.deque_list[i].extend(split_data[i])
-
-                self.accumulated_samples += len(data)
-                if(self.accumulated_samples >= self.blocksize_total):
-                    analyzed_data = np.array([self.analyze(dq) for dq in self.deque_list])
-                    self.dispatch(ast.merge_channel(analyzed_data))
-                    self.accumulated_samples = 0
-
-            except queue.Empty:
-                '''do nothing'''
-                pass
-
-    def analyze(self, datablock):
-        datablock = list(datablock)
-        datablock = datablock[int(self.overlapsize/2) : self.blocksize_single + int(self.overlapsize/2)]
-        datablock = datablock * self.window
-        self.extended_block[0:self.blocksize_single] = datablock
-        fftblock = np.fft.rfft(self.extended_block)
-
-        return fftblock[0:self.blocksize_single]
+        try:
+            for data in self.consume():
+                start = instrumentation.now()
+                self.process(data)
+                self.stage_stats.record_block(start, self.in_queue,
+                                              getattr(data, 'timestamp', None))
+        except threading.BrokenBarrierError:
+            '''sharded workers were shut down'''
+            pass
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+class AudioBlock(np.ndarray):
+    '''ndarray that carries pipeline metadata along with the samples.
+
+    Behaves like the plain array it wraps, so existing consumers keep
+    working, and keeps its metadata when sliced or sent through a
+    multiprocessing queue.
+
+    seq numbers the blocks a streamer dispatched, timestamp is when the
+    block was captured (instrumentation.now()), sample_index the position
+    of an analysis frame in the stream.
+    '''
+    meta_attrs = ('sample_index', 'seq', 'timestamp')
+
+    def __new__(cls, data, **meta):
+        obj = np.asarray(data).view(cls)
+        for attr in cls.meta_attrs:
+            setattr(obj, attr, meta.get(attr))
+        return obj
+
+    def __array_finalize__(self, obj):
+        if(obj is None):
+            return
+        for attr in self.meta_attrs:
+            setattr(self, attr, getattr(obj, attr, None))
+
+    def __reduce__(self):
+        reconstruct, args, state = super(AudioBlock, self).__reduce__()
+        meta = tuple(getattr(self, attr) for attr in self.meta_attrs)
+        return (reconstruct, args, state + (meta,))
+
+    def __setstate__(self, state):
+        meta = state[-1]
+        super(AudioBlock, self).__setstate__(state[:-1])
+        for attr, value in zip(self.meta_attrs, meta):
+            setattr(self, attr, value)
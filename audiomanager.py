@@ -1,13 +1,139 @@
 import audioanalyzer as aa
 import audiostreamer as ast
+import customthreads as ct
+import instrumentation
+import sharedring
+import numpy as np
 
 
 class AudioManager:
-    def __init__(self, analyzer_blocksize):
+    def __init__(self, analyzer_blocksize, analyzer_hop_size=None,
+                 shared_memory=False, compute_dtype=None, callback_mode=False,
+                 streamer_options=None, analyzer_post_process=None,
+                 analyzer_bands=None, analyzer_fft_backend=None,
+                 analyzer_fft_options=None, analyzer_workers=1):
         self.audiobuffer = None
         self.streamer = None
         self.analyzer = None
         self.analyzer_blocksize = analyzer_blocksize
+        self.analyzer_hop_size = analyzer_hop_size
+        self.shared_memory = shared_memory
+        '''e.g. np.float32: normalize samples once in the streamer and
+        analyze in single precision; None keeps raw samples and float64'''
+        self.compute_dtype = compute_dtype
+        '''use CallbackAudioStreamer; streamer_options are passed to the
+        streamer, e.g. frames_per_buffer, prebuffer or pyaudio_module'''
+        self.callback_mode = callback_mode
+        self.streamer_options = streamer_options
+        if(self.streamer_options is None):
+            self.streamer_options = {}
+        '''e.g. a spectrumkernels.Chain, run by the analyzer on every
+        spectrum it dispatches'''
+        self.analyzer_post_process = analyzer_post_process
+        '''band reduction of the analyzer, see AudioAnalyzer(bands=...)'''
+        self.analyzer_bands = analyzer_bands
+        '''see AudioAnalyzer(fft_backend=..., fft_options=...)'''
+        self.analyzer_fft_backend = analyzer_fft_backend
+        self.analyzer_fft_options = analyzer_fft_options
+        '''shard the analyzer's channels across this many processes, see
+        AudioAnalyzer(workers=...)'''
+        self.analyzer_workers = analyzer_workers
+        '''broadcast rings of the sources in shared memory mode, by
+        source name; the analyzer reads the streamer's too'''
+        self.rings = {}
+        '''StageStats of stages outside the manager, e.g. plots'''
+        self.extra_stats = []
+
+    @property
+    def analyzer_dtype(self):
+        if(self.compute_dtype is None):
+            return np.float64
+        return self.compute_dtype
+
+    @property
+    def analyzer_layout(self):
+        '''plots take planar spectra as they are; ring frames are flat, so
+        spectra going through shared memory stay interleaved'''
+        if(self.shared_memory):
+            return 'interleaved'
+        return 'planar'
+
+    @property
+    def block_dtype(self):
+        '''dtype of the blocks the streamer dispatches'''
+        if(self.compute_dtype is None):
+            return self.dtype
+        return self.compute_dtype
+
+    def make_streamer(self, **kwargs):
+        kwargs.update(self.streamer_options)
+        if(self.callback_mode):
+            return ast.CallbackAudioStreamer(**kwargs)
+        return ast.AudioStreamer(**kwargs)
+
+    def make_analyzer(self):
+        return aa.AudioAnalyzer(blocksize=self.analyzer_blocksize,
+                                overlap=1024,
+                                channel=self.channel,
+                                hop_size=self.analyzer_hop_size,
+                                dtype=self.analyzer_dtype,
+                                layout=self.analyzer_layout,
+                                post_process=self.analyzer_post_process,
+                                samplerate=self.samplerate,
+                                bands=self.analyzer_bands,
+                                fft_backend=self.analyzer_fft_backend,
+                                fft_options=self.analyzer_fft_options,
+                                workers=self.analyzer_workers,
+                                daemon=True)
+
+    def connect_analyzer(self):
+        '''feed streamer blocks to the analyzer, through shared memory if
+        enabled. The analyzer must see every block, or its sample history
+        and hop timing break, so its queue blocks when full; only plots
+        (see connect()) may drop blocks. In shared memory it reads the
+        streamer's broadcast ring, which the plots share, so the streamer
+        writes each block to shared memory once'''
+        if(self.shared_memory is False):
+            self.streamer.register_queue(self.analyzer.in_queue, ct.BLOCK)
+            return
+        self.analyzer.in_queue = self.broadcast_ring('streamer').reader()
+
+    def broadcast_ring(self, source):
+        '''the SharedRing all shared memory subscribers of source read
+        from, registered on first use'''
+        if(source in self.rings):
+            return self.rings[source]
+        if(source == 'streamer'):
+            ring = sharedring.SharedRing(
+                frame_size=self.streamer.buffersize * self.channel,
+                dtype=self.block_dtype)
+        else:
+            template = self.analyzer.frame_template()
+            ring = sharedring.SharedRing(frame_size=template.size,
+                                         dtype=template.dtype)
+        getattr(self, source).register_queue(ring)
+        self.rings[source] = ring
+        return ring
+
+    def connect(self, consumer, source='streamer', policy=ct.DROP_OLDEST,
+                every=1):
+        '''subscribe consumer (e.g. a plot) to the 'streamer' or 'analyzer'
+        blocks; call before starting it.
+
+        With shared_memory all subscribers of a source share one ring the
+        source writes each block to once, whatever their number, and
+        consumer.in_queue is replaced by a reader of it; LATEST makes the
+        reader skip to the newest block. Otherwise the consumer subscribe()s
+        to the source with the given policy.'''
+        if(source not in ('streamer', 'analyzer')):
+            raise ValueError("unknown source %r" % (source,))
+        if(self.shared_memory is False):
+            return consumer.subscribe(getattr(self, source), policy, every)
+        ring = self.broadcast_ring(source)
+        consumer.in_queue = ring.reader(every=every,
+                                        latest=(policy == ct.LATEST),
+                                        copy=True)
+        return consumer.in_queue
 
     def set_play_wav_file(self, filename):
 
@@ -15,21 +141,19 @@ class AudioManager:
 
         self.samplerate = self.audiobuffer.samplerate
         self.channel = self.audiobuffer.channel
-        self.dtype = ast.dic_datawidth_to_numpy_dtype[self.audiobuffer.width]
+        self.dtype = self.audiobuffer.dtype
 
-        self.streamer = ast.AudioStreamer(samplerate=self.samplerate,
-                                          channel=self.channel,
-                                          datatype=self.dtype,
-                                          input_flag=False,
-                                          daemon=True)
+        self.streamer = self.make_streamer(samplerate=self.samplerate,
+                                           channel=self.channel,
+                                           datatype=self.dtype,
+                                           compute_dtype=self.compute_dtype,
+                                           input_flag=False,
+                                           daemon=True)
 
-        self.analyzer = aa.AudioAnalyzer(blocksize=self.analyzer_blocksize,
-                                         overlap=1024,
-                                         channel=self.channel,
-                                         daemon=True)
+        self.analyzer = self.make_analyzer()
 
         self.audiobuffer.register_queue(self.streamer.in_queue)
-        self.streamer.register_queue(self.analyzer.in_queue)
+        self.connect_analyzer()
 
     def set_play_audiodata(self, datablock, samplerate, channel, dtype):
 
@@ -37,18 +161,17 @@ class AudioManager:
         self.samplerate = samplerate
         self.channel = channel
         self.audiobuffer = ast.AudioBuffer(datablock, daemon=True)
-        self.streamer = ast.AudioStreamer(samplerate=self.samplerate,
-                                          channel=self.channel,
-                                          datatype=self.dtype,
-                                          input_flag=False,
-                                          daemon=True)
+        self.streamer = self.make_streamer(samplerate=self.samplerate,
+                                           channel=self.channel,
+                                           datatype=self.dtype,
+                                           compute_dtype=self.compute_dtype,
+                                           input_flag=False,
+                                           daemon=True)
 
-        self.analyzer = aa.AudioAnalyzer(blocksize=self.analyzer_blocksize,
-                                         channel=self.channel,
-                                         daemon=True)
+        self.analyzer = self.make_analyzer()
 
         self.audiobuffer.register_queue(self.streamer.in_queue)
-        self.streamer.register_queue(self.analyzer.in_queue)
+        self.connect_analyzer()
 
     def set_record(self, samplerate, channel, dtype, filename):
 
@@ -56,17 +179,16 @@ class AudioManager:
         self.audiobuffer = None
         self.samplerate = samplerate
         self.channel = channel
-        self.streamer = ast.AudioStreamer(samplerate=self.samplerate,
-                                          channel=self.channel,
-                                          datatype=self.dtype,
-                                          input_flag=True,
-                                          filename=filename,
-                                          daemon=True)
-
-        self.analyzer = aa.AudioAnalyzer(blocksize=self.analyzer_blocksize,
-                                         channel=self.channel,
-                                         daemon=True)
-        self.streamer.register_queue(self.analyzer.in_queue)
+        self.streamer = self.make_streamer(samplerate=self.samplerate,
+                                           channel=self.channel,
+                                           datatype=self.dtype,
+                                           compute_dtype=self.compute_dtype,
+                                           input_flag=True,
+                                           filename=filename,
+                                           daemon=True)
+
+        self.analyzer = self.make_analyzer()
+        self.connect_analyzer()
 
     def start(self):
         if(self.streamer is not None):
@@ -83,6 +205,56 @@ class AudioManager:
             self.streamer.immediate_join()
         if((self.analyzer is not None) and (self.analyzer.is_running)):
             self.analyzer.immediate_join()
+        for ring in self.rings.values():
+            ring.close()
+            ring.unlink()
+        self.rings = {}
+
+    def queue_stats(self):
+        '''dispatched/dropped block counts per subscriber of every stage'''
+        stats = {}
+        for name in ('audiobuffer', 'streamer', 'analyzer'):
+            stage = getattr(self, name)
+            if(stage is not None):
+                stats[name] = stage.queue_stats()
+        return stats
+
+    def add_stage_stats(self, stage_stats):
+        '''include e.g. a plot's stage_stats in snapshot()/export_stats()'''
+        self.extra_stats.append(stage_stats)
+
+    def stage_stats(self):
+        stages = []
+        for stage in (self.streamer, self.analyzer):
+            if(stage is not None):
+                stages.append(stage.stage_stats)
+        return stages + self.extra_stats
+
+    def snapshot(self):
+        '''timing histograms per stage plus queue and ring counters'''
+        stages = {}
+        for stage_stats in self.stage_stats():
+            name = stage_stats.name
+            if(name in stages):
+                name = '%s-%d' % (name, len(stages))
+            stages[name] = stage_stats.snapshot()
+        snapshot = {'stages': stages, 'queues': self.queue_stats()}
+        for source, ring in self.rings.items():
+            snapshot['%s_ring_write_count' % source] = ring.write_count
+        return snapshot
+
+    def export_stats(self, filename, format='json'):
+        '''write snapshot() as JSON or in the Prometheus text format (e.g.
+        for node_exporter's textfile collector)'''
+        snapshot = self.snapshot()
+        if(format == 'json'):
+            text = instrumentation.to_json(snapshot)
+        elif(format == 'prometheus'):
+            text = instrumentation.to_prometheus(snapshot['stages'])
+        else:
+            raise ValueError("unknown stats format %r" % (format,))
+        with open(filename, 'w') as f:
+            f.write(text)
 
     def is_running(self):
         result_flag = False
@@ -1,7 +1,13 @@
 import numpy
-import wave
 import queue
+import threading
+import warnings
+import audioblock as ab
 import customthreads as ct
+import instrumentation
+import ringbuffer
+import wavfile
+import wavwriter
 
 # dic_pyaudio_dtype_to_numpy_dtype = {  1: numpy.float32,
 #                                       2: numpy.int32,
@@ -14,12 +20,56 @@ dic_datawidth_to_numpy_dtype = {1: numpy.uint8,
                                 4: numpy.int32}
 
 
-def split_channel(data, channel):
-    return numpy.transpose(numpy.reshape(data, (len(data)/channel, channel)))
+'''Channel layouts: devices and WAV files deliver interleaved blocks
+(l0 r0 l1 r1 ...), analysis and plotting work on planar (channel x n)
+arrays. split_channel() of an interleaved block and merge_channel() of
+the result are strided views, not copies, so a block is only ever
+rearranged where a stage really needs the other layout.'''
+LAYOUTS = ('interleaved', 'planar')
 
-def merge_channel(data):
-    # data_size = len(data) * len(data[0])
-    return numpy.reshape(numpy.transpose(data), data.size)
+
+def split_channel(data, channel, out=None):
+    '''(channel x n) view of an interleaved block, or a copy into out'''
+    planar = numpy.asanyarray(data).reshape(-1, channel).T
+    if(out is None):
+        return planar
+    out[...] = planar
+    return out
+
+def merge_channel(data, out=None):
+    '''interleaved block of a (channel x n) array, or a copy into out; a
+    view when data is a planar view of an interleaved block'''
+    data = numpy.asanyarray(data)
+    if(out is None):
+        return numpy.ravel(data, order='F')
+    numpy.reshape(out, data.shape[::-1])[...] = data.T
+    return out
+
+def as_planar(data, channel):
+    '''data as (channel x n), whichever layout it was dispatched in'''
+    if(numpy.ndim(data) == 2):
+        return data
+    return split_channel(data, channel)
+
+def as_interleaved(data):
+    if(numpy.ndim(data) == 1):
+        return data
+    return merge_channel(data)
+
+
+def normalize(data, dtype=numpy.float32):
+    '''integer samples scaled to [-1, 1) as dtype; float samples are only cast'''
+    data = numpy.asarray(data)
+    if(data.dtype.kind == 'f'):
+        return data.astype(dtype, copy=False)
+
+    typeinfo = numpy.iinfo(data.dtype)
+    scale = numpy.asarray(2.0 / (typeinfo.max - typeinfo.min + 1), dtype=dtype)
+    result = numpy.multiply(data, scale, dtype=dtype)
+    if(typeinfo.min == 0):
+        '''unsigned samples (8 bit WAV) are centered on half the range'''
+        numpy.subtract(result, 1, out=result)
+    return result
 
 class AudioBuffer(ct.StoppableThread, ct.DispatcherThread):
     def read_with_blocksize(self, alist, blocksize=1):
@@ -46,27 +96,52 @@ class AudioBuffer(ct.StoppableThread, ct.DispatcherThread):
 
 
 class WavBuffer(ct.StoppableThread, ct.DispatcherThread):
-    def __init__(self, filename, blocksize=1024, *args, **kwargs):
+    '''Dispatches a WAV file block by block straight from a memory map.
+
+    The header is parsed once and the data chunk is mapped read-only, so
+    nothing is read into RAM up front and every dispatched block is an
+    interleaved numpy view into the file rather than a copy (except for
+    24 bit files, whose blocks are widened to int32, see wavfile).
+    '''
+    def __init__(self, filename, blocksize=1024, loop=False, *args, **kwargs):
         super(WavBuffer, self).__init__(*args, **kwargs)
 
-        self.wf = wave.open(filename, 'rb')
-        self.samplerate = self.wf.getframerate()
-        self.channel = self.wf.getnchannels()
-        self.width = self.wf.getsampwidth()
+        self.info, self.data = wavfile.open_memmap(filename)
+        self.samplerate = self.info.samplerate
+        self.channel = self.info.channel
+        self.width = self.info.width
+        self.dtype = self.info.dtype.type
+        self.frames = self.info.frames
         self.blocksize = blocksize
+        self.loop = loop
+
+        self.position = 0
+        self.seek_lock = threading.Lock()
+        self.seek_position = None
+
+    def seek(self, frame):
+        '''continue playback from the given frame (thread safe)'''
+        with self.seek_lock:
+            self.seek_position = min(max(int(frame), 0), self.frames)
 
     def run(self):
-        db = self.wf.readframes(self.blocksize)
-        while db:
-            if(self.is_stopped()):
-                break
-            self.dispatch(db)
-            # self.out_queue.put(db)
-            # self.out_q.task_done()
-            db = self.wf.readframes(self.blocksize)
+        while(self.is_stopped() is False):
+            with self.seek_lock:
+                if(self.seek_position is not None):
+                    self.position = self.seek_position
+                    self.seek_position = None
+
+            if(self.position >= self.frames):
+                if((self.loop is False) or (self.frames == 0)):
+                    break
+                self.position = 0
 
+            end_pos = min(self.position + self.blocksize, self.frames)
+            self.dispatch(self.data[self.position:end_pos].reshape(-1))
+            self.position = end_pos
 
-class AudioStreamer(ct.StoppableThread, ct.DispatcherThread):
+
+class AudioStreamer(ct.QueueConsumer, ct.StoppableThread, ct.DispatcherThread):
 
     dic_numpy_dtype_to_pyaudio_dtype = {numpy.float32: 1,
                                         numpy.int32: 2,
@@ -76,7 +151,8 @@ class AudioStreamer(ct.StoppableThread, ct.DispatcherThread):
 
     def __init__(self, samplerate=44100, buffersize=1024, input_flag=False,
                  channel=1, datatype=numpy.int32, filename=None,
-                 *args, **kwargs):
+                 compute_dtype=None, queue_size=ct.QUEUE_SIZE,
+                 pyaudio_module=None, writer_options=None, *args, **kwargs):
 
         super(AudioStreamer, self).__init__(*args, **kwargs)
 
@@ -85,17 +161,81 @@ class AudioStreamer(ct.StoppableThread, ct.DispatcherThread):
         self.pyaudio_format = self.dic_numpy_dtype_to_pyaudio_dtype[self.datatype]
         self.channel = channel
         self.buffersize = buffersize
-        self.in_queue = queue.Queue()
+        '''if set, blocks are normalized to [-1, 1) in this dtype before dispatch'''
+        self.compute_dtype = compute_dtype
+        self.in_queue = queue.Queue(queue_size)
         self.input_flag = input_flag
         self.filename = filename
-        if(self.filename is ''):
+        if(self.filename == ''):
             self.filename = None
-        self.frames = []
+        '''records are streamed to disk by a WavWriter; writer_options are
+        passed on to it, e.g. max_bytes/max_seconds for rotation'''
+        self.writer = None
+        self.recorder = None
+        if((self.input_flag is True) and (self.filename is not None)):
+            if(writer_options is None):
+                writer_options = {}
+            self.writer = wavwriter.WavWriter(self.filename, self.samplerate,
+                                              self.channel, self.datatype,
+                                              daemon=True, **writer_options)
+            self.recorder = ct.Subscription(self.writer.in_queue)
+        '''pyaudio or a stand-in such as fakepyaudio; imported on run() if None'''
+        self.pyaudio_module = pyaudio_module
+        self.seq = 0
+        self.stage_stats = instrumentation.StageStats('streamer')
 
-    def run(self):
-        import pyaudio
+    def load_pyaudio(self):
+        if(self.pyaudio_module is None):
+            import pyaudio
+            self.pyaudio_module = pyaudio
+        return self.pyaudio_module
+
+    def ingest(self, datablock, timestamp=None):
+        '''raw bytes or samples as an AudioBlock in the pipeline's compute
+        dtype, numbered and stamped with its capture time'''
+        if(isinstance(datablock, numpy.ndarray)):
+            data = datablock.reshape(-1)
+        else:
+            data = numpy.frombuffer(datablock, dtype=self.datatype)
+        if(self.compute_dtype is not None):
+            data = normalize(data, self.compute_dtype)
+        if(timestamp is None):
+            timestamp = instrumentation.now()
+        block = ab.AudioBlock(data, seq=self.seq, timestamp=timestamp)
+        self.seq += 1
+        return block
+
+    def forward(self, datablock, timestamp, in_queue=None):
+        '''dispatch a captured or played block and time it'''
+        self.dispatch(self.ingest(datablock, timestamp))
+        self.stage_stats.record_block(timestamp, in_queue, timestamp)
+
+    def writer_gone(self):
+        return self.writer.is_stopped() or (self.writer.is_alive() is False)
 
-        p = pyaudio.PyAudio()
+    def record(self, datablock):
+        '''hand a raw captured block to the writer; waits for room as long
+        as the writer runs, even once the streamer is stopped, since
+        stop_recording() lets the writer drain its queue'''
+        if(self.recorder is None):
+            return
+        if(self.recorder.put(datablock, self.writer_gone) is False):
+            self.recorder.counters[1] += 1
+            warnings.warn("recording to %s lost a block, the writer has "
+                          "stopped" % self.filename)
+
+    def start_recording(self):
+        if(self.writer is not None):
+            self.writer.start()
+
+    def stop_recording(self):
+        '''let the writer flush what was captured and close the file'''
+        if(self.writer is not None):
+            self.writer.immediate_join()
+
+    def run(self):
+        p = self.load_pyaudio().PyAudio()
+        self.start_recording()
         if(self.input_flag is True):
             stream = p.open(format=self.pyaudio_format,
                             channels=self.channel,
@@ -104,10 +244,9 @@ class AudioStreamer(ct.StoppableThread, ct.DispatcherThread):
 
             while(self.is_stopped() is False):
                 datablock = stream.read(self.buffersize)
-                self.dispatch(numpy.frombuffer(datablock,
-                                               dtype=self.datatype))
-                if(self.filename is not None):
-                    self.frames.append(datablock)
+                timestamp = instrumentation.now()
+                self.record(datablock)
+                self.forward(datablock, timestamp)
 
         else:
             stream = p.open(format=self.pyaudio_format,
@@ -115,24 +254,150 @@ class AudioStreamer(ct.StoppableThread, ct.DispatcherThread):
                             rate=self.samplerate,
                             output=True)
 
-            while(self.is_stopped() is False):
-                try:
-                    datablock = self.in_queue.get_nowait()
+            for datablock in self.consume():
+                if(isinstance(datablock, numpy.ndarray)):
+                    stream.write(datablock.tobytes())
+                else:
                     stream.write(datablock)
-                    self.dispatch(numpy.frombuffer(datablock,
-                                                   dtype=self.datatype))
-                except queue.Empty:
-                    pass
+                self.forward(datablock, instrumentation.now(), self.in_queue)
 
-        if((self.input_flag is True) and (self.filename is not None)):
-            print("save")
-            wf = wave.open(self.filename, 'wb')
-            wf.setnchannels(self.channel)
-            wf.setsampwidth(p.get_sample_size(self.pyaudio_format))
-            wf.setframerate(self.samplerate)
-            wf.writeframes(b''.join(self.frames))
-            wf.close()
+        self.stop_recording()
+
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
+class CallbackAudioStreamer(AudioStreamer):
+    '''AudioStreamer driven by PyAudio's stream_callback.
+
+    The callback only copies between the device and a SampleFifo, in
+    frames_per_buffer frames; the streamer thread fills (playback) or
+    drains (capture) the FIFO in buffersize blocks and does the dispatching.
+    Playback starts once prebuffer device buffers are queued, and primes
+    again after an underrun. Capture with monitor=True also plays the
+    input back from within the callback, so the round trip is about two
+    device buffers plus the driver's own latency. The defaults keep both
+    under 10 ms: 2 buffers of 128 frames are 5.8 ms at 44.1 kHz.
+
+    underruns counts device buffers that could not be filled, overruns
+    captured buffers that did not fit into the FIFO, see stats().
+    '''
+
+    def __init__(self, frames_per_buffer=128, prebuffer=2, fifo_buffers=32,
+                 monitor=False, *args, **kwargs):
+        super(CallbackAudioStreamer, self).__init__(*args, **kwargs)
+        self.frames_per_buffer = frames_per_buffer
+        self.prebuffer = prebuffer
+        self.monitor = monitor
+        capacity = max(fifo_buffers * self.frames_per_buffer,
+                       2 * self.buffersize)
+        self.fifo = ringbuffer.SampleFifo(capacity, self.channel, self.datatype)
+        self.fifo_event = threading.Event()
+        self.out_block = None
+        self.primed = False
+        self.underruns = 0
+        self.overruns = 0
+        self.latency = None
+
+    def stats(self):
+        return {'underruns': self.underruns, 'overruns': self.overruns,
+                'buffered': self.fifo.available, 'latency': self.latency}
+
+    def play_callback(self, in_data, frame_count, time_info, status):
+        pa = self.pyaudio_module
+        if(status & pa.paOutputUnderflow):
+            self.underruns += 1
+        if((self.out_block is None) or (len(self.out_block) != frame_count)):
+            self.out_block = numpy.zeros((frame_count, self.channel),
+                                         dtype=self.datatype)
+        out = self.out_block
+
+        if((self.primed is False) and
+           (self.fifo.available >= self.prebuffer * self.frames_per_buffer)):
+            self.primed = True
+        if(self.primed is False):
+            out[:] = 0
+            return (out.tobytes(), pa.paContinue)
+
+        n = self.fifo.read(out)
+        self.fifo_event.set()
+        if(n < frame_count):
+            out[n:] = 0
+            self.underruns += 1
+            self.primed = False
+        return (out.tobytes(), pa.paContinue)
+
+    def record_callback(self, in_data, frame_count, time_info, status):
+        pa = self.pyaudio_module
+        if(status & pa.paInputOverflow):
+            self.overruns += 1
+        frames = numpy.frombuffer(in_data, dtype=self.datatype)
+        if(self.fifo.write(frames) * self.channel < len(frames)):
+            self.overruns += 1
+        self.fifo_event.set()
+        if(self.monitor):
+            return (in_data, pa.paContinue)
+        return (None, pa.paContinue)
+
+    def wait_fifo(self, ready):
+        '''wait until ready() holds or the streamer is stopped'''
+        while(self.is_stopped() is False):
+            self.fifo_event.clear()
+            if(ready()):
+                return True
+            self.fifo_event.wait(self.poll_timeout)
+        return False
+
+    def capture(self):
+        while(self.wait_fifo(lambda: self.fifo.available >= self.buffersize)):
+            block = numpy.empty((self.buffersize, self.channel),
+                                dtype=self.datatype)
+            self.fifo.read(block)
+            timestamp = instrumentation.now()
+            self.record(block)
+            self.forward(block, timestamp)
+
+    def playback(self):
+        for datablock in self.consume():
+            if(isinstance(datablock, numpy.ndarray)):
+                frames = datablock.reshape(-1)
+            else:
+                frames = numpy.frombuffer(datablock, dtype=self.datatype)
+            frames = frames.reshape(-1, self.channel)
+            pos = 0
+            while(pos < len(frames)):
+                if(self.wait_fifo(lambda: self.fifo.free > 0) is False):
+                    break
+                pos += self.fifo.write(frames[pos:])
+            self.forward(datablock, instrumentation.now(), self.in_queue)
+
+    def run(self):
+        pa = self.load_pyaudio()
+        p = pa.PyAudio()
+        self.start_recording()
+        if(self.input_flag is True):
+            stream = p.open(format=self.pyaudio_format,
+                            channels=self.channel,
+                            rate=self.samplerate,
+                            input=True, output=self.monitor,
+                            frames_per_buffer=self.frames_per_buffer,
+                            stream_callback=self.record_callback)
+            self.latency = stream.get_input_latency()
+            if(self.monitor):
+                self.latency += stream.get_output_latency()
+            self.capture()
+        else:
+            stream = p.open(format=self.pyaudio_format,
+                            channels=self.channel,
+                            rate=self.samplerate,
+                            output=True,
+                            frames_per_buffer=self.frames_per_buffer,
+                            stream_callback=self.play_callback)
+            self.latency = stream.get_output_latency()
+            self.playback()
 
         stream.stop_stream()
         stream.close()
+        self.stop_recording()
         p.terminate()
@@ -2,12 +2,21 @@ import collections
 import numpy as np
 import time
 import audiomanager as am
+import customthreads as ct
 import mplot as mp
+import spectrumkernels as sk
 
 max_deque_size = 44100 * 20 
 acc_deque = collections.deque(maxlen=max_deque_size)
 analyzer_blocksize = 1024 
-audio_mgr = am.AudioManager(analyzer_blocksize)
+'''spectra leave the analyzer as log-spaced band powers in float32 dB,
+floored at a magnitude of 1 like the log10 scale the plots used before.
+The bins of a 1024 point analyzer are ~20 Hz apart and resolve only about
+100 of 128 log bands; the analyzer merges the rest (see band_centers)'''
+analyzer_bands = 128
+audio_mgr = am.AudioManager(analyzer_blocksize,
+                            analyzer_post_process=sk.Chain(sk.Decibel(floor=0.0)),
+                            analyzer_bands=analyzer_bands)
 
 if __name__ == '__main__':
 
@@ -20,42 +29,41 @@ if __name__ == '__main__':
                                  ylim=(dtypeinfo.min, dtypeinfo.max),
                                  redraw_interval = 0.2,
                                  max_size = max_deque_size,
+                                 display_width=1000,
+                                 zoom_levels=4,
+                                 dtype=audio_mgr.dtype,
                                  channel=channel,
                                  daemon=True)
 
-        freq_y_lim = (0, np.log10(analyzer_blocksize * dtypeinfo.max))
-        # freq_y_lim = (0, analyzer_blocksize * dtypeinfo.max)
-        freq_x_step = audio_mgr.samplerate / analyzer_blocksize
-        freq_x_lim = (-freq_x_step * analyzer_blocksize / 2,
-                      freq_x_step * analyzer_blocksize / 2)
-        freq_x_range = np.arange(freq_x_lim[0], freq_x_lim[1], freq_x_step)
+        freq_y_lim = (0, 20 * np.log10(analyzer_blocksize * dtypeinfo.max))
+        freq_x_range = audio_mgr.analyzer.band_centers
+        freq_x_lim = (0, audio_mgr.samplerate / 2)
 
 
         freq_plot = mp.DequeMPlot(xlim=freq_x_lim,
                                   ylim=freq_y_lim,
                                   x_range=freq_x_range,
-                                  max_size=analyzer_blocksize,
-                                  post_process=lambda d: np.log10(np.absolute(d)),
+                                  max_size=len(freq_x_range),
                                   channel=channel,
                                   daemon=True)
 
         # spectro_ystep = audio_mgr.samplerate / analyzer_blocksize
         # spectro_ylim = np.arange(-audio_mgr.samplerate/2, audio_mgr.samplerate/2, spectro_ystep)
-        data_max = np.log10(dtypeinfo.max * np.sqrt(analyzer_blocksize * 2))
+        data_max = 20 * np.log10(dtypeinfo.max * np.sqrt(analyzer_blocksize * 2))
 
         freq_plot2 = mp.SpectroMPlot(xlim=(0, 100),
                                      # ylim=(0, analyzer_blocksize * dtypeinfo.max),
                                      ylim = (0, data_max),
-                                     block_size=analyzer_blocksize,
-                                     post_process=lambda d: np.log10(d),
+                                     block_size=len(freq_x_range),
                                      channel=channel,
                                      daemon=True)
 
         # freq_plot2 = mp.SpectroMPlot(block_size=4096)
 
-        audio_mgr.streamer.register_queue(acc_plot.in_queue)
-        audio_mgr.analyzer.register_queue(freq_plot.in_queue)
-        audio_mgr.analyzer.register_queue(freq_plot2.in_queue)
+        '''plots may fall behind, but must never stall the audio pipeline'''
+        audio_mgr.connect(acc_plot, 'streamer', ct.DROP_OLDEST)
+        audio_mgr.connect(freq_plot, 'analyzer', ct.LATEST)
+        audio_mgr.connect(freq_plot2, 'analyzer', ct.DROP_OLDEST)
 
         acc_plot.start()
         freq_plot.start()
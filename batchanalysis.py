@@ -0,0 +1,206 @@
+import argparse
+import functools
+import multiprocessing
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import audiostreamer as ast
+import fftbackend
+import spectrumkernels
+import wavfile
+
+
+class BatchAnalyzer(object):
+    '''Offline counterpart of AudioAnalyzer: file in, spectrogram out.
+
+    Frames are taken like AudioAnalyzer's for the same
+    blocksize/overlap/hop_size (frame k after (k + 1) * hop_size samples,
+    with a zero history before the start of the file), but without
+    realtime pacing: they are computed chunk_frames at a time with one
+    windowed, batched rfft per chunk. The values only equal what an
+    AudioAnalyzer dispatches when both see the same samples in the same
+    dtype: dtype=np.float64 and normalize=False for an AudioAnalyzer with
+    its defaults, or normalize=True and the analyzer's dtype for one fed
+    by an AudioStreamer with compute_dtype set. The defaults (float32,
+    normalized) are meant for storing spectrograms compactly.
+
+    The result has shape (frames, channel, blocksize); complex spectra, or
+    their magnitude in dtype when magnitude=True. With bands (as for
+    AudioAnalyzer) it is the float32 mean power per band instead, of shape
+    (frames, channel, bands), and analyze() needs the samplerate.
+    fft_backend and fft_options are those of AudioAnalyzer.
+    '''
+
+    def __init__(self, blocksize=4096, overlap=1024, hop_size=None,
+                 dtype=np.float32, normalize=True, magnitude=False,
+                 fft_backend=None, chunk_frames=256, bands=None,
+                 fft_options=None):
+        self.blocksize = blocksize
+        self.overlap = overlap
+        self.hop_size = hop_size
+        if(self.hop_size is None):
+            self.hop_size = self.blocksize
+        if((isinstance(self.hop_size, (int, np.integer)) is False) or
+           (self.hop_size <= 0)):
+            raise ValueError("hop_size must be a positive int, not %r"
+                             % (hop_size,))
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = np.result_type(self.dtype, np.complex64)
+        self.normalize = normalize
+        self.magnitude = magnitude
+        if(fft_options is None):
+            fft_options = {}
+        self.backend = fftbackend.get_backend(fft_backend, **fft_options)
+        self.chunk_frames = chunk_frames
+        self.bands = bands
+        self.reduction = None
+        self.band_centers = None
+        self.samplerate = None
+
+        self.window = np.hanning(self.blocksize).astype(self.dtype)
+        '''distance from the newest sample back to the start of the
+        analyzed block, as in STFT.compute()'''
+        self.lead = self.blocksize + self.overlap - self.overlap // 2
+
+    @property
+    def out_dtype(self):
+        if(self.bands is not None):
+            return np.dtype(np.float32)
+        if(self.magnitude):
+            return self.dtype
+        return self.complex_dtype
+
+    def set_samplerate(self, samplerate):
+        '''build the band reduction for samplerate, once per rate'''
+        if((self.bands is None) or (samplerate == self.samplerate)):
+            return
+        if(samplerate is None):
+            if(self.reduction is not None):
+                return
+            raise ValueError("band reduction needs the samplerate")
+        self.samplerate = samplerate
+        self.reduction, self.band_centers = spectrumkernels.band_reduction(
+            self.bands, self.blocksize, samplerate)
+
+    def out_bins(self):
+        '''values per channel and frame'''
+        if(self.reduction is not None):
+            return len(self.band_centers)
+        return self.blocksize
+
+    def frame_count(self, samples):
+        return samples // self.hop_size
+
+    def read_planar(self, data, start, end):
+        '''(channel x n) samples start:end of a (frames x channel) array,
+        zero filled outside the file'''
+        planar = np.zeros((data.shape[1], end - start), dtype=self.dtype)
+        lo = max(start, 0)
+        hi = min(end, data.shape[0])
+        if(hi > lo):
+            block = data[lo:hi]
+            if(self.normalize):
+                block = ast.normalize(block, self.dtype)
+            planar[:, lo - start:hi - start] = block.T
+        return planar
+
+    def analyze(self, data, out=None, samplerate=None):
+        '''spectrogram of a (frames x channel) sample array, e.g. a memmap'''
+        self.set_samplerate(samplerate)
+        channel = data.shape[1]
+        count = self.frame_count(data.shape[0])
+        if(out is None):
+            out = np.empty((count, channel, self.out_bins()), dtype=self.out_dtype)
+
+        frame = None
+        spectrum = None
+        for first in range(0, count, self.chunk_frames):
+            last = min(first + self.chunk_frames, count)
+            nframes = last - first
+            start = (first + 1) * self.hop_size - self.lead
+            end = last * self.hop_size - self.lead + self.blocksize
+            planar = self.read_planar(data, start, end)
+
+            '''(channel, nframes, blocksize) strided view, no copy'''
+            blocks = sliding_window_view(planar, self.blocksize, axis=1)[:, ::self.hop_size]
+            if((frame is None) or (frame.shape[1] != nframes)):
+                frame = np.zeros((channel, nframes, 2 * self.blocksize),
+                                 dtype=self.dtype)
+                spectrum = np.empty((channel, nframes, self.blocksize + 1),
+                                    dtype=self.complex_dtype)
+            np.multiply(blocks, self.window, out=frame[:, :, :self.blocksize])
+            self.backend.rfft(frame.reshape(channel * nframes, -1),
+                              out=spectrum.reshape(channel * nframes, -1))
+
+            result = spectrum[:, :, :self.blocksize].transpose(1, 0, 2)
+            if(self.reduction is not None):
+                out[first:last] = self.reduction(result)
+            elif(self.magnitude):
+                np.absolute(result, out=out[first:last])
+            else:
+                out[first:last] = result
+        return out
+
+    def analyze_file(self, filename, out_filename=None):
+        '''spectrogram of a WAV file, written to an .npy memmap if out_filename is given'''
+        info, data = wavfile.open_memmap(filename)
+        self.set_samplerate(info.samplerate)
+        out = None
+        if(out_filename is not None):
+            shape = (self.frame_count(info.frames), info.channel, self.out_bins())
+            out = np.lib.format.open_memmap(out_filename, mode='w+',
+                                            dtype=self.out_dtype, shape=shape)
+        out = self.analyze(data, out, info.samplerate)
+        if(out_filename is not None):
+            out.flush()
+        return out
+
+
+def _analyze_one(paths, options):
+    src, dst = paths
+    BatchAnalyzer(**options).analyze_file(src, dst)
+    return dst
+
+
+def analyze_directory(src_dir, dst_dir, processes=None, **options):
+    '''write <name>.npy into dst_dir for every .wav in src_dir, one file per pool task'''
+    if(os.path.isdir(dst_dir) is False):
+        os.makedirs(dst_dir)
+    jobs = []
+    for name in sorted(os.listdir(src_dir)):
+        root, ext = os.path.splitext(name)
+        if(ext.lower() == '.wav'):
+            jobs.append((os.path.join(src_dir, name),
+                         os.path.join(dst_dir, root + '.npy')))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(functools.partial(_analyze_one, options=options), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="precompute spectrograms of WAV files")
+    parser.add_argument('src', help="WAV file or directory of WAV files")
+    parser.add_argument('dst', help=".npy file or output directory")
+    parser.add_argument('--blocksize', type=int, default=4096)
+    parser.add_argument('--overlap', type=int, default=1024)
+    parser.add_argument('--hop-size', type=int, default=None)
+    parser.add_argument('--magnitude', action='store_true')
+    parser.add_argument('--bands', default=None,
+                        help="mean power in this many log-spaced bands, "
+                        "or in 'octave' or 'third-octave' bands")
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    options = {'blocksize': args.blocksize, 'overlap': args.overlap,
+               'hop_size': args.hop_size, 'magnitude': args.magnitude,
+               'fft_backend': args.backend, 'bands': args.bands}
+    if(os.path.isdir(args.src)):
+        analyze_directory(args.src, args.dst, args.processes, **options)
+    else:
+        BatchAnalyzer(**options).analyze_file(args.src, args.dst)
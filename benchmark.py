@@ -0,0 +1,197 @@
+'''Headless benchmarks of the audio -> analysis -> render pipeline.
+
+Needs neither an audio device nor a display: samples come from a
+synthetic signal played through AudioBuffer and plots render on the Agg
+backend. Results are written as JSON for comparing runs, e.g.
+
+    python benchmark.py --output before.json
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+import audioanalyzer as aa
+import audiostreamer as ast
+import customthreads as ct
+import mplot
+
+'''block sizes of audiovisualizer.py and qt_audiovisualizer.py'''
+blocksizes = (1024, 4096)
+
+
+def synthetic_signal(samplerate, channel, seconds, dtype=np.int16):
+    '''interleaved test signal: a few sines per channel plus noise'''
+    rng = np.random.default_rng(0)
+    t = np.arange(int(samplerate * seconds)) / float(samplerate)
+    planar = np.empty((channel, len(t)))
+    for c in range(channel):
+        planar[c] = (0.4 * np.sin(2 * np.pi * 440.0 * (c + 1) * t) +
+                     0.2 * np.sin(2 * np.pi * 3000.0 * t) +
+                     0.05 * rng.standard_normal(len(t)))
+    info = np.iinfo(dtype)
+    return ast.merge_channel((planar * info.max).astype(dtype))
+
+
+def bench_analyzer(samplerate, channel, blocksize, seconds, hop_size=None,
+                   streamer_block=1024):
+    '''frames/s of an AudioAnalyzer process fed by AudioBuffer as fast as
+    the queues allow'''
+    signal = synthetic_signal(samplerate, channel, seconds)
+    analyzer = aa.AudioAnalyzer(blocksize=blocksize, channel=channel,
+                                hop_size=hop_size, daemon=True)
+    out_queue = multiprocessing.Queue(ct.QUEUE_SIZE)
+    analyzer.register_queue(out_queue)
+    source = ast.AudioBuffer(signal, blocksize=streamer_block * channel,
+                             daemon=True)
+    source.register_queue(analyzer.in_queue)
+    expected = (len(signal) // channel) // analyzer.hop_size
+
+    analyzer.start()
+    start = time.perf_counter()
+    source.start()
+    received = 0
+    try:
+        while(received < expected):
+            out_queue.get(timeout=30)
+            received += 1
+    except queue.Empty:
+        pass
+    elapsed = time.perf_counter() - start
+    source.immediate_join()
+    analyzer.immediate_join()
+
+    process = analyzer.stage_stats.process.snapshot()
+    return {'benchmark': 'analyzer', 'samplerate': samplerate,
+            'channel': channel, 'blocksize': blocksize,
+            'hop_size': analyzer.hop_size, 'frames': received,
+            'frames_per_second': received / elapsed,
+            'realtime_factor': (received * analyzer.hop_size / float(samplerate)) / elapsed,
+            'process_mean_seconds': process['mean']}
+
+
+class _EchoProcess(ct.QueueConsumer, ct.StoppableProcess, ct.DispatcherProcess):
+    '''dispatches every block it receives straight back'''
+
+    def __init__(self, *args, **kwargs):
+        super(_EchoProcess, self).__init__(*args, **kwargs)
+        self.in_queue = multiprocessing.Queue(ct.QUEUE_SIZE)
+
+    def run(self):
+        for data in self.consume():
+            self.dispatch(data)
+
+
+def bench_ipc(channel, blocksize, blocks, dtype=np.float64):
+    '''seconds per block for a round trip through a DispatcherProcess'''
+    echo = _EchoProcess(daemon=True)
+    back = multiprocessing.Queue(ct.QUEUE_SIZE)
+    echo.register_queue(back)
+    echo.start()
+    block = np.zeros(blocksize * channel, dtype=dtype)
+
+    '''one block in flight at a time, so queueing does not hide the cost'''
+    echo.in_queue.put(block)
+    back.get()
+    start = time.perf_counter()
+    for i in range(blocks):
+        echo.in_queue.put(block)
+        back.get()
+    elapsed = time.perf_counter() - start
+    echo.immediate_join()
+    return {'benchmark': 'ipc', 'channel': channel, 'blocksize': blocksize,
+            'dtype': np.dtype(dtype).name, 'bytes': block.nbytes,
+            'round_trip_seconds': elapsed / blocks}
+
+
+def bench_render(plot, frames, data):
+    '''frames/s of one plot object, ingesting data[i % len(data)] and
+    rendering after every block, without starting its process'''
+    with warnings.catch_warnings():
+        '''Agg cannot show() a figure, which is what we want here'''
+        warnings.simplefilter('ignore', UserWarning)
+        plot.init_plot()
+    plot.ingest(data[0])
+    plot.redraw()
+    start = time.perf_counter()
+    for i in range(frames):
+        plot.ingest(data[i % len(data)])
+        plot.redraw()
+    elapsed = time.perf_counter() - start
+    mplot.plt.close(plot.fig)
+    return frames / elapsed
+
+
+def bench_plots(channel, blocksize, frames):
+    rng = np.random.default_rng(0)
+    results = []
+
+    samples = [rng.standard_normal(blocksize * channel) for i in range(8)]
+    plot = mplot.MPlot(xlim=(0, blocksize), ylim=(-4, 4), channel=channel)
+    results.append(('MPlot', bench_render(plot, frames, samples)))
+
+    history = 44100 * 20
+    plot = mplot.DequeMPlot(xlim=(0, history), ylim=(-4, 4), channel=channel,
+                            max_size=history, display_width=1000)
+    results.append(('DequeMPlot', bench_render(plot, frames, samples)))
+
+    spectra = [np.abs(rng.standard_normal(blocksize * channel)) + 1e-3
+               for i in range(8)]
+    plot = mplot.SpectroMPlot(xlim=(0, 100), ylim=(-3, 1), channel=channel,
+                              block_size=blocksize, post_process=np.log10)
+    results.append(('SpectroMPlot', bench_render(plot, frames, spectra)))
+
+    return [{'benchmark': 'render', 'plot': name, 'channel': channel,
+             'blocksize': blocksize, 'frames': frames, 'fps': fps}
+            for name, fps in results]
+
+
+def environment():
+    return {'python': sys.version.split()[0], 'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark the visualizer pipeline headlessly")
+    parser.add_argument('--samplerates', type=int, nargs='+', default=[44100])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--blocksizes', type=int, nargs='+', default=list(blocksizes))
+    parser.add_argument('--seconds', type=float, default=10.0,
+                        help="length of the synthetic signal per analyzer run")
+    parser.add_argument('--ipc-blocks', type=int, default=500)
+    parser.add_argument('--frames', type=int, default=100,
+                        help="frames rendered per plot")
+    parser.add_argument('--only', choices=('analyzer', 'ipc', 'render'),
+                        nargs='+', default=['analyzer', 'ipc', 'render'])
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    results = []
+    for blocksize in args.blocksizes:
+        for channel in args.channels:
+            first = len(results)
+            if('analyzer' in args.only):
+                for samplerate in args.samplerates:
+                    results.append(bench_analyzer(samplerate, channel,
+                                                  blocksize, args.seconds))
+            if('ipc' in args.only):
+                results.append(bench_ipc(channel, blocksize, args.ipc_blocks))
+            if('render' in args.only):
+                results.extend(bench_plots(channel, blocksize, args.frames))
+            for result in results[first:]:
+                print(json.dumps(result, sort_keys=True))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2, sort_keys=True)
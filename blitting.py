@@ -0,0 +1,49 @@
+class BlitManager(object):
+    '''Redraws a fixed set of animated artists over a cached background.
+
+    A full canvas.draw() renders axes, ticks and labels once and fires a
+    draw_event, on which the static background is captured. After that,
+    update() only restores the background, draws the registered artists and
+    blits the figure area. Any later full draw (e.g. on resize) refreshes
+    the cached background.
+
+    Set event_loop=True when update() is called from the canvas' own GUI
+    event loop (e.g. a QTimer): the first full draw is then deferred with
+    draw_idle() and pending events are left to the loop.
+    '''
+
+    def __init__(self, canvas, artists=(), event_loop=False):
+        self.canvas = canvas
+        self.event_loop = event_loop
+        self.background = None
+        self.artists = []
+        self.set_artists(artists)
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def set_artists(self, artists):
+        for artist in artists:
+            artist.set_animated(True)
+        self.artists = list(artists)
+        self.background = None
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        figure = self.canvas.figure
+        for artist in self.artists:
+            figure.draw_artist(artist)
+
+    def update(self):
+        if(self.background is None):
+            if(self.event_loop):
+                self.canvas.draw_idle()
+                return
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.canvas.figure.bbox)
+        if(self.event_loop is False):
+            self.canvas.flush_events()
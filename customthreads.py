@@ -1,5 +1,21 @@
 import multiprocessing
+import multiprocessing.queues
+import pickle
 import threading
+import queue
+
+'''put into a consumer's in_queue to wake it up without delivering data'''
+WAKEUP = None
+
+'''what dispatch() does when a subscriber's bounded queue is full'''
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+LATEST = 'latest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, LATEST)
+
+'''default maxsize of consumer in_queues'''
+QUEUE_SIZE = 32
 
 
 class StoppableThread(threading.Thread):
@@ -21,17 +37,216 @@ class StoppableThread(threading.Thread):
         self.join()
 
 
-class DispatcherThread(threading.Thread):
-    def __init__(self, *args, **kwargs):
-        super(DispatcherThread, self).__init__(*args, **kwargs)
-        self._queuelist = []
+class PickledBlock(object):
+    '''A block pickled once by a dispatcher and put as is into all of its
+    multiprocessing queues, so each of them only copies bytes instead of
+    pickling the block again; QueueConsumer.consume() unpickles it.'''
+    __slots__ = ('payload',)
+
+    def __init__(self, data):
+        self.payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def __getstate__(self):
+        return self.payload
+
+    def __setstate__(self, payload):
+        self.payload = payload
+
+    def load(self):
+        return pickle.loads(self.payload)
+
+
+class QueueConsumer(object):
+    '''Mixin for stoppable threads/processes reading blocks from self.in_queue.
+
+    Waits on the queue instead of polling it, so an idle stage does not burn
+    a core. stop() pushes WAKEUP into the queue so a blocked consumer
+    notices the stop flag immediately; poll_timeout only bounds the wait when
+    the wakeup cannot be delivered (e.g. a full bounded queue). idle() is
+    called whenever poll_timeout passes without a block.
+
+    A consumer that subscribe()s to a dispatcher reads through its
+    Subscription, which applies the DROP_OLDEST and LATEST policies on
+    this side of the queue.
+    '''
+    poll_timeout = 0.5
+    subscription = None
+
+    def idle(self):
+        pass
+
+    def stop(self):
+        super(QueueConsumer, self).stop()
+        self.wakeup()
+
+    def subscribe(self, dispatcher, policy=BLOCK, every=1):
+        '''register in_queue with dispatcher; returns the Subscription'''
+        self.subscription = dispatcher.register_queue(self.in_queue, policy,
+                                                      every)
+        return self.subscription
+
+    def wakeup(self):
+        try:
+            self.in_queue.put_nowait(WAKEUP)
+        except (AttributeError, queue.Full):
+            pass
+
+    def consume(self):
+        '''yield blocks from in_queue until the stop flag is set'''
+        while(self.is_stopped() is False):
+            try:
+                if(self.subscription is None):
+                    data = self.in_queue.get(timeout=self.poll_timeout)
+                else:
+                    data = self.subscription.get(timeout=self.poll_timeout)
+            except queue.Empty:
+                self.idle()
+                continue
+            if(data is WAKEUP):
+                continue
+            if(isinstance(data, PickledBlock)):
+                data = data.load()
+            yield data
+
+
+class Subscription(object):
+    '''A dispatcher's queue together with its overflow policy.
+
+    BLOCK waits for room (in put_timeout steps, giving up once the
+    dispatcher is stopped). With any other policy put() never waits: a
+    block that finds the queue full is dropped. Only BLOCK can stall the
+    dispatcher; use one of the others for subscribers that must not hold
+    up audio I/O. With every=N only every Nth dispatched block is offered
+    to the queue.
+
+    The dispatcher never takes blocks out of a queue, which would make it
+    receive (and unpickle) them just to throw them away. Making room is
+    up to the consumer, reading through get() (see
+    QueueConsumer.subscribe()): with DROP_OLDEST it discards the oldest
+    queued blocks while the queue is full, with LATEST it skips to the
+    newest queued block. DROP_NEWEST only drops incoming blocks.
 
-    def register_queue(self, q):
-        self._queuelist.append(q)
+    The counters live in shared memory, so they stay readable from the
+    parent when the dispatcher or the consumer is a process; each side
+    counts its drops in its own slot.
+    '''
+    put_timeout = 0.1
+
+    def __init__(self, q, policy=BLOCK, every=1):
+        if(policy not in POLICIES):
+            raise ValueError("unknown queue policy %r" % (policy,))
+        self.queue = q
+        self.policy = policy
+        self.every = every
+        self.offered = 0
+        '''blocks for another process are pickled; see PickledBlock'''
+        self.cross_process = isinstance(q, multiprocessing.queues.Queue)
+        '''dispatched, dropped by put(), dropped by get()'''
+        self.counters = multiprocessing.RawArray('Q', 3)
+
+    def due(self):
+        '''whether the current block is one of every `every`'''
+        due = (self.offered % self.every == 0)
+        self.offered += 1
+        return due
+
+    @property
+    def dispatched(self):
+        return self.counters[0]
+
+    @property
+    def dropped(self):
+        return self.counters[1] + self.counters[2]
+
+    def stats(self):
+        return {'policy': self.policy, 'every': self.every,
+                'dispatched': self.dispatched, 'dropped': self.dropped}
+
+    def put(self, data, is_stopped):
+        if(self.policy == BLOCK):
+            while(is_stopped() is False):
+                try:
+                    self.queue.put(data, timeout=self.put_timeout)
+                except queue.Full:
+                    continue
+                self.counters[0] += 1
+                return True
+            return False
+
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            self.counters[1] += 1
+            return False
+        self.counters[0] += 1
+        return True
+
+    def get(self, timeout=None):
+        '''consumer side: the next block to process; WAKEUP is passed on'''
+        if(self.policy == DROP_OLDEST):
+            while(self.queue.full()):
+                try:
+                    stale = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if(stale is WAKEUP):
+                    return stale
+                self.counters[2] += 1
+        data = self.queue.get(timeout=timeout)
+        if(self.policy == LATEST):
+            while(data is not WAKEUP):
+                try:
+                    newer = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.counters[2] += 1
+                data = newer
+        return data
+
+
+class _Dispatcher(object):
+    '''register_queue()/dispatch() shared by DispatcherThread and
+    DispatcherProcess.
+
+    dispatch() hands thread queues the block itself and, when there is
+    more than one multiprocessing queue, pickles the block only once for
+    all of them. To fan out to many processes at no cost per subscriber,
+    register one sharedring.SharedRing and give every consumer its own
+    reader() instead.
+    '''
+
+    def register_queue(self, q, policy=BLOCK, every=1):
+        '''q is anything with put()/put_nowait(), e.g. a (multiprocessing)
+        Queue or a sharedring.SharedRing; returns its Subscription'''
+        subscription = Subscription(q, policy, every)
+        self._queuelist.append(subscription)
+        return subscription
+
+    def is_stopped(self):
+        '''overridden by StoppableThread/StoppableProcess when mixed in'''
+        return False
 
     def dispatch(self, data):
-        for q in self._queuelist:
-            q.put(data)
+        cross_process = [s for s in self._queuelist if s.cross_process]
+        shared = None
+        for subscription in self._queuelist:
+            if(subscription.due() is False):
+                continue
+            item = data
+            if(subscription.cross_process and (len(cross_process) > 1)):
+                if(shared is None):
+                    shared = PickledBlock(data)
+                item = shared
+            subscription.put(item, self.is_stopped)
+
+    def queue_stats(self):
+        return [subscription.stats() for subscription in self._queuelist]
+
+
+class DispatcherThread(_Dispatcher, threading.Thread):
+    def __init__(self, *args, **kwargs):
+        super(DispatcherThread, self).__init__(*args, **kwargs)
+        self._queuelist = []
 
 
 class StoppableProcess(multiprocessing.Process):
@@ -53,15 +268,8 @@ class StoppableProcess(multiprocessing.Process):
         self.join()
 
 
-class DispatcherProcess(multiprocessing.Process):
+class DispatcherProcess(_Dispatcher, multiprocessing.Process):
 
     def __init__(self, *args, **kwargs):
         super(DispatcherProcess, self).__init__(*args, **kwargs)
         self._queuelist = []
-
-    def register_queue(self, q):
-        self._queuelist.append(q)
-
-    def dispatch(self, data):
-        for q in self._queuelist:
-            q.put(data)
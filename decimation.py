@@ -0,0 +1,114 @@
+import numpy as np
+import ringbuffer
+
+
+class _EnvelopeLevel(object):
+    '''reduces incoming (min, max) columns by `factor` into its own ring'''
+
+    def __init__(self, factor, columns, channel, dtype):
+        self.factor = factor
+        self.mins = ringbuffer.RingBuffer(columns, channel, dtype, mirrored=True)
+        self.maxs = ringbuffer.RingBuffer(columns, channel, dtype, mirrored=True)
+        self.pending_min = np.zeros((channel, factor), dtype=dtype)
+        self.pending_max = np.zeros((channel, factor), dtype=dtype)
+        self.pending = 0
+
+    def push(self, mins, maxs):
+        '''add columns; returns the (mins, maxs) columns this level completed'''
+        factor = self.factor
+        n = mins.shape[1]
+        pos = 0
+        done_min = []
+        done_max = []
+
+        if(self.pending > 0):
+            take = min(n, factor - self.pending)
+            self.pending_min[:, self.pending:self.pending + take] = mins[:, :take]
+            self.pending_max[:, self.pending:self.pending + take] = maxs[:, :take]
+            self.pending += take
+            pos = take
+            if(self.pending < factor):
+                return None
+            done_min.append(self.pending_min.min(axis=1)[:, np.newaxis])
+            done_max.append(self.pending_max.max(axis=1)[:, np.newaxis])
+            self.pending = 0
+
+        full = (n - pos) // factor
+        if(full > 0):
+            body = slice(pos, pos + full * factor)
+            shape = (mins.shape[0], full, factor)
+            done_min.append(mins[:, body].reshape(shape).min(axis=2))
+            done_max.append(maxs[:, body].reshape(shape).max(axis=2))
+            pos += full * factor
+
+        rest = n - pos
+        if(rest > 0):
+            self.pending_min[:, :rest] = mins[:, pos:]
+            self.pending_max[:, :rest] = maxs[:, pos:]
+            self.pending = rest
+
+        if(len(done_min) == 0):
+            return None
+        if(len(done_min) == 1):
+            done = (done_min[0], done_max[0])
+        else:
+            done = (np.concatenate(done_min, axis=1),
+                    np.concatenate(done_max, axis=1))
+        self.mins.extend(done[0])
+        self.maxs.extend(done[1])
+        return done
+
+
+class EnvelopeBuffer(object):
+    '''Per-pixel-column min/max envelope of the last `size` samples.
+
+    Level 0 summarizes the whole history in `columns` columns; level k
+    shows the newest size / 2**k samples at the same column count, for
+    zoomed views. Only the finest level sees raw samples, each coarser
+    level is built from pairs of columns of the one below, so extend()
+    costs O(samples) once and drawing costs O(columns) regardless of the
+    history length.
+    '''
+
+    def __init__(self, size, columns, channel=1, levels=1, dtype=np.float64):
+        self.channel = channel
+        self.levels = levels
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+
+        '''samples per column at the finest (most zoomed) level'''
+        finest_bucket = max(1, size // (columns * 2 ** (levels - 1)))
+        self.buckets = [finest_bucket * 2 ** (levels - 1 - k) for k in range(levels)]
+        self.size = self.buckets[0] * columns
+
+        '''finest first: the order in which extend() feeds them'''
+        self.chain = [_EnvelopeLevel(finest_bucket, columns * 2 ** (levels - 1),
+                                     channel, self.dtype)]
+        for k in range(levels - 2, -1, -1):
+            self.chain.append(_EnvelopeLevel(2, columns * 2 ** k,
+                                             channel, self.dtype))
+
+        self.display = np.zeros((channel, 2 * columns), dtype=self.dtype)
+
+    def extend(self, planar):
+        '''add a (channel x n) block of samples'''
+        planar = np.asarray(planar, dtype=self.dtype)
+        done = (planar, planar)
+        for level in self.chain:
+            done = level.push(*done)
+            if(done is None):
+                break
+
+    def x_values(self, xlim, level=0):
+        '''x positions matching envelope(level), two points per column'''
+        span = (xlim[1] - xlim[0]) / 2 ** level
+        x = np.linspace(xlim[1] - span, xlim[1], self.columns)
+        return np.repeat(x, 2)
+
+    def envelope(self, level=0):
+        '''(channel x 2*columns) interleaved min/max of the newest columns;
+        the returned array is reused'''
+        chain_level = self.chain[self.levels - 1 - level]
+        self.display[:, 0::2] = chain_level.mins.latest(self.columns)
+        self.display[:, 1::2] = chain_level.maxs.latest(self.columns)
+        return self.display
@@ -0,0 +1,170 @@
+'''Stand-in for the pyaudio module on machines without audio devices.
+
+Pass it as AudioStreamer(pyaudio_module=fakepyaudio) (or to
+CallbackAudioStreamer). Input streams produce a sine tone, output streams
+keep the most recent blocks they were given in Stream.played. Callback
+streams call stream_callback from their own thread, paced like a sound
+card unless `realtime` is False.
+'''
+import collections
+import threading
+import time
+import numpy
+
+paFloat32 = 1
+paInt32 = 2
+paInt24 = 4
+paInt16 = 8
+paInt8 = 16
+paUInt8 = 32
+
+paContinue = 0
+paComplete = 1
+paAbort = 2
+
+paInputUnderflow = 1
+paInputOverflow = 2
+paOutputUnderflow = 4
+paOutputOverflow = 8
+paPrimingOutput = 16
+
+realtime = True
+input_frequency = 440.0
+'''output blocks kept per stream'''
+played_blocks = 256
+
+dic_format_to_numpy_dtype = {paFloat32: numpy.float32,
+                             paInt32: numpy.int32,
+                             paInt16: numpy.int16,
+                             paInt8: numpy.int8,
+                             paUInt8: numpy.uint8}
+
+
+def get_sample_size(format):
+    if(format == paInt24):
+        return 3
+    return numpy.dtype(dic_format_to_numpy_dtype[format]).itemsize
+
+
+class Stream(object):
+    def __init__(self, format, channels, rate, input=False, output=False,
+                 frames_per_buffer=1024, stream_callback=None, start=True,
+                 **kwargs):
+        self.dtype = numpy.dtype(dic_format_to_numpy_dtype[format])
+        self.channels = channels
+        self.rate = rate
+        self.input = input
+        self.output = output
+        self.frames_per_buffer = frames_per_buffer
+        self.stream_callback = stream_callback
+        self.played = collections.deque(maxlen=played_blocks)
+        self.frames_played = 0
+        self.input_position = 0
+        self.active = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        if(start):
+            self.start_stream()
+
+    def generate(self, frame_count):
+        '''the next frame_count frames of the input tone, as bytes'''
+        t = (self.input_position + numpy.arange(frame_count)) / float(self.rate)
+        self.input_position += frame_count
+        tone = 0.5 * numpy.sin(2 * numpy.pi * input_frequency * t)
+        if(self.dtype.kind == 'f'):
+            samples = tone.astype(self.dtype)
+        else:
+            info = numpy.iinfo(self.dtype)
+            middle = (int(info.max) + int(info.min) + 1) // 2
+            samples = (tone * (info.max - middle) + middle).astype(self.dtype)
+        return numpy.repeat(samples, self.channels).tobytes()
+
+    def play(self, data):
+        self.played.append(data)
+        self.frames_played += len(data) // (self.dtype.itemsize * self.channels)
+
+    def wait(self, frame_count):
+        if(realtime):
+            time.sleep(frame_count / float(self.rate))
+
+    def run_callback(self):
+        deadline = time.monotonic()
+        status = 0
+        while(self.stop_event.is_set() is False):
+            in_data = None
+            if(self.input):
+                in_data = self.generate(self.frames_per_buffer)
+            time_info = {'input_buffer_adc_time': 0.0,
+                         'current_time': time.monotonic(),
+                         'output_buffer_dac_time': 0.0}
+            out_data, flag = self.stream_callback(in_data,
+                                                  self.frames_per_buffer,
+                                                  time_info, status)
+            if(self.output and (out_data is not None)):
+                self.play(out_data)
+            if(flag != paContinue):
+                break
+
+            if(realtime):
+                deadline += self.frames_per_buffer / float(self.rate)
+                delay = deadline - time.monotonic()
+                status = 0
+                if(delay > 0):
+                    self.stop_event.wait(delay)
+                else:
+                    '''the callback took longer than a buffer'''
+                    status = paOutputUnderflow if self.output else paInputOverflow
+        self.active = False
+
+    def start_stream(self):
+        self.active = True
+        if(self.stream_callback is not None):
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run_callback, daemon=True)
+            self.thread.start()
+
+    def stop_stream(self):
+        self.stop_event.set()
+        if((self.thread is not None) and
+           (self.thread is not threading.current_thread())):
+            self.thread.join()
+        self.thread = None
+        self.active = False
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.stop_stream()
+
+    def read(self, num_frames, exception_on_overflow=True):
+        self.wait(num_frames)
+        return self.generate(num_frames)
+
+    def write(self, frames, num_frames=None, exception_on_underflow=False):
+        self.play(frames)
+        self.wait(len(frames) // (self.dtype.itemsize * self.channels))
+
+    def get_input_latency(self):
+        return self.frames_per_buffer / float(self.rate)
+
+    def get_output_latency(self):
+        return self.frames_per_buffer / float(self.rate)
+
+
+class PyAudio(object):
+    def __init__(self):
+        self.streams = []
+
+    def open(self, *args, **kwargs):
+        stream = Stream(*args, **kwargs)
+        self.streams.append(stream)
+        return stream
+
+    def get_sample_size(self, format):
+        return get_sample_size(format)
+
+    def terminate(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
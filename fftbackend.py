@@ -0,0 +1,182 @@
+import warnings
+import numpy as np
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+
+backends = {}
+'''first available backend wins when none is requested explicitly'''
+preference = ('pyfftw', 'scipy', 'numpy')
+
+
+def register_backend(cls):
+    backends[cls.name] = cls
+    return cls
+
+
+def available_backends():
+    return [name for name in preference
+            if (name in backends) and backends[name].available()]
+
+
+def get_backend(backend=None, **kwargs):
+    '''return a backend instance for a name, an instance, or None for the
+    best one; kwargs are options of the named backend, e.g. workers for
+    scipy or threads and planner_effort for pyfftw'''
+    if((backend is not None) and not isinstance(backend, str)):
+        return backend
+    if(backend is None):
+        if(kwargs):
+            raise ValueError("FFT backend options %s need a backend name"
+                             % sorted(kwargs))
+        backend = available_backends()[0]
+
+    cls = backends[backend]
+    if(cls.available() is False):
+        warnings.warn("FFT backend '%s' is not installed, using numpy" % backend)
+        cls = NumpyBackend
+        kwargs = {}
+    return cls(**kwargs)
+
+
+def _complex_dtype(dtype):
+    return np.result_type(dtype, np.complex64)
+
+
+@register_backend
+class NumpyBackend(object):
+    '''np.fft; always available, no plans to cache'''
+    name = 'numpy'
+
+    @staticmethod
+    def available():
+        return True
+
+    def prepare(self, shape, dtype):
+        '''nothing to plan'''
+        pass
+
+    def rfft(self, x, out=None):
+        '''rfft along the last axis of x, written into out if given'''
+        result = np.fft.rfft(x, axis=-1)
+        if(out is None):
+            return result
+        out[...] = result
+        return out
+
+
+@register_backend
+class ScipyBackend(object):
+    '''scipy.fft, which keeps its own plan cache; workers > 1 splits the
+    rows (channels) of a batched transform across threads'''
+    name = 'scipy'
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.prepared = []
+
+    @staticmethod
+    def available():
+        return scipy_fft is not None
+
+    def __setstate__(self, state):
+        '''the plan cache is per process: fill it again on unpickling'''
+        self.__dict__.update(state)
+        for shape, dtype in self.prepared:
+            self.rfft(np.zeros(shape, dtype=dtype))
+
+    def prepare(self, shape, dtype):
+        '''run one transform of this shape, so that its plan is cached
+        before the first frame'''
+        self.prepared.append((tuple(shape), np.dtype(dtype).str))
+        self.rfft(np.zeros(shape, dtype=dtype))
+
+    def rfft(self, x, out=None):
+        result = scipy_fft.rfft(x, axis=-1, workers=self.workers)
+        if(out is None):
+            return result
+        out[...] = result
+        return out
+
+
+@register_backend
+class PyfftwBackend(object):
+    '''FFTW through pyfftw, with one plan per (size, dtype, channels)'''
+    name = 'pyfftw'
+
+    def __init__(self, threads=1, planner_effort='FFTW_MEASURE'):
+        self.threads = threads
+        self.planner_effort = planner_effort
+        self.plans = {}
+
+    @staticmethod
+    def available():
+        return pyfftw is not None
+
+    def __getstate__(self):
+        '''plans hold aligned buffers and cannot be pickled; they are
+        rebuilt on unpickling, from the wisdom gathered so far'''
+        state = self.__dict__.copy()
+        state['plans'] = [(key[2] + (key[0],), key[1]) for key in self.plans]
+        state['wisdom'] = export_wisdom()
+        return state
+
+    def __setstate__(self, state):
+        plans = state.pop('plans')
+        import_wisdom(state.pop('wisdom'))
+        self.__dict__.update(state)
+        self.plans = {}
+        for shape, dtype in plans:
+            self.plan(shape, dtype)
+
+    def prepare(self, shape, dtype):
+        '''plan the transform now; with FFTW_MEASURE or slower this takes
+        a while and should not happen on the first frame'''
+        self.plan(tuple(shape), dtype)
+
+    def plan(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        key = (shape[-1], dtype.str, shape[:-1])
+        fftw = self.plans.get(key)
+        if(fftw is None):
+            in_array = pyfftw.empty_aligned(shape, dtype=dtype)
+            out_shape = shape[:-1] + (shape[-1] // 2 + 1,)
+            out_array = pyfftw.empty_aligned(out_shape,
+                                             dtype=_complex_dtype(dtype))
+            fftw = pyfftw.FFTW(in_array, out_array, axes=(-1,),
+                               direction='FFTW_FORWARD',
+                               flags=(self.planner_effort,),
+                               threads=self.threads)
+            self.plans[key] = fftw
+        return fftw
+
+    def rfft(self, x, out=None):
+        '''without out, the returned array is the plan's buffer and is reused'''
+        fftw = self.plan(x.shape, x.dtype)
+        fftw.input_array[...] = x
+        result = fftw()
+        if(out is None):
+            return result
+        out[...] = result
+        return out
+
+
+def export_wisdom():
+    '''FFTW wisdom gathered so far, to be saved and passed to import_wisdom'''
+    if(pyfftw is None):
+        return None
+    return pyfftw.export_wisdom()
+
+
+def import_wisdom(wisdom):
+    if((pyfftw is None) or (wisdom is None)):
+        return
+    pyfftw.import_wisdom(wisdom)
@@ -0,0 +1,41 @@
+import argparse
+import timeit
+import numpy as np
+import fftbackend
+
+'''block sizes of audiovisualizer.py and qt_audiovisualizer.py'''
+blocksizes = (1024, 4096)
+
+
+def bench(backend, blocksize, channel, dtype, repeat):
+    '''microseconds per batched transform of a zero padded analyzer frame'''
+    frame = np.random.standard_normal((channel, 2 * blocksize)).astype(dtype)
+    out = np.empty((channel, blocksize + 1), dtype=np.result_type(dtype, np.complex64))
+    backend.rfft(frame, out=out)
+    timer = timeit.Timer(lambda: backend.rfft(frame, out=out))
+    loops, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=loops))
+    return best / loops * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compare FFT backends")
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2, 8])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="scipy.fft workers / pyfftw threads")
+    args = parser.parse_args()
+
+    options = {'scipy': {'workers': args.workers}}
+    if(args.workers is not None):
+        options['pyfftw'] = {'threads': args.workers}
+
+    print("%-8s %6s %4s %-8s %10s" % ("backend", "block", "ch", "dtype", "us/frame"))
+    for name in fftbackend.available_backends():
+        backend = fftbackend.get_backend(name, **options.get(name, {}))
+        for blocksize in blocksizes:
+            for channel in args.channels:
+                for dtype in (np.float64, np.float32):
+                    usec = bench(backend, blocksize, channel, dtype, args.repeat)
+                    print("%-8s %6d %4d %-8s %10.1f" % (name, blocksize, channel,
+                                                        np.dtype(dtype).name, usec))
@@ -0,0 +1,152 @@
+import bisect
+import json
+import multiprocessing
+import time
+
+
+'''upper bounds in seconds: 10 us doubling up to ~10 s'''
+TIME_BOUNDS = [1e-5 * 2 ** k for k in range(21)]
+'''upper bounds in queued blocks'''
+DEPTH_BOUNDS = [0] + [2 ** k for k in range(11)]
+
+
+def now():
+    '''timestamp for AudioBlock.timestamp; monotonic and, on Linux, the
+    same clock in every process of the pipeline'''
+    return time.monotonic()
+
+
+def queue_depth(q):
+    '''blocks waiting in q, or None where qsize() is not implemented
+    (multiprocessing.Queue on macOS)'''
+    try:
+        return q.qsize()
+    except (NotImplementedError, AttributeError):
+        return None
+
+
+class Histogram(object):
+    '''Fixed-bucket histogram in shared memory.
+
+    Lock-free for a single writer: record() only increments its own
+    counters, readers in any process may snapshot() at any time and see
+    counts that are at most one sample behind. Create it in the parent,
+    before the writing process is started.
+    '''
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        '''one bucket per bound plus +Inf'''
+        self.buckets = multiprocessing.RawArray('Q', len(self.bounds) + 1)
+        self.total = multiprocessing.RawArray('d', 1)
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.total[0] += value
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def quantile(self, q):
+        '''upper bound of the bucket holding the q-quantile'''
+        counts = list(self.buckets)
+        rank = q * sum(counts)
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if((n > 0) and (seen >= rank)):
+                if(i < len(self.bounds)):
+                    return self.bounds[i]
+                return float('inf')
+        return None
+
+    def snapshot(self):
+        counts = list(self.buckets)
+        count = sum(counts)
+        cumulative = []
+        seen = 0
+        for bound, n in zip(self.bounds + [float('inf')], counts):
+            seen += n
+            cumulative.append((bound, seen))
+        mean = None
+        if(count > 0):
+            mean = self.total[0] / count
+        return {'count': count, 'sum': self.total[0], 'mean': mean,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': cumulative}
+
+
+class StageStats(object):
+    '''Per-block timings of one pipeline stage.
+
+    process: seconds spent handling a block, queue_depth: blocks waiting
+    in the stage's input queue when it took one, latency: seconds from the
+    block's capture timestamp until the stage was done with it (for plots:
+    until it was on screen).
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.process = Histogram(TIME_BOUNDS)
+        self.queue_depth = Histogram(DEPTH_BOUNDS)
+        self.latency = Histogram(TIME_BOUNDS)
+
+    def record_block(self, start, in_queue=None, timestamp=None):
+        '''call when done with a block whose handling began at start (now())'''
+        end = now()
+        self.process.record(end - start)
+        if(in_queue is not None):
+            depth = queue_depth(in_queue)
+            if(depth is not None):
+                self.queue_depth.record(depth)
+        if(timestamp is not None):
+            self.latency.record(end - timestamp)
+
+    def record_latency(self, timestamp):
+        if(timestamp is not None):
+            self.latency.record(now() - timestamp)
+
+    def snapshot(self):
+        return {'process': self.process.snapshot(),
+                'queue_depth': self.queue_depth.snapshot(),
+                'latency': self.latency.snapshot()}
+
+
+def _json_safe(value):
+    '''+Inf bucket bounds as strings, JSON has no infinity'''
+    if(isinstance(value, dict)):
+        return dict((key, _json_safe(item)) for key, item in value.items())
+    if(isinstance(value, (list, tuple))):
+        return [_json_safe(item) for item in value]
+    if(value == float('inf')):
+        return '+Inf'
+    return value
+
+
+def to_json(snapshot):
+    return json.dumps(_json_safe(snapshot), indent=2, sort_keys=True)
+
+
+def _prometheus_le(bound):
+    if(bound == float('inf')):
+        return '+Inf'
+    return repr(float(bound))
+
+
+def to_prometheus(stages, prefix='audiovisualizer'):
+    '''Prometheus text exposition of {stage name: StageStats.snapshot()}'''
+    lines = []
+    for metric in ('process', 'queue_depth', 'latency'):
+        name = '%s_%s' % (prefix, metric)
+        if(metric != 'queue_depth'):
+            name += '_seconds'
+        lines.append('# TYPE %s histogram' % name)
+        for stage in sorted(stages):
+            snapshot = stages[stage][metric]
+            for bound, count in snapshot['buckets']:
+                lines.append('%s_bucket{stage="%s",le="%s"} %d'
+                             % (name, stage, _prometheus_le(bound), count))
+            lines.append('%s_sum{stage="%s"} %r' % (name, stage, snapshot['sum']))
+            lines.append('%s_count{stage="%s"} %d' % (name, stage, snapshot['count']))
+    return '\n'.join(lines) + '\n'
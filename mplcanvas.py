@@ -1,25 +1,34 @@
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 
 import matplotlib
 matplotlib.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 
-import threading
 import multiprocessing
+import audiostreamer
 import customthreads
+import renderscheduler
 import queue
-import collections
 import numpy
+import ringbuffer
 
 
-class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
+class MplCanvas(FigureCanvasQTAgg, customthreads.QueueConsumer,
+                customthreads.StoppableThread):
+    '''The worker thread only prepares (channel x n) frames and publishes
+    them through a DoubleBuffer; a QTimer on the GUI thread plots the
+    newest one at most max_fps times per second (see qt_mplcanvas).'''
 
     def __init__(self, parent=None, width=5, height=4, channel=1,
-                 dpi=100, *args, **kwargs):
+                 dpi=100, max_fps=30, queue_size=customthreads.QUEUE_SIZE,
+                 *args, **kwargs):
 
         customthreads.StoppableThread.__init__(self, *args, **kwargs)
-        self.in_queue = queue.Queue()
+        self.queue_size = queue_size
+        self.in_queue = queue.Queue(queue_size)
+        self.frames = renderscheduler.DoubleBuffer()
+        self.scheduler = renderscheduler.RenderScheduler(self.redraw, max_fps)
 
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         FigureCanvasQTAgg.__init__(self, self.fig)
@@ -29,11 +38,16 @@ class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
         FigureCanvasQTAgg.updateGeometry(self)
 
         self.axes_list = []
+        self.lines = []
         self.ylim = None
 
         self.setParent(parent)
         self.set_channel(channel)
 
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setInterval(int(1000 * self.scheduler.interval))
+        self.frame_timer.timeout.connect(self.on_frame_timer)
+
         # self.axes = self.fig.add_subplot(111)
         # self.axes.hold(False)
 
@@ -48,100 +62,112 @@ class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
 
         for i in range(1, self.channel+1):
             self.axes_list.append(self.fig.add_subplot(self.channel, 1, i))
-        for ax in self.axes_list:
-            ax.hold(False)
+        '''one line per channel, updated in place by update_lines()'''
+        self.lines = [ax.plot([], [], 'b')[0] for ax in self.axes_list]
+        self.frames.clear()
 
     def set_lim(self, dtype):
         self.typeinfo = numpy.iinfo(dtype)
         self.ylim = [self.typeinfo.min, self.typeinfo.max]
 
     def split_channel(self, data):
-        return numpy.transpose(numpy.reshape(data, (len(data)/self.channel, self.channel)))
+        return audiostreamer.as_planar(data, self.channel)
+
+    def prepare(self, data):
+        '''worker thread: the (channel x n) frame to show for a block'''
+        return self.split_channel(data)
+
+    def update_lines(self, frame, x_range=None, ylim=None):
+        '''GUI thread: new y data for every line; the x data and the x
+        limits only change with the length of the frame'''
+        for i in range(self.channel):
+            line = self.lines[i]
+            ax = self.axes_list[i]
+            if(len(line.get_xdata()) != len(frame[i])):
+                x_values = x_range
+                if(x_values is None):
+                    x_values = numpy.arange(len(frame[i]))
+                line.set_data(x_values, frame[i])
+                ax.set_xlim(x_values[0], x_values[-1])
+            else:
+                line.set_ydata(frame[i])
+            if((ylim is not None) and (tuple(ax.get_ylim()) != tuple(ylim))):
+                ax.set_ylim(ylim)
+
+    def plot_frame(self, frame):
+        '''GUI thread'''
+        self.update_lines(frame, ylim=self.ylim)
+
+    def redraw(self):
+        self.frames.lock.acquire()
+        frame = self.frames.front
+        if((frame is not None) and (len(frame) == self.channel)):
+            self.plot_frame(frame)
+        self.frames.lock.release()
+        self.draw_idle()
+
+    def on_frame_timer(self):
+        if(self.is_stopped()):
+            self.frame_timer.stop()
+            return
+        self.scheduler.tick()
+
+    def start(self):
+        '''call from the GUI thread, whose event loop renders the frames'''
+        self.frame_timer.start()
+        customthreads.StoppableThread.start(self)
 
     def run(self):
         '''Thread Loop'''
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = self.split_channel(data)
-                for i in range(self.channel):
-                    # print(split_data[i], len(split_data[i]))
-                    self.axes_list[i].plot(range(len(split_data[i])), split_data[i], 'b')
-                    self.axes_list[i].set_ylim(self.ylim)
-                self.draw()
-
-            except queue.Empty:
-                '''do nothing'''
-                pass
+        for data in self.consume():
+            planar = self.prepare(data)
+            frame = self.frames.back(planar.shape, planar.dtype)
+            frame[:] = planar
+            self.frames.publish(frame)
+            self.scheduler.request()
 
 
 class AccumulateMplCanvas(MplCanvas):
 
     def __init__(self, deque_size=44100, redraw_interval=0.2,
                  *args, **kwargs):
-        self.deque_list = []
+        self.history = None
         self.deque_size = deque_size
         self.x_range = range(self.deque_size)
         self.redraw_interval = redraw_interval
+        kwargs['max_fps'] = 1.0 / self.redraw_interval
         super(AccumulateMplCanvas, self).__init__(*args, **kwargs)
 
     def set_channel(self, channel):
         super(AccumulateMplCanvas, self).set_channel(channel)
         # print("CHANNEL!:", channel)
-        self.deque_list = []
-        for i in range(channel):
-            self.deque_list.append(collections.deque(maxlen=self.deque_size))
-        for dq in self.deque_list:
-            dq.extend([0] * self.deque_size)
+        self.history = ringbuffer.RingBuffer(self.deque_size, channel)
 
-    def redraw(self):
-        '''redraw graph every 'redraw_interval' seconds'''
-        for i in range(self.channel):
-            self.axes_list[i].plot(self.x_range, self.deque_list[i], 'b')
-            self.axes_list[i].set_ylim(self.ylim)
-        self.draw()
-        threading.Timer(self.redraw_interval, self.redraw).start()
+    def prepare(self, data):
+        self.history.extend(self.split_channel(data))
+        return self.history.view()
 
-    def run(self):
-        self.redraw()
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = self.split_channel(data)
-                for i in range(self.channel):
-                    self.deque_list[i].extend(split_data[i])
-            except queue.Empty:
-                pass
+    def plot_frame(self, frame):
+        '''at most every 'redraw_interval' seconds, when data arrived'''
+        self.update_lines(frame, self.x_range, self.ylim)
 
 
 class MplCanvasMP(MplCanvas):
     def __init__(self, *args, **kwargs):
         super(MplCanvasMP, self).__init__(*args, **kwargs)
-        self.in_queue = multiprocessing.Queue()
+        self.in_queue = multiprocessing.Queue(self.queue_size)
 
 
 class FreqMplCanvasMP(MplCanvasMP):
     def __init__(self, *args, **kwargs):
         super(FreqMplCanvasMP, self).__init__(*args, **kwargs)
 
-    def run(self):
-        '''Process Loop'''
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = self.split_channel(data)
-                datalength = len(split_data[0])
-                x_range = range(datalength)
-                scaled_ylim = numpy.log10(datalength * self.ylim[1])
-                for i in range(self.channel):
-                    scaled = numpy.log10(split_data[i])
-                    self.axes_list[i].plot(x_range, scaled.real, 'b')
-                    self.axes_list[i].set_ylim(0, scaled_ylim)
-                self.draw()
-
-            except queue.Empty:
-                '''do nothing'''
-                pass
+    def prepare(self, data):
+        return numpy.log10(self.split_channel(data)).real
+
+    def plot_frame(self, frame):
+        scaled_ylim = (0, numpy.log10(len(frame[0]) * self.ylim[1]))
+        self.update_lines(frame, ylim=scaled_ylim)
 
 
     # def run(self):
@@ -3,18 +3,34 @@ from multiprocessing import Lock
 import audiostreamer as ast
 import matplotlib
 import matplotlib.pyplot as plt
-import threading
-import queue
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import customthreads as ct
-import collections
+import blitting
+import instrumentation
+import renderscheduler
+import decimation
+import ringbuffer
 import numpy as np
 
 
-class MPlot(ct.StoppableProcess):
+class MPlot(ct.QueueConsumer, ct.StoppableProcess):
+    '''Plot process: ingest() takes every incoming block, redraw() is run
+    by a RenderScheduler at most max_fps times per second. The scheduler
+    is ticked from the process' main thread, between blocks and while the
+    queue is idle, so the GUI backend is only used from that thread. Its
+    requested/rendered/dropped frame counters are shared with the parent
+    process, see frame_stats(), as are the timings in stage_stats, whose
+    latency runs from a block's capture until it was drawn.
+
+    With offscreen=True the figure is a plain Agg figure of figsize inches
+    at dpi that is never shown, so no display is needed; see offscreen.py.
+    '''
     def __init__(self, xlim, ylim, channel=1, post_process=None, x_range=None,
-                 *args, **kwargs):
+                 dtype=np.float64, max_fps=30, queue_size=ct.QUEUE_SIZE,
+                 offscreen=False, figsize=None, dpi=None, *args, **kwargs):
         super(MPlot, self).__init__(*args, **kwargs)
-        self.in_queue = multiprocessing.Queue()
+        self.in_queue = multiprocessing.Queue(queue_size)
         self.xlim = xlim
         self.ylim = ylim
         self.x_range = x_range
@@ -23,131 +39,263 @@ class MPlot(ct.StoppableProcess):
 
         self.lock = Lock()
         self.channel = channel
+        '''dtype of the buffers kept for display'''
+        self.dtype = dtype
 
         self.post_process = post_process
         if(self.post_process is None):
             self.post_process = lambda data: data
 
+        self.max_fps = max_fps
+        self.frame_counters = multiprocessing.RawArray('Q', 3)
+        self.scheduler = None
+        self.ydata = None
+        self.latest_timestamp = None
+        self.stage_stats = instrumentation.StageStats(type(self).__name__)
+
+        self.offscreen = offscreen
+        self.figsize = figsize
+        self.dpi = dpi
+
+    def frame_stats(self):
+        return {'requested': self.frame_counters[renderscheduler.REQUESTED],
+                'rendered': self.frame_counters[renderscheduler.RENDERED],
+                'dropped': self.frame_counters[renderscheduler.DROPPED]}
+
     def init_plot(self):
         self.lock.acquire()
 
-        self.fig, self.axarr = plt.subplots(self.channel,
-                                            sharex=True,
-                                            squeeze=False)
+        if(self.offscreen):
+            self.fig = Figure(figsize=self.figsize, dpi=self.dpi)
+            FigureCanvasAgg(self.fig)
+            self.axarr = self.fig.subplots(self.channel, sharex=True,
+                                           squeeze=False)
+        else:
+            self.fig, self.axarr = plt.subplots(self.channel,
+                                                sharex=True,
+                                                squeeze=False,
+                                                figsize=self.figsize,
+                                                dpi=self.dpi)
+        for i in range(self.channel):
+            self.axarr[i, 0].set_xlim(self.xlim)
+            self.axarr[i, 0].set_ylim(self.ylim)
+        self.blitter = blitting.BlitManager(self.fig.canvas, self.init_artists())
+        if(self.offscreen is False):
+            self.fig.show()
+        self.fig.canvas.draw()
+
+        self.lock.release()
+
+    def init_artists(self):
+        '''create the artists that are updated on every redraw, once'''
+        self.lines = [self.axarr[i, 0].plot(self.x_range,
+                                             np.zeros(len(self.x_range)))[0]
+                      for i in range(self.channel)]
+        return self.lines
+
+    def update_lines(self, ydata_list):
         for i in range(self.channel):
-            self.axarr[i, 0].hold(False)
-        self.fig.show()
+            self.lines[i].set_ydata(ydata_list[i])
+        self.blitter.update()
+
+    def ingest(self, data):
+        split_data = ast.as_planar(data, self.channel)
+        p_split_data = [self.post_process(sd) for sd in split_data]
+
+        self.lock.acquire()
+        self.ydata = p_split_data
+        self.lock.release()
 
+    def redraw(self):
+        self.lock.acquire()
+        if(self.ydata is not None):
+            self.update_lines(self.ydata)
         self.lock.release()
 
+    def idle(self):
+        self.scheduler.tick()
+
+    def render_frame(self):
+        self.redraw()
+        self.stage_stats.record_latency(self.latest_timestamp)
+
     def run(self):
         self.init_plot()
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                p_split_data = [self.post_process(sd) for sd in split_data]
+        self.scheduler = renderscheduler.RenderScheduler(self.render_frame,
+                                                         self.max_fps,
+                                                         self.frame_counters)
+        self.poll_timeout = self.scheduler.interval
+        for data in self.consume():
+            start = instrumentation.now()
+            self.ingest(data)
+            self.latest_timestamp = getattr(data, 'timestamp', None)
+            self.stage_stats.record_block(start, self.in_queue)
+            self.scheduler.request()
+            self.scheduler.tick()
 
-                self.lock.acquire()
-                for i in range(self.channel):
-                    self.axarr[i, 0].plot(self.x_range, p_split_data[i])
-                    self.axarr[i, 0].set_xlim(self.xlim)
-                    self.axarr[i, 0].set_ylim(self.ylim)
-                self.fig.canvas.draw()
-                self.lock.release()
 
-            except queue.Empty:
-                pass
+class DequeMPlot(MPlot):
+    '''Plots the last max_size samples of every channel, kept in a
+    ringbuffer.RingBuffer of dtype.
 
+    With display_width set (in pixels) and a history much longer than
+    that, only a min/max envelope per pixel column is kept and drawn
+    (see decimation.EnvelopeBuffer), so redraw cost depends on the width
+    rather than on max_size. zoom_levels > 1 adds finer envelopes that
+    set_zoom() switches to.
 
-class DequeMPlot(MPlot):
+    redraw_interval, if given, caps the frame rate at 1 / redraw_interval.
+    '''
     def __init__(self, max_size=44100, redraw_interval=None,
-                 *args, **kwargs):
+                 display_width=None, zoom_levels=1, *args, **kwargs):
+        if(redraw_interval is not None):
+            kwargs['max_fps'] = 1.0 / redraw_interval
         super(DequeMPlot, self).__init__(*args, **kwargs)
         self.max_deque_size = max_size
-        self.deque_list = [collections.deque(maxlen=self.max_deque_size)
-                           for i in range(self.channel)]
+        self.redraw_interval = redraw_interval
 
-        for dq in self.deque_list:
-            dq.extend([0] * max_size)
+        self.envelope = None
+        self.zoom_level = 0
+        if((display_width is not None) and (max_size > 2 * display_width)):
+            self.envelope = decimation.EnvelopeBuffer(max_size, display_width,
+                                                      channel=self.channel,
+                                                      levels=zoom_levels,
+                                                      dtype=self.dtype)
+            self.x_range = self.envelope.x_values(self.xlim)
+            self.history = None
+            return
 
-        self.redraw_interval = redraw_interval
+        self.history = ringbuffer.RingBuffer(self.max_deque_size, self.channel,
+                                             self.dtype)
 
-    def redraw(self):
+    def set_zoom(self, level):
+        '''show the newest max_size / 2**level samples'''
         self.lock.acquire()
+        self.zoom_level = level
+        if(self.envelope is not None):
+            x_range = self.envelope.x_values(self.xlim, level)
+            for i in range(self.channel):
+                self.lines[i].set_xdata(x_range)
+        else:
+            '''the lines keep every sample, only the visible part changes'''
+            span = (self.x_range[-1] - self.x_range[0]) / 2 ** level
+            x_range = (self.x_range[-1] - span, self.x_range[-1])
         for i in range(self.channel):
-            self.axarr[i, 0].plot(self.x_range, self.deque_list[i])
-            self.axarr[i, 0].set_xlim(self.xlim)
-            self.axarr[i, 0].set_ylim(self.ylim)
+            self.axarr[i, 0].set_xlim(x_range[0], x_range[-1])
         self.fig.canvas.draw()
         self.lock.release()
 
-    def redraw_with_timer(self):
-        self.redraw()
-        self.lock.acquire()
-        threading.Timer(self.redraw_interval, self.redraw_with_timer).start()
-        self.lock.release()
+    def extend(self, split_data):
+        if(self.envelope is not None):
+            self.envelope.extend(split_data)
+            return
+        self.history.extend(split_data)
 
-    def run(self):
-        self.init_plot()
-
-        if(self.redraw_interval is not None):
-            self.redraw_with_timer()
+    def ingest(self, data):
+        split_data = ast.as_planar(data, self.channel)
+        p_split_data = [self.post_process(sd) for sd in split_data]
 
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                p_split_data = [self.post_process(sd) for sd in split_data]
+        self.lock.acquire()
+        self.extend(p_split_data)
+        self.lock.release()
 
-                for i in range(self.channel):
-                    self.deque_list[i].extend(p_split_data[i])
-                if(self.redraw_interval is None):
-                    self.redraw()
-            except queue.Empty:
-                pass
+    def redraw(self):
+        self.lock.acquire()
+        if(self.envelope is not None):
+            self.update_lines(self.envelope.envelope(self.zoom_level))
+        else:
+            self.update_lines(self.history.view())
+        self.lock.release()
 
 
 class SpectroMPlot(MPlot):
-    def __init__(self, block_size, *args, **kwargs):
+    '''Scrolling spectrogram (waterfall) of the last len(x_range) frames.
+
+    Each channel has one image artist over a preallocated RGBA buffer twice
+    as wide as the history and no taller than the axes are in pixels. A new
+    frame is peak-reduced to that many rows, colored through a precomputed
+    256 entry lookup table and written as a single column, at its ring
+    position and again one history length further on; scrolling only moves
+    the x limits so the newest column is at the right edge, and the image
+    alone is blitted. ylim is the color range.
+    '''
+    def __init__(self, block_size, cmap='jet', *args, **kwargs):
         super(SpectroMPlot, self).__init__(*args, **kwargs)
         self.block_size = block_size
-        self.arr_list = [np.zeros((len(self.x_range), self.block_size))
-                         for i in range(self.channel)]
         self.arr_order = 0
         self.x_range_len = len(self.x_range)
 
-    def redraw(self):
-        self.lock.acquire()
+        colormap = matplotlib.colormaps[cmap]
+        self.lut = (colormap(np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+        self.lut_scale = 255.0 / (self.ylim[1] - self.ylim[0])
+
+    def init_rows(self, height):
+        '''bins are max-reduced into at most `height` image rows'''
+        self.rows = min(self.block_size, max(1, int(height)))
+        self.row_starts = np.linspace(0, self.block_size, self.rows + 1).astype(np.intp)[:-1]
+        self.reduced = np.zeros(self.rows, dtype=np.float32)
+        self.indices = np.zeros(self.rows, dtype=np.intp)
+
+    def init_artists(self):
+        width = self.x_range_len
+        self.init_rows(self.axarr[0, 0].bbox.height)
+        self.images = []
+        self.pixels = []
         for i in range(self.channel):
-            # self.axarr[i, 0].plot(self.x_range, self.arr_list[i])
-            self.axarr[i, 0].imshow(np.transpose(self.arr_list[i]),
-                                    origin="lower", aspect="auto",
-                                    cmap='jet', interpolation="none",
-                                    vmin=self.ylim[0], vmax=self.ylim[1])
+            ax = self.axarr[i, 0]
+            image = ax.imshow(np.zeros((self.rows, 2 * width, 4),
+                                       dtype=np.uint8),
+                              origin="lower", aspect="auto",
+                              interpolation="nearest",
+                              extent=(0, 2 * width, 0, self.block_size))
+            self.images.append(image)
+            '''the image keeps its own copy of the buffer; write into that'''
+            self.pixels.append(np.ma.getdata(image.get_array()))
+            ax.set_ylim(0, self.block_size)
+            ax.set_xticks([])
+        self.scroll()
+        return self.images
 
-        self.fig.canvas.draw()
-        # self.fig.canvas.update()
-        self.lock.release()
+    def scroll(self):
+        for i in range(self.channel):
+            self.axarr[i, 0].set_xlim(self.arr_order,
+                                      self.arr_order + self.x_range_len)
 
-    def run(self):
-        self.init_plot()
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                p_split_data = [self.post_process(sd) for sd in split_data]
+    def add_column(self, i, values):
+        '''color one frame of channel i into the current column'''
+        values = np.real(values)
+        if(self.rows < self.block_size):
+            np.maximum.reduceat(values, self.row_starts, out=self.reduced)
+        else:
+            self.reduced[...] = values
+        np.subtract(self.reduced, self.ylim[0], out=self.reduced)
+        np.multiply(self.reduced, self.lut_scale, out=self.reduced)
+        np.nan_to_num(self.reduced, copy=False)
+        np.clip(self.reduced, 0, 255, out=self.reduced)
+        self.indices[...] = self.reduced
 
-                for i in range(self.channel):
-                    self.arr_list[i][self.arr_order] = p_split_data[i]
+        pixels = self.pixels[i]
+        column = self.arr_order
+        np.take(self.lut, self.indices, axis=0, out=pixels[:, column], mode='clip')
+        pixels[:, column + self.x_range_len] = pixels[:, column]
+        self.images[i].changed()
 
-                self.redraw()
-                self.arr_order += 1
-                if(self.arr_order >= self.x_range_len):
-                    self.arr_order = 0
+    def redraw(self):
+        self.lock.acquire()
+        self.scroll()
+        self.blitter.update()
+        self.lock.release()
 
-            except queue.Empty:
-                pass
+    def ingest(self, data):
+        '''every frame gets its column, whether or not it is rendered'''
+        split_data = ast.as_planar(data, self.channel)
+        p_split_data = [self.post_process(sd) for sd in split_data]
 
-    # def redraw(self):
+        self.lock.acquire()
+        for i in range(self.channel):
+            self.add_column(i, p_split_data[i])
 
+        self.arr_order += 1
+        if(self.arr_order >= self.x_range_len):
+            self.arr_order = 0
+        self.lock.release()
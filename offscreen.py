@@ -0,0 +1,254 @@
+'''Render plots of a recording into video or image files, headlessly.
+
+OffscreenRenderer feeds a WAV file through in-process plots created with
+offscreen=True (Agg figures, no display, no QApplication). Frames are
+taken on sample time: frame k shows the data up to sample
+k * samplerate / fps, however long drawing takes, so a file renders as
+fast as the machine allows. Every frame is composed into one
+preallocated RGBA buffer and handed to a sink: an ffmpeg subprocess, or
+a PNG/npy image sequence.
+'''
+import argparse
+import functools
+import multiprocessing
+import os
+import queue
+import subprocess
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.image
+import numpy as np
+
+import audioanalyzer as aa
+import audiostreamer as ast
+import mplot
+import spectrumkernels
+import wavfile
+
+
+class FfmpegSink(object):
+    '''pipes raw RGBA frames into `ffmpeg` encoding filename'''
+
+    def __init__(self, filename, width, height, fps, codec='libx264',
+                 ffmpeg='ffmpeg', extra_args=()):
+        command = [ffmpeg, '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                   '-s', '%dx%d' % (width, height), '-r', str(fps),
+                   '-i', '-',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-c:v', codec, '-pix_fmt', 'yuv420p']
+        command += list(extra_args) + [filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, rgba):
+        self.process.stdin.write(memoryview(rgba).cast('B'))
+
+    def close(self):
+        self.process.stdin.close()
+        if(self.process.wait() != 0):
+            raise RuntimeError("ffmpeg exited with status %d"
+                               % self.process.returncode)
+
+
+class ImageSequenceSink(object):
+    '''one file per frame; pattern is e.g. "frames/%06d.png" or ".npy"'''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.index = 0
+        directory = os.path.dirname(pattern)
+        if(directory and (os.path.isdir(directory) is False)):
+            os.makedirs(directory)
+
+    def write(self, rgba):
+        filename = self.pattern % self.index
+        if(filename.endswith('.npy')):
+            np.save(filename, rgba)
+        else:
+            matplotlib.image.imsave(filename, rgba)
+        self.index += 1
+
+    def close(self):
+        pass
+
+
+def open_sink(output, width, height, fps):
+    '''an image sequence if output contains a % pattern, else a video'''
+    if('%' in output):
+        return ImageSequenceSink(output)
+    return FfmpegSink(output, width, height, fps)
+
+
+class OffscreenRenderer(object):
+    '''Drives offscreen plots over a recording and composes their frames.
+
+    Plots are stacked top to bottom in the order they were added. A
+    'samples' plot gets the normalized interleaved samples, a 'spectrum'
+    plot the frames of an in-process AudioAnalyzer (created on the first
+    such plot with the given analyzer options).
+    '''
+
+    def __init__(self, fps=30, block_frames=1024, dtype=np.float32):
+        self.fps = fps
+        self.block_frames = block_frames
+        self.dtype = np.dtype(dtype)
+        self.plots = []
+        self.analyzer = None
+        self.spectra = None
+        self.frame = None
+
+    def add_plot(self, plot, source='samples'):
+        if(source not in ('samples', 'spectrum')):
+            raise ValueError("unknown plot source %r" % (source,))
+        self.plots.append((plot, source))
+
+    def use_analyzer(self, **options):
+        '''run an AudioAnalyzer in this process for the 'spectrum' plots'''
+        options.setdefault('dtype', self.dtype)
+        options.setdefault('layout', 'planar')
+        self.analyzer = aa.AudioAnalyzer(**options)
+        self.spectra = queue.Queue()
+        self.analyzer.register_queue(self.spectra)
+
+    def init_frame(self):
+        for plot, source in self.plots:
+            plot.init_plot()
+        buffers = [np.asarray(plot.fig.canvas.buffer_rgba()) for plot, source in self.plots]
+        height = sum(buffer.shape[0] for buffer in buffers)
+        width = max(buffer.shape[1] for buffer in buffers)
+        self.frame = np.zeros((height, width, 4), dtype=np.uint8)
+        return width, height
+
+    def compose(self):
+        '''draw every plot and copy its Agg buffer into self.frame'''
+        row = 0
+        for plot, source in self.plots:
+            plot.redraw()
+            buffer = np.asarray(plot.fig.canvas.buffer_rgba())
+            height, width = buffer.shape[:2]
+            self.frame[row:row + height, :width] = buffer
+            row += height
+        return self.frame
+
+    def feed(self, block):
+        for plot, source in self.plots:
+            if(source == 'samples'):
+                plot.ingest(block)
+        if(self.analyzer is None):
+            return
+        self.analyzer.process(block)
+        while True:
+            try:
+                spectrum = self.spectra.get_nowait()
+            except queue.Empty:
+                break
+            for plot, source in self.plots:
+                if(source == 'spectrum'):
+                    plot.ingest(spectrum)
+
+    def render(self, data, samplerate, sink):
+        '''render a (frames x channel) sample array, e.g. a WAV memmap;
+        returns the number of video frames written'''
+        frame_count = 0
+        for start in range(0, len(data), self.block_frames):
+            block = data[start:start + self.block_frames]
+            self.feed(ast.normalize(block, self.dtype).reshape(-1))
+            position = start + len(block)
+            '''every frame whose sample time has been reached'''
+            while(frame_count * samplerate < position * self.fps):
+                sink.write(self.compose())
+                frame_count += 1
+        return frame_count
+
+    def close(self):
+        for plot, source in self.plots:
+            mplot.plt.close(plot.fig)
+
+
+def default_renderer(info, fps=30, width=1280, height=720, dpi=100,
+                     blocksize=1024, seconds=5.0):
+    '''waveform envelope of the last `seconds` above a spectrogram'''
+    renderer = OffscreenRenderer(fps=fps, block_frames=blocksize)
+    figsize = (width / float(dpi), height / 2.0 / dpi)
+    history = int(seconds * info.samplerate)
+    renderer.add_plot(mplot.DequeMPlot(xlim=(0, history), ylim=(-1, 1),
+                                       channel=info.channel,
+                                       max_size=history,
+                                       display_width=width,
+                                       dtype=np.float32, offscreen=True,
+                                       figsize=figsize, dpi=dpi))
+    renderer.use_analyzer(blocksize=blocksize, channel=info.channel,
+                          hop_size=blocksize,
+                          post_process=spectrumkernels.Chain(
+                              spectrumkernels.PowerDB(floor=-80.0)))
+    columns = int(seconds * info.samplerate / blocksize)
+    renderer.add_plot(mplot.SpectroMPlot(block_size=blocksize,
+                                         xlim=(0, columns),
+                                         ylim=(-80, 20 * np.log10(blocksize)),
+                                         channel=info.channel,
+                                         offscreen=True, figsize=figsize,
+                                         dpi=dpi),
+                      source='spectrum')
+    return renderer
+
+
+def render_file(filename, output, **options):
+    info, data = wavfile.open_memmap(filename)
+    renderer = default_renderer(info, **options)
+    width, height = renderer.init_frame()
+    sink = open_sink(output, width, height, renderer.fps)
+    try:
+        return renderer.render(data, info.samplerate, sink)
+    finally:
+        sink.close()
+        renderer.close()
+
+
+def _render_one(paths, options):
+    src, dst = paths
+    render_file(src, dst, **options)
+    return dst
+
+
+def render_directory(src_dir, dst_dir, ext='.mp4', processes=None, **options):
+    '''render <name><ext> into dst_dir for every .wav in src_dir'''
+    if(os.path.isdir(dst_dir) is False):
+        os.makedirs(dst_dir)
+    jobs = []
+    for name in sorted(os.listdir(src_dir)):
+        root, src_ext = os.path.splitext(name)
+        if(src_ext.lower() == '.wav'):
+            jobs.append((os.path.join(src_dir, name),
+                         os.path.join(dst_dir, root + ext)))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(functools.partial(_render_one, options=options), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="render WAV files to video without a display")
+    parser.add_argument('src', help="WAV file or directory of WAV files")
+    parser.add_argument('dst', help="video file, image pattern such as "
+                        "frames/%%06d.png, or output directory")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--blocksize', type=int, default=1024)
+    parser.add_argument('--seconds', type=float, default=5.0,
+                        help="history shown by the plots")
+    parser.add_argument('--ext', default='.mp4',
+                        help="output extension when rendering a directory")
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    options = {'fps': args.fps, 'width': args.width, 'height': args.height,
+               'blocksize': args.blocksize, 'seconds': args.seconds}
+    if(os.path.isdir(args.src)):
+        render_directory(args.src, args.dst, args.ext, args.processes, **options)
+    else:
+        render_file(args.src, args.dst, **options)
@@ -3,7 +3,9 @@ import sys
 
 import numpy
 import audiomanager as am
+import customthreads as ct
 import qt_mplcanvas as mp
+import spectrumkernels as sk
 
 
 class ApplicationWindow (QtWidgets.QMainWindow):
@@ -16,19 +18,20 @@ class ApplicationWindow (QtWidgets.QMainWindow):
     def __init__(self, maxcol=3):
         super(ApplicationWindow, self).__init__()
         self.setWindowTitle("Audio visualizer")
-        self.audio_mgr = am.AudioManager(self.analyzer_blocksize)
+        self.audio_mgr = am.AudioManager(self.analyzer_blocksize,
+                                         analyzer_post_process=sk.Chain(sk.PowerDB(floor=0.0)))
         self.maxcol = maxcol
 
         self.accumulated_plot = mp.DequeMplCanvas(xlim=(0, self.max_deque_size),
                                                   ylim=None,
                                                   redraw_interval=0.2,
+                                                  display_width=1000,
                                                   parent=self,
                                                   daemon=True)
 
         self.freq_plot = mp.DequeMplCanvasWithMpQueue(xlim=(0, self.analyzer_blocksize), 
                                                       ylim=None, x_range=None,
                                                       max_size=self.analyzer_blocksize,
-                                                      post_process=lambda d: numpy.log10(numpy.absolute(d)),
                                                       daemon=True)
 
         # self.freq_plot = mp.FreqMplCanvasMP(parent=self, daemon=True)
@@ -42,19 +45,18 @@ class ApplicationWindow (QtWidgets.QMainWindow):
         self.accumulated_plot.ylim = (dtypeinfo.min, dtypeinfo.max)
         self.accumulated_plot.set_channel(self.audio_mgr.channel)
 
-        freq_y_lim = (0, numpy.log10(self.analyzer_blocksize * dtypeinfo.max))
-        freq_x_step = self.audio_mgr.samplerate / self.analyzer_blocksize
-        freq_x_lim = (-freq_x_step * self.analyzer_blocksize / 2,
-                      freq_x_step * self.analyzer_blocksize / 2)
-        freq_x_range = numpy.arange(freq_x_lim[0], freq_x_lim[1], freq_x_step)
+        freq_y_lim = (0, 20 * numpy.log10(self.analyzer_blocksize * dtypeinfo.max))
+        freq_x_range = sk.bin_frequencies(self.analyzer_blocksize,
+                                          self.audio_mgr.samplerate)
+        freq_x_lim = (0, self.audio_mgr.samplerate / 2)
 
         self.freq_plot.xlim = freq_x_lim
         self.freq_plot.ylim = freq_y_lim
         self.freq_plot.x_range = freq_x_range
         self.freq_plot.set_channel(self.audio_mgr.channel)
 
-        self.audio_mgr.streamer.register_queue(self.accumulated_plot.in_queue)
-        self.audio_mgr.analyzer.register_queue(self.freq_plot.in_queue)
+        self.accumulated_plot.subscribe(self.audio_mgr.streamer, ct.DROP_OLDEST)
+        self.freq_plot.subscribe(self.audio_mgr.analyzer, ct.LATEST)
 
         self.audio_mgr.start()
 
@@ -69,9 +71,9 @@ class ApplicationWindow (QtWidgets.QMainWindow):
                                   dtype=rec_dtypeinfo,
                                   filename=self.le_file_address.text())
 
-        self.audio_mgr.streamer.register_queue(self.accumulated_plot.in_queue)
-        self.accumulated_plot.set_channel(self.audio_mgr.channel)
+        self.accumulated_plot.subscribe(self.audio_mgr.streamer, ct.DROP_OLDEST)
         self.accumulated_plot.ylim = (rec_dtypeinfo.min, rec_dtypeinfo.max)
+        self.accumulated_plot.set_channel(self.audio_mgr.channel)
 
         # self.audio_mgr.analyzer.register_queue(self.freq_plot.in_queue)
         # self.freq_plot.set_lim(self.audio_mgr.dtype)
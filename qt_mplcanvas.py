@@ -1,4 +1,4 @@
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 
 import matplotlib
 matplotlib.use('Qt5Agg')
@@ -6,24 +6,44 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 
 import audiostreamer as ast
-import threading
+import blitting
+import decimation
+import ringbuffer
+import numpy
 from threading import Lock
 import multiprocessing
 import customthreads
+import instrumentation
+import renderscheduler
 import queue
-import collections
 
 
-class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
+class MplCanvas(FigureCanvasQTAgg, customthreads.QueueConsumer,
+                customthreads.StoppableThread):
+    '''Plot widget fed by its own worker thread.
+
+    The worker thread (run()) only turns incoming blocks into line data and
+    publishes it through a DoubleBuffer; it never touches the figure. A
+    QTimer on the GUI thread ticks the RenderScheduler, which blits the
+    newest published frame at most max_fps times per second, so Qt objects
+    are only ever used from the thread that owns them.
+    '''
 
     def __init__(self, xlim=None, ylim=None, channel=1, x_range=None,
                  parent=None, post_process=None, width=5, height=4, dpi=100,
+                 max_fps=30, queue_size=customthreads.QUEUE_SIZE,
                  *args, **kwargs):
 
         customthreads.StoppableThread.__init__(self, *args, **kwargs)
 
         self.lock = Lock()
-        self.in_queue = queue.Queue()
+        self.queue_size = queue_size
+        self.in_queue = queue.Queue(queue_size)
+        self.frames = renderscheduler.DoubleBuffer()
+        self.scheduler = renderscheduler.RenderScheduler(self.redraw, max_fps)
+        '''latency: from capture until the block's frame was blitted'''
+        self.stage_stats = instrumentation.StageStats(type(self).__name__)
+        self.latest_timestamp = None
 
         self.xlim = xlim
         self.ylim = ylim
@@ -40,8 +60,14 @@ class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
         FigureCanvasQTAgg.updateGeometry(self)
 
         self.axes_list = []
+        self.lines = []
+        self.blitter = blitting.BlitManager(self, event_loop=True)
         self.setParent(parent)
 
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setInterval(int(1000 * self.scheduler.interval))
+        self.frame_timer.timeout.connect(self.on_frame_timer)
+
         self.set_channel(channel)
 
         self.post_process = post_process
@@ -61,86 +87,176 @@ class MplCanvas(FigureCanvasQTAgg, customthreads.StoppableThread):
         self.axes_list = []
         for i in range(1, self.channel+1):
             self.axes_list.append(self.fig.add_subplot(self.channel, 1, i))
-            self.axes_list[i-1].hold(False)
+        self.lines = []
+        for ax in self.axes_list:
+            ax.set_xlim(self.xlim)
+            ax.set_ylim(self.ylim)
+            self.lines.append(ax.plot(self.x_range,
+                                      numpy.zeros(len(self.x_range)), 'b')[0])
+        self.blitter.set_artists(self.lines)
+        self.frames.clear()
 
         self.lock.release()
+        self.draw_idle()
 
-    def run(self):
-        print(self.x_range)
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                p_split_data = [self.post_process(sd) for sd in split_data]
+    def update_lines(self, ydata_list):
+        for i in range(self.channel):
+            self.lines[i].set_ydata(ydata_list[i])
+        self.blitter.update()
 
-                self.lock.acquire()
-                for i in range(self.channel):
-                    self.axes_list[i].plot(self.x_range, p_split_data[i], 'b')
-                    self.axes_list[i].set_xlim(self.xlim)
-                    self.axes_list[i].set_ylim(self.ylim)
-                self.draw()
-                self.lock.release()
+    def frame_stats(self):
+        return self.scheduler.stats()
 
-            except queue.Empty:
-                pass
+    def publish(self, ydata_list):
+        '''copy one row per channel into the back buffer and publish it'''
+        frame = self.frames.back((len(ydata_list), len(ydata_list[0])),
+                                 numpy.result_type(ydata_list[0]))
+        for i in range(len(ydata_list)):
+            frame[i] = ydata_list[i]
+        self.frames.publish(frame, self.latest_timestamp)
+        self.scheduler.request()
+
+    def ingest(self, data):
+        '''worker thread'''
+        split_data = ast.as_planar(data, self.channel)
+        self.publish([self.post_process(sd) for sd in split_data])
+
+    def redraw(self):
+        '''GUI thread'''
+        self.lock.acquire()
+        self.frames.lock.acquire()
+        frame = self.frames.front
+        if((frame is not None) and (len(frame) == self.channel)):
+            self.update_lines(frame)
+            self.stage_stats.record_latency(self.frames.front_meta)
+        self.frames.lock.release()
+        self.lock.release()
+
+    def on_frame_timer(self):
+        if(self.is_stopped()):
+            self.frame_timer.stop()
+            return
+        self.scheduler.tick()
+
+    def start(self):
+        '''call from the GUI thread, whose event loop renders the frames'''
+        self.frame_timer.start()
+        customthreads.StoppableThread.start(self)
+
+    def run(self):
+        for data in self.consume():
+            start = instrumentation.now()
+            self.latest_timestamp = getattr(data, 'timestamp', None)
+            self.ingest(data)
+            self.stage_stats.record_block(start, self.in_queue)
 
 
 class DequeMplCanvas(MplCanvas):
+    '''Plots the last max_size samples of every channel; with display_width
+    set, as a min/max envelope per pixel column (see mplot.DequeMPlot).
+    redraw_interval, if given, caps the frame rate at 1 / redraw_interval.
+
+    Every block extends the history, but it is only copied out for the
+    renderer when the scheduler is due to render, at most once per frame
+    interval. history_lock guards the history on the worker thread; lock,
+    which redraw() takes on the GUI thread, is never held while copying.'''
 
     def __init__(self, max_size=44100, redraw_interval=None,
-                 *args, **kwargs):
+                 display_width=None, zoom_levels=1, *args, **kwargs):
+        if(redraw_interval is not None):
+            kwargs['max_fps'] = 1.0 / redraw_interval
         self.max_deque_size = max_size
-        self.deque_list = []
+        self.history = None
+        self.history_lock = Lock()
+        self.unpublished = False
         self.redraw_interval = redraw_interval
+        self.display_width = display_width
+        self.zoom_levels = zoom_levels
+        self.zoom_level = 0
+        self.envelope = None
         super(DequeMplCanvas, self).__init__(*args, **kwargs)
+        '''idle() publishes the last blocks within a frame'''
+        self.poll_timeout = self.scheduler.interval
+
+    def use_envelope(self):
+        return ((self.display_width is not None) and
+                (self.max_deque_size > 2 * self.display_width))
 
     def set_channel(self, channel):
+        self.history_lock.acquire()
+        self.envelope = None
+        self.history = None
+        self.unpublished = False
+        if(self.use_envelope()):
+            self.envelope = decimation.EnvelopeBuffer(self.max_deque_size,
+                                                      self.display_width,
+                                                      channel=channel,
+                                                      levels=self.zoom_levels)
+            self.x_range = self.envelope.x_values(self.xlim, self.zoom_level)
+        else:
+            self.history = ringbuffer.RingBuffer(self.max_deque_size, channel)
         super(DequeMplCanvas, self).set_channel(channel)
-        self.lock.acquire()
-        self.deque_list = [collections.deque(maxlen=self.max_deque_size) for i in range(self.channel)]
-        for dq in self.deque_list:
-            dq.extend([0] * self.max_deque_size)
-        self.lock.release()
+        self.history_lock.release()
+
+    def set_zoom(self, level):
+        '''show the newest max_size / 2**level samples'''
+        self.history_lock.acquire()
+        self.zoom_level = level
+        if(self.envelope is not None):
+            self.x_range = self.envelope.x_values(self.xlim, level)
+            xlim = (self.x_range[0], self.x_range[-1])
+        else:
+            '''the lines keep every sample, only the visible part changes'''
+            span = (self.x_range[-1] - self.x_range[0]) / 2 ** level
+            xlim = (self.x_range[-1] - span, self.x_range[-1])
 
-    def redraw(self):
         self.lock.acquire()
         for i in range(self.channel):
-            self.axes_list[i].plot(self.x_range, self.deque_list[i], 'b')
-            self.axes_list[i].set_xlim(self.xlim)
-            self.axes_list[i].set_ylim(self.ylim)
+            if(self.envelope is not None):
+                self.lines[i].set_xdata(self.x_range)
+            self.axes_list[i].set_xlim(*xlim)
         self.draw()
         self.lock.release()
+        self.history_lock.release()
 
-    def redraw_with_timer(self):
-        '''redraw graph every 'redraw_interval' seconds'''
-        self.redraw()
-        self.lock.acquire()
-        if(self.is_running()):
-            threading.Timer(self.redraw_interval, self.redraw_with_timer).start()
-        self.lock.release()
+    def extend(self, split_data):
+        if(self.envelope is not None):
+            self.envelope.extend(split_data)
+            return
+        self.history.extend(split_data)
 
-    def run(self):
-        if(self.redraw_interval is not None):
-            self.redraw_with_timer()
-        while(self.is_stopped() is False):
-            try:
-                data = self.in_queue.get_nowait()
-                split_data = ast.split_channel(data, self.channel)
-                p_split_data = [self.post_process(sd) for sd in split_data]
-                for i in range(self.channel):
-                    self.deque_list[i].extend(p_split_data[i])
-                if(self.redraw_interval is None):
-                    self.redraw()
-            except queue.Empty:
-                pass
+    def publish_history(self):
+        '''copy what is shown into the back buffer; needs history_lock'''
+        if(self.envelope is not None):
+            self.publish(self.envelope.envelope(self.zoom_level))
+        else:
+            self.publish(self.history.view())
+        self.unpublished = False
+
+    def ingest(self, data):
+        '''worker thread'''
+        self.history_lock.acquire()
+        split_data = ast.as_planar(data, self.channel)
+        self.extend([self.post_process(sd) for sd in split_data])
+        self.unpublished = True
+        if(self.scheduler.due()):
+            self.publish_history()
+        self.history_lock.release()
+
+    def idle(self):
+        '''worker thread: show the last blocks once no more arrive'''
+        self.history_lock.acquire()
+        if(self.unpublished):
+            self.publish_history()
+        self.history_lock.release()
 
 
 class MplCanvasWithMPQueue(MplCanvas):
     def __init__(self, *args, **kwargs):
         super(MplCanvasWithMPQueue, self).__init__(*args, **kwargs)
-        self.in_queue = multiprocessing.Queue()
+        self.in_queue = multiprocessing.Queue(self.queue_size)
 
 class DequeMplCanvasWithMpQueue(DequeMplCanvas):
     def __init__(self, *args, **kwargs):
         super(DequeMplCanvasWithMpQueue, self).__init__(*args, **kwargs)
-        self.in_queue = multiprocessing.Queue()
+        self.in_queue = multiprocessing.Queue(self.queue_size)
@@ -0,0 +1,143 @@
+import threading
+import time
+import numpy as np
+import customthreads as ct
+
+REQUESTED = 0
+RENDERED = 1
+DROPPED = 2
+
+
+class RenderScheduler(ct.StoppableThread):
+    '''Renders at most max_fps times per second, however fast data arrives.
+
+    Producers call request() whenever new data is ready. The scheduler
+    thread then calls render() once for all the updates requested since
+    the previous render, no sooner than 1/max_fps after it; updates that
+    were superseded before they could be shown are counted as dropped.
+
+    Instead of starting the thread, a caller may drive tick() from its own
+    timer (e.g. a QTimer on the GUI thread), so that render() runs on the
+    thread that owns the canvas.
+
+    counters is any writable sequence of three integers (requested,
+    rendered, dropped), e.g. a multiprocessing.RawArray so that another
+    process can read them.
+    '''
+
+    '''fraction of the interval a tick may come early, for timers that do
+    not fire exactly on the frame boundary'''
+    early = 0.1
+
+    def __init__(self, render, max_fps=30, counters=None, *args, **kwargs):
+        kwargs.setdefault('daemon', True)
+        super(RenderScheduler, self).__init__(*args, **kwargs)
+        self.render = render
+        self.interval = 1.0 / max_fps
+        self.counters = counters
+        if(self.counters is None):
+            self.counters = [0, 0, 0]
+
+        self.pending = threading.Event()
+        self.counter_lock = threading.Lock()
+        self.covered = 0
+        self.last_render = 0.0
+
+    @property
+    def requested(self):
+        return self.counters[REQUESTED]
+
+    @property
+    def rendered(self):
+        return self.counters[RENDERED]
+
+    @property
+    def dropped(self):
+        return self.counters[DROPPED]
+
+    def stats(self):
+        return {'requested': self.requested, 'rendered': self.rendered,
+                'dropped': self.dropped}
+
+    def request(self):
+        with self.counter_lock:
+            self.counters[REQUESTED] += 1
+        self.pending.set()
+
+    def stop(self):
+        super(RenderScheduler, self).stop()
+        self.pending.set()
+
+    def due(self, now=None):
+        '''whether the frame interval has passed, i.e. whether a frame
+        requested now is rendered on the next tick'''
+        if(now is None):
+            now = time.monotonic()
+        return now - self.last_render >= self.interval * (1.0 - self.early)
+
+    def tick(self):
+        '''render if an update is pending and the frame interval has passed'''
+        if(self.pending.is_set() is False):
+            return False
+        now = time.monotonic()
+        if(self.due(now) is False):
+            return False
+
+        self.pending.clear()
+        with self.counter_lock:
+            covered = self.counters[REQUESTED] - self.covered
+            self.covered = self.counters[REQUESTED]
+        self.last_render = now
+        self.render()
+        self.counters[RENDERED] += 1
+        if(covered > 1):
+            self.counters[DROPPED] += covered - 1
+        return True
+
+    def run(self):
+        while(self.is_stopped() is False):
+            self.pending.wait()
+            delay = self.last_render + self.interval - time.monotonic()
+            if(delay > 0):
+                self._stop_flag.wait(delay)
+            if(self.is_stopped()):
+                break
+            self.tick()
+
+
+class DoubleBuffer(object):
+    '''Hands frames from a producer thread to the render thread.
+
+    The producer fills the array returned by back() outside of any lock
+    and publish()es it; the renderer reads front while holding lock. Only
+    publish() swaps the two, so neither side ever sees a half-written
+    frame and no data is copied under the lock.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.front = None
+        '''e.g. the capture timestamp of the data in front'''
+        self.front_meta = None
+        self.spare = None
+
+    def back(self, shape, dtype=np.float64):
+        '''the array to fill next, reallocated only if shape or dtype change'''
+        frame = self.spare
+        if((frame is None) or (frame.shape != shape) or (frame.dtype != dtype)):
+            frame = np.empty(shape, dtype=dtype)
+        self.spare = None
+        return frame
+
+    def publish(self, frame, meta=None):
+        self.lock.acquire()
+        self.spare = self.front
+        self.front = frame
+        self.front_meta = meta
+        self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        self.front = None
+        self.front_meta = None
+        self.lock.release()
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    '''Fixed-capacity sample history in one preallocated numpy array.
+
+    Holds the last `capacity` samples, of one signal (channel=None, shape
+    (capacity,)) or of several (shape (channel, capacity)). extend() writes
+    whole blocks with at most two slice assignments.
+
+    With mirrored=True every sample is also written `capacity` further on,
+    so latest(n) is always a contiguous view, at twice the memory and
+    write cost; use it for short histories that are read on every block.
+    Otherwise latest(n) is a view unless the range wraps, and view()
+    unwraps lazily into a reused buffer, only when the data has changed.
+    '''
+
+    def __init__(self, capacity, channel=None, dtype=np.float64,
+                 mirrored=False, data=None):
+        self.capacity = capacity
+        self.channel = channel
+        self.dtype = np.dtype(dtype)
+        self.mirrored = mirrored
+
+        width = self.capacity
+        if(self.mirrored):
+            width = 2 * self.capacity
+        shape = (width,)
+        if(self.channel is not None):
+            shape = (self.channel, width)
+        '''data may be caller-provided storage, e.g. in shared memory'''
+        self.data = data
+        if(self.data is None):
+            self.data = np.zeros(shape, dtype=self.dtype)
+
+        self.write_pos = 0
+        self.count = 0
+        self.unwrapped = None
+        self.unwrapped_count = -1
+
+    def __len__(self):
+        return self.capacity
+
+    def _write(self, pos, block):
+        n = block.shape[-1]
+        self.data[..., pos:pos + n] = block
+        if(self.mirrored):
+            self.data[..., pos + self.capacity:pos + self.capacity + n] = block
+
+    def extend(self, block):
+        '''append samples, shape (n,) or (channel, n)'''
+        block = np.asarray(block)
+        n = block.shape[-1]
+        self.count += n
+        if(n > self.capacity):
+            block = block[..., n - self.capacity:]
+            n = self.capacity
+
+        pos = self.write_pos
+        head = min(n, self.capacity - pos)
+        self._write(pos, block[..., :head])
+        if(n > head):
+            self._write(0, block[..., head:])
+        self.write_pos = (pos + n) % self.capacity
+
+    def latest(self, n):
+        '''the newest n samples, oldest first'''
+        if(self.mirrored):
+            end = self.write_pos + self.capacity
+            return self.data[..., end - n:end]
+
+        end = self.write_pos
+        if(end == 0):
+            end = self.capacity
+        if(n <= end):
+            return self.data[..., end - n:end]
+        return np.concatenate((self.data[..., self.capacity - (n - end):],
+                               self.data[..., :end]), axis=-1)
+
+    def view(self):
+        '''all samples, oldest first, as one contiguous array'''
+        if(self.mirrored or (self.write_pos == 0)):
+            return self.latest(self.capacity)
+
+        if(self.unwrapped_count != self.count):
+            if(self.unwrapped is None):
+                self.unwrapped = np.empty_like(self.data)
+            head = self.capacity - self.write_pos
+            self.unwrapped[..., :head] = self.data[..., self.write_pos:]
+            self.unwrapped[..., head:] = self.data[..., :self.write_pos]
+            self.unwrapped_count = self.count
+        return self.unwrapped
+
+
+class SampleFifo(object):
+    '''Bounded FIFO of interleaved sample frames, shape (capacity, channel).
+
+    Meant for exactly one producer and one consumer thread, e.g. an audio
+    callback and a worker: each side only advances its own counter, after
+    copying, so no lock is needed. write() and read() copy with at most two
+    slice assignments and never block; they return how many frames fit.
+    '''
+
+    def __init__(self, capacity, channel=1, dtype=np.int16):
+        self.capacity = capacity
+        self.channel = channel
+        self.dtype = np.dtype(dtype)
+        self.data = np.zeros((capacity, channel), dtype=self.dtype)
+        self.write_count = 0
+        self.read_count = 0
+
+    @property
+    def available(self):
+        '''frames that can be read'''
+        return self.write_count - self.read_count
+
+    @property
+    def free(self):
+        '''frames that can be written'''
+        return self.capacity - self.available
+
+    def write(self, frames):
+        '''append (n, channel) frames, or n * channel interleaved samples'''
+        frames = np.asarray(frames).reshape(-1, self.channel)
+        n = min(len(frames), self.free)
+        pos = self.write_count % self.capacity
+        head = min(n, self.capacity - pos)
+        self.data[pos:pos + head] = frames[:head]
+        self.data[:n - head] = frames[head:n]
+        self.write_count += n
+        return n
+
+    def read(self, out):
+        '''fill the (n, channel) array out from the oldest frames'''
+        n = min(len(out), self.available)
+        pos = self.read_count % self.capacity
+        head = min(n, self.capacity - pos)
+        out[:head] = self.data[pos:pos + head]
+        out[head:n] = self.data[:n - head]
+        self.read_count += n
+        return n
+
+    def clear(self):
+        '''drop all buffered frames; call from the consumer side'''
+        self.read_count = self.write_count
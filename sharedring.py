@@ -0,0 +1,260 @@
+import math
+import time
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+
+import audioblock as ab
+
+
+def _attach_shm(name):
+    '''attach to an existing segment without handing it to the resource
+    tracker, which would otherwise unlink it when an attaching process exits'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedArray(object):
+    '''numpy array in shared memory that survives pickling to other processes'''
+
+    def __init__(self, shape, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner = True
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.array[...] = 0
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype.str,
+                'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.shm = _attach_shm(state['name'])
+        self._owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        if(self._owner):
+            self.shm.unlink()
+
+
+class SharedRing(object):
+    '''Single-producer/multi-consumer ring of fixed-size numpy frames in
+    shared memory.
+
+    The producer side has the same put()/put_nowait() interface as a queue,
+    so a ring can be handed to register_queue(). Every consumer gets its own
+    SharedRingReader (see reader()) with a private cursor; readers never
+    block the producer. A reader that falls more than `capacity` frames
+    behind skips ahead to the oldest frame that is safe to read and counts
+    the skipped frames in `overruns`.
+
+    No locks are taken: the producer fills a slot, then publishes it by
+    bumping the write counter. Readers re-check the counter after taking a
+    slot to detect that the producer lapped them meanwhile. Nothing but
+    the shared memory name is needed to reach the ring, so it pickles to
+    any process, e.g. through a Queue, and a ring attached by name works
+    the same as the one it was created as.
+
+    The AudioBlock metadata of a frame (seq, timestamp, ...) travels in its
+    slot too, and readers return AudioBlocks when it was set.
+    '''
+
+    def __init__(self, frame_size, dtype=np.int16, capacity=64,
+                 name=None, create=True):
+        self.frame_size = frame_size
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+
+        data_bytes = self.capacity * self.frame_size * self.dtype.itemsize
+        header_bytes = (1 + self.capacity) * 8
+        header_bytes += self.capacity * len(ab.AudioBlock.meta_attrs) * 8
+        if(create):
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=header_bytes + data_bytes)
+        else:
+            self.shm = _attach_shm(name)
+        self._owner = create
+        self._attach()
+        if(create):
+            self.header[:] = 0
+
+    def _attach(self):
+        header_len = 1 + self.capacity
+        self.header = np.ndarray((header_len,), dtype=np.int64,
+                                 buffer=self.shm.buf)
+        # header[0] is the number of frames ever written,
+        # header[1 + slot] the valid length of that slot
+        self.lengths = self.header[1:]
+        # metadata per slot, NaN where an attribute is None
+        meta_shape = (self.capacity, len(ab.AudioBlock.meta_attrs))
+        self.meta = np.ndarray(meta_shape, dtype=np.float64,
+                               buffer=self.shm.buf, offset=header_len * 8)
+        self.frames = np.ndarray((self.capacity, self.frame_size),
+                                 dtype=self.dtype, buffer=self.shm.buf,
+                                 offset=(header_len + self.meta.size) * 8)
+
+    def __getstate__(self):
+        return {'frame_size': self.frame_size, 'dtype': self.dtype.str,
+                'capacity': self.capacity, 'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.frame_size = state['frame_size']
+        self.dtype = np.dtype(state['dtype'])
+        self.capacity = state['capacity']
+        self.shm = _attach_shm(state['name'])
+        self._owner = False
+        self._attach()
+
+    @property
+    def write_count(self):
+        return int(self.header[0])
+
+    def put(self, data, block=True, timeout=None):
+        '''write one frame; never blocks, the oldest frame is overwritten'''
+        meta = [getattr(data, attr, None) for attr in ab.AudioBlock.meta_attrs]
+        if(isinstance(data, (bytes, bytearray, memoryview))):
+            data = np.frombuffer(data, dtype=self.dtype)
+        data = np.ravel(data)
+        length = len(data)
+        if(length > self.frame_size):
+            raise ValueError("frame of %d samples exceeds ring frame size %d"
+                             % (length, self.frame_size))
+
+        count = int(self.header[0])
+        slot = count % self.capacity
+        self.frames[slot, :length] = data
+        self.meta[slot] = [np.nan if value is None else value for value in meta]
+        self.lengths[slot] = length
+        self.header[0] = count + 1
+
+    def put_nowait(self, data):
+        self.put(data, block=False)
+
+    def reader(self, every=1, latest=False, copy=False):
+        return SharedRingReader(self, every, latest, copy)
+
+    def close(self):
+        self.header = None
+        self.lengths = None
+        self.meta = None
+        self.frames = None
+        self.shm.close()
+
+    def unlink(self):
+        '''release the shared memory; only the creating side should call it'''
+        if(self._owner):
+            self.shm.unlink()
+
+
+class SharedRingReader(object):
+    '''Consumer end of a SharedRing with a queue-like get() interface.
+
+    get() returns a view into shared memory. It is checked to be whole
+    when it is returned, but the producer overwrites it in place once it
+    laps the reader and reuses the slot, so a view that is kept around can
+    tear. Pass copy=True (to get() or for all reads, to the reader) to
+    detach the frame.
+
+    A blocking get() polls, backing off from poll_interval up to
+    max_poll_interval while no frame arrives, so an idle reader wakes up
+    at most 1 / max_poll_interval times per second. The producer never
+    waits for or signals readers.
+
+    Readers decimate on their own, at no cost to the producer: with
+    every=N only every Nth frame is returned, with latest=True always the
+    newest one, skipping any backlog (counted in `skipped`).
+    '''
+    poll_interval = 0.001
+    max_poll_interval = 0.02
+
+    def __init__(self, ring, every=1, latest=False, copy=False):
+        self.ring = ring
+        self.every = every
+        self.latest = latest
+        self.copy = copy
+        self.cursor = ring.write_count
+        self.overruns = 0
+        self.skipped = 0
+
+    def qsize(self):
+        return self.ring.write_count - self.cursor
+
+    def empty(self):
+        return self.qsize() <= 0
+
+    def _read(self, copy):
+        ring = self.ring
+        count = ring.write_count
+        if(self.cursor >= count):
+            raise queue.Empty
+        if(self.latest and (count - self.cursor > 1)):
+            self.skipped += count - 1 - self.cursor
+            self.cursor = count - 1
+        # the slot `capacity` frames back may be the one being written now
+        if(count - self.cursor >= ring.capacity):
+            skip_to = count - ring.capacity + 1
+            self.overruns += skip_to - self.cursor
+            self.cursor = skip_to
+
+        slot = self.cursor % ring.capacity
+        frame = ring.frames[slot, :ring.lengths[slot]]
+        meta = ring.meta[slot].tolist()
+        if(copy):
+            frame = frame.copy()
+        if(ring.write_count - self.cursor >= ring.capacity):
+            # the producer overwrote the slot while we were taking it
+            self.overruns += 1
+            self.cursor += 1
+            return self._read(copy)
+        self.cursor += self.every
+        return self._with_meta(frame, meta)
+
+    def _with_meta(self, frame, meta):
+        if(all(math.isnan(value) for value in meta)):
+            return frame
+        values = {}
+        for attr, value in zip(ab.AudioBlock.meta_attrs, meta):
+            if(math.isnan(value)):
+                continue
+            if(attr != 'timestamp'):
+                value = int(value)
+            values[attr] = value
+        return ab.AudioBlock(frame, **values)
+
+    def get(self, block=True, timeout=None, copy=None):
+        if(copy is None):
+            copy = self.copy
+        if(block is False):
+            return self._read(copy)
+
+        deadline = None
+        if(timeout is not None):
+            deadline = time.monotonic() + timeout
+        backoff = self.poll_interval
+        while True:
+            try:
+                return self._read(copy)
+            except queue.Empty:
+                remaining = None
+                if(deadline is not None):
+                    remaining = deadline - time.monotonic()
+                    if(remaining <= 0):
+                        raise
+            if(remaining is not None):
+                backoff = min(backoff, remaining)
+            time.sleep(backoff)
+            backoff = min(2 * backoff, self.max_poll_interval)
+
+    def get_nowait(self, copy=None):
+        return self.get(block=False, copy=copy)
@@ -0,0 +1,291 @@
+'''Display transforms of (channel x bins) complex spectra.
+
+Every kernel is a callable kernel(data, out=None) that writes into out
+when given, so an analyzer can run a Chain of them once per frame with
+buffers allocated up front, and dispatch small float32 arrays that plots
+show as they are:
+
+    post_process = Chain(Power(), Bands(octave_bands(freqs)[0]), Decibel())
+
+Kernels are plain objects, so they pickle along with an AudioAnalyzer
+process. Frequencies are those of the analyzer's bins, see
+bin_frequencies().
+'''
+import numpy as np
+
+try:
+    import scipy.sparse as scipy_sparse
+except ImportError:
+    scipy_sparse = None
+
+
+def bin_frequencies(blocksize, samplerate):
+    '''frequency of every bin of an AudioAnalyzer spectrum; its frames are
+    zero padded to twice the blocksize'''
+    return np.arange(blocksize) * (samplerate / (2.0 * blocksize))
+
+
+def _output(data, out, dtype=np.float32):
+    '''out, or a new float32 array of data's shape'''
+    if(out is None):
+        out = np.empty(np.shape(data), dtype=dtype)
+    return out
+
+
+class Magnitude(object):
+    '''|X|'''
+
+    def __call__(self, data, out=None):
+        return np.absolute(data, out=_output(data, out))
+
+
+class Power(object):
+    '''|X|^2'''
+
+    def __call__(self, data, out=None):
+        out = np.absolute(data, out=_output(data, out))
+        return np.square(out, out=out)
+
+
+class Decibel(object):
+    '''10 log10(x / reference) of powers (20 log10 of magnitudes with
+    power=False), never below floor dB'''
+
+    def __init__(self, floor=-120.0, reference=1.0, power=True):
+        self.floor = floor
+        self.factor = 10.0 if power else 20.0
+        self.minimum = reference * 10 ** (floor / self.factor)
+        self.reference = reference
+
+    def __call__(self, data, out=None):
+        out = np.maximum(data, self.minimum, out=_output(data, out))
+        if(self.reference != 1.0):
+            np.divide(out, self.reference, out=out)
+        np.log10(out, out=out)
+        return np.multiply(out, self.factor, out=out)
+
+
+class PowerDB(object):
+    '''power in dB with a floor, straight from complex bins'''
+
+    def __init__(self, floor=-120.0, reference=1.0):
+        self.power = Power()
+        self.decibel = Decibel(floor, reference)
+
+    def __call__(self, data, out=None):
+        out = self.power(data, out)
+        return self.decibel(out, out)
+
+
+def a_weighting(frequencies):
+    '''IEC 61672 A-weighting gain in dB at each frequency'''
+    f2 = np.square(np.asarray(frequencies, dtype=np.float64))
+    numerator = 12194.0 ** 2 * f2 ** 2
+    denominator = ((f2 + 20.6 ** 2) *
+                   np.sqrt((f2 + 107.7 ** 2) * (f2 + 737.9 ** 2)) *
+                   (f2 + 12194.0 ** 2))
+    with np.errstate(divide='ignore'):
+        gain = 20 * np.log10(numerator / denominator) + 2.0
+    '''0 Hz has no finite gain; it is just as inaudible as the lowest bands'''
+    return np.maximum(gain, -200.0)
+
+
+class AWeighting(object):
+    '''adds the A-weighting gain to dB values at the given frequencies
+    (bin frequencies, or band centers after Bands)'''
+
+    def __init__(self, frequencies):
+        self.gain = a_weighting(frequencies).astype(np.float32)
+
+    def __call__(self, data, out=None):
+        return np.add(data, self.gain, out=_output(data, out))
+
+
+def _nearest_bins(frequencies, centers):
+    index = np.searchsorted(frequencies, centers)
+    index = np.clip(index, 1, len(frequencies) - 1)
+    lower = frequencies[index - 1]
+    upper = frequencies[index]
+    return np.where(centers - lower < upper - centers, index - 1, index)
+
+
+def band_matrix(frequencies, edges):
+    '''(bands x bins) matrix averaging the bins between consecutive edges;
+    a band narrower than the bin spacing takes its nearest bin instead'''
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    matrix = np.zeros((len(edges) - 1, len(frequencies)), dtype=np.float32)
+    band = np.searchsorted(edges, frequencies, side='right') - 1
+    inside = (band >= 0) & (band < len(edges) - 1)
+    matrix[band[inside], np.nonzero(inside)[0]] = 1.0
+
+    counts = matrix.sum(axis=1)
+    empty = np.nonzero(counts == 0)[0]
+    centers = np.sqrt(np.maximum(edges[empty], 1e-9) * edges[empty + 1])
+    matrix[empty, _nearest_bins(frequencies, centers)] = 1.0
+    counts[empty] = 1.0
+    matrix /= counts[:, np.newaxis]
+    return matrix
+
+
+def log_bands(frequencies, bands, fmin=20.0, fmax=None):
+    '''bands log-spaced bands from fmin to fmax (default: the top bin);
+    returns (matrix, band centers)'''
+    if(bands <= 0):
+        raise ValueError("need at least one band, not %r" % (bands,))
+    if(fmax is None):
+        fmax = frequencies[-1]
+    edges = np.geomspace(fmin, fmax, bands + 1)
+    return band_matrix(frequencies, edges), np.sqrt(edges[:-1] * edges[1:])
+
+
+def octave_bands(frequencies, fraction=3, fmin=20.0, fmax=None):
+    '''1/fraction octave bands around the 1 kHz reference (base 2);
+    returns (matrix, band centers)'''
+    if(fmax is None):
+        fmax = frequencies[-1]
+    first = int(np.ceil(fraction * np.log2(fmin / 1000.0)))
+    last = int(np.floor(fraction * np.log2(fmax / 1000.0)))
+    if(first > last):
+        raise ValueError("no 1/%d octave band center between %g and %g Hz"
+                         % (fraction, fmin, fmax))
+    centers = 1000.0 * 2.0 ** (np.arange(first, last + 1) / float(fraction))
+    half = 2.0 ** (0.5 / fraction)
+    edges = np.append(centers / half, centers[-1] * half)
+    return band_matrix(frequencies, edges), centers
+
+
+def hz_to_mel(frequencies):
+    return 2595.0 * np.log10(1.0 + np.asarray(frequencies) / 700.0)
+
+
+def mel_to_hz(mels):
+    return 700.0 * (10 ** (np.asarray(mels) / 2595.0) - 1.0)
+
+
+def mel_bands(frequencies, bands, fmin=0.0, fmax=None):
+    '''bands triangular mel filters, each normalized to a sum of 1;
+    returns (matrix, band centers)'''
+    if(bands <= 0):
+        raise ValueError("need at least one band, not %r" % (bands,))
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if(fmax is None):
+        fmax = frequencies[-1]
+    points = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), bands + 2))
+    lower, centers, upper = points[:-2], points[1:-1], points[2:]
+    f = frequencies[np.newaxis, :]
+    rising = (f - lower[:, np.newaxis]) / (centers - lower)[:, np.newaxis]
+    falling = (upper[:, np.newaxis] - f) / (upper - centers)[:, np.newaxis]
+    matrix = np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+    sums = matrix.sum(axis=1)
+    empty = np.nonzero(sums == 0)[0]
+    matrix[empty, _nearest_bins(frequencies, centers[empty])] = 1.0
+    matrix /= matrix.sum(axis=1)[:, np.newaxis]
+    return matrix, centers
+
+
+class Bands(object):
+    '''(channel x bins) -> (channel x bands) through a band matrix, e.g. of
+    log_bands(); kept sparse when scipy is installed and sparse is not
+    False, which pays off once bands are much narrower than the spectrum'''
+
+    def __init__(self, matrix, sparse=None):
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.bands = self.matrix.shape[0]
+        if(sparse is None):
+            sparse = scipy_sparse is not None
+        self.sparse = None
+        if(sparse and (scipy_sparse is not None)):
+            self.sparse = scipy_sparse.csr_matrix(self.matrix)
+        self.transposed = np.ascontiguousarray(self.matrix.T)
+
+    def __getstate__(self):
+        return {'matrix': self.matrix, 'sparse': self.sparse is not None}
+
+    def __setstate__(self, state):
+        self.__init__(state['matrix'], state['sparse'])
+
+    def __call__(self, data, out=None):
+        data = np.asarray(data, dtype=np.float32)
+        if(out is None):
+            out = np.empty(data.shape[:-1] + (self.bands,), dtype=np.float32)
+        if(self.sparse is not None):
+            rows = data.reshape(-1, data.shape[-1])
+            out.reshape(-1, self.bands)[...] = (self.sparse @ rows.T).T
+        else:
+            np.dot(data, self.transposed, out=out)
+        return out
+
+
+def unique_bands(matrix, centers):
+    '''merge consecutive bands that average the very same bins, i.e.
+    narrow low bands that fell back to one nearest bin; a merged band is
+    centered (geometrically) between the ones it replaces'''
+    keep = np.ones(len(matrix), dtype=bool)
+    keep[1:] = np.any(matrix[1:] != matrix[:-1], axis=1)
+    groups = np.cumsum(keep) - 1
+    log_centers = np.bincount(groups, np.log(centers)) / np.bincount(groups)
+    return matrix[keep], np.exp(log_centers)
+
+
+def reduction_bands(bands, blocksize, samplerate, fmin=20.0):
+    '''(matrix, centers) of a band reduction of AudioAnalyzer spectra:
+    `bands` log-spaced bands if it is a number, else 'octave' or
+    'third-octave' bands.
+
+    Bands start at least two bins up, and bands the bins cannot resolve
+    are merged, so there may be fewer than asked for; every row is
+    distinct.'''
+    frequencies = bin_frequencies(blocksize, samplerate)
+    fmin = max(fmin, 2 * frequencies[1])
+    if(bands == 'octave'):
+        matrix, centers = octave_bands(frequencies, 1, fmin)
+    elif(bands == 'third-octave'):
+        matrix, centers = octave_bands(frequencies, 3, fmin)
+    elif(isinstance(bands, str) and (bands.isdigit() is False)):
+        raise ValueError("unknown bands %r" % (bands,))
+    else:
+        matrix, centers = log_bands(frequencies, int(bands), fmin)
+    return unique_bands(matrix, centers)
+
+
+def band_reduction(bands, blocksize, samplerate, fmin=20.0):
+    '''Chain of the mean power per band of reduction_bands(), and the band
+    centers'''
+    matrix, centers = reduction_bands(bands, blocksize, samplerate, fmin)
+    return Chain(Power(), Bands(matrix)), centers
+
+
+class Chain(object):
+    '''kernels applied one after the other, with one buffer per kernel
+    allocated on the first frame (and again if the input shape changes);
+    the returned array is reused for the next frame'''
+
+    def __init__(self, *kernels):
+        self.kernels = kernels
+        self.shape = None
+        self.buffers = None
+
+    def __getstate__(self):
+        return {'kernels': self.kernels}
+
+    def __setstate__(self, state):
+        self.__init__(*state['kernels'])
+
+    def allocate(self, data):
+        self.shape = data.shape
+        self.buffers = []
+        for kernel in self.kernels:
+            data = kernel(data)
+            self.buffers.append(np.empty_like(data))
+
+    def __call__(self, data, out=None):
+        if(data.shape != self.shape):
+            self.allocate(data)
+        for kernel, buffer in zip(self.kernels, self.buffers):
+            data = kernel(data, out=buffer)
+        if(out is not None):
+            out[...] = data
+            return out
+        return data
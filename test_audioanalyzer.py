@@ -0,0 +1,140 @@
+import queue
+import numpy as np
+import pytest
+
+import audioanalyzer as aa
+import audiomanager as am
+import batchanalysis as ba
+import fakepyaudio
+import spectrumkernels as sk
+
+samplerate = 44100
+
+
+def signal(frames, channel=2, seed=0):
+    '''(frames x channel) int16 noise'''
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((frames, channel)) * 1000).astype(np.int16)
+
+
+def collect(analyzer):
+    '''a queue.Queue subscribed to analyzer, for calling process() inline'''
+    frames = queue.Queue()
+    analyzer.register_queue(frames)
+    return frames
+
+
+def drain(frames):
+    return [frames.get_nowait() for i in range(frames.qsize())]
+
+
+def test_reduction_bands_are_distinct():
+    frequencies = sk.bin_frequencies(1024, samplerate)
+    for bands in (64, 256, 'third-octave', 'octave'):
+        matrix, centers = sk.reduction_bands(bands, 1024, samplerate)
+        assert len(np.unique(matrix, axis=0)) == len(matrix) == len(centers)
+        assert np.allclose(matrix.sum(axis=1), 1.0)
+        assert centers[0] >= 2 * frequencies[1]
+
+
+@pytest.mark.parametrize('bands', [0, -1, 'fifth-octave'])
+def test_bad_band_counts_are_rejected(bands):
+    with pytest.raises(ValueError):
+        aa.AudioAnalyzer(blocksize=1024, samplerate=samplerate, bands=bands)
+
+
+def test_bands_need_the_samplerate():
+    with pytest.raises(ValueError):
+        aa.AudioAnalyzer(blocksize=1024, bands=64)
+
+
+@pytest.mark.parametrize('bands', [64, 'third-octave'])
+def test_analyzer_bands_match_batch_analyzer(bands):
+    samples = signal(8 * 1024)
+    analyzer = aa.AudioAnalyzer(blocksize=1024, overlap=256, channel=2,
+                                layout='planar', samplerate=samplerate,
+                                bands=bands)
+    frames = collect(analyzer)
+    analyzer.process(samples.reshape(-1))
+    live = np.array(drain(frames))
+    assert live.shape[-1] == len(analyzer.band_centers)
+    assert analyzer.frame_template().shape == live.shape[1:]
+
+    batch = ba.BatchAnalyzer(blocksize=1024, overlap=256, dtype=np.float64,
+                             normalize=False, bands=bands)
+    offline = batch.analyze(samples, samplerate=samplerate)
+    assert live.shape == offline.shape
+    assert np.allclose(live, offline, rtol=1e-4)
+    assert np.array_equal(analyzer.band_centers, batch.band_centers)
+
+
+def feed(analyzer, samples, sizes):
+    '''process (frames x channel) samples interleaved, in blocks of the
+    given sizes in turn'''
+    frames = collect(analyzer)
+    pos = 0
+    step = 0
+    while(pos < len(samples)):
+        size = sizes[step % len(sizes)]
+        analyzer.process(samples[pos:pos + size].reshape(-1))
+        pos += size
+        step += 1
+    return drain(frames)
+
+
+@pytest.mark.parametrize('sizes', [[1024], [100], [1000, 37, 3000, 1]])
+def test_hops_span_block_boundaries(sizes):
+    samples = signal(6000)
+    analyzer = aa.AudioAnalyzer(blocksize=512, overlap=128, channel=2,
+                                hop_size=300, layout='planar')
+    frames = feed(analyzer, samples, sizes)
+    assert [frame.sample_index for frame in frames] == list(range(300, 6001, 300))
+
+    batch = ba.BatchAnalyzer(blocksize=512, overlap=128, hop_size=300,
+                             dtype=np.float64, normalize=False)
+    assert np.allclose(np.array(frames), batch.analyze(samples))
+
+
+def test_hop_defaults_to_the_blocksize():
+    analyzer = aa.AudioAnalyzer(blocksize=512, channel=1)
+    frames = feed(analyzer, signal(2000, channel=1), [700])
+    assert [frame.sample_index for frame in frames] == [512, 1024, 1536]
+    assert analyzer.samples_since_hop == 2000 - 1536
+
+
+@pytest.mark.parametrize('hop_size', [0, -1, 2.5])
+def test_bad_hop_sizes_are_rejected(hop_size):
+    with pytest.raises(ValueError):
+        aa.AudioAnalyzer(blocksize=512, hop_size=hop_size)
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_sharded_output_equals_single_process_output(workers):
+    samples = signal(5000, channel=5)
+    options = dict(blocksize=512, overlap=128, channel=5, hop_size=256,
+                   layout='planar', fft_backend='numpy')
+    single = feed(aa.AudioAnalyzer(**options), samples, [700])
+
+    analyzer = aa.AudioAnalyzer(workers=workers, **options)
+    analyzer.stft.start()
+    try:
+        sharded = feed(analyzer, samples, [700])
+    finally:
+        analyzer.stft.stop()
+        analyzer.stft.join()
+    assert len(sharded) == len(single)
+    for frame, expected in zip(sharded, single):
+        assert frame.sample_index == expected.sample_index
+        assert np.allclose(frame, expected)
+
+
+def test_manager_passes_analyzer_workers():
+    manager = am.AudioManager(512, analyzer_workers=2,
+                              streamer_options={'pyaudio_module': fakepyaudio})
+    manager.set_play_audiodata(signal(1024).reshape(-1), samplerate, 2,
+                               np.int16)
+    assert isinstance(manager.analyzer.stft, aa.ShardedSTFT)
+    assert manager.analyzer.workers == 2
+    for shared in manager.analyzer.stft.shared.values():
+        shared.close()
+        shared.unlink()
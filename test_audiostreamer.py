@@ -0,0 +1,179 @@
+import time
+import numpy as np
+import pytest
+
+import audioblock as ab
+import audiostreamer as ast
+import fakepyaudio
+import ringbuffer
+
+
+def make_streamer(**kwargs):
+    kwargs.setdefault('datatype', np.int16)
+    kwargs.setdefault('channel', 2)
+    return ast.CallbackAudioStreamer(pyaudio_module=fakepyaudio, daemon=True,
+                                     **kwargs)
+
+
+def frames(streamer, count):
+    return np.arange(count * streamer.channel,
+                     dtype=streamer.datatype).reshape(count, streamer.channel)
+
+
+def play(streamer, status=0):
+    out, flag = streamer.play_callback(None, streamer.frames_per_buffer, {},
+                                       status)
+    assert flag == fakepyaudio.paContinue
+    return np.frombuffer(out, dtype=streamer.datatype)
+
+
+def test_default_buffering_is_under_10_ms():
+    streamer = make_streamer()
+    prebuffered = streamer.prebuffer * streamer.frames_per_buffer
+    assert prebuffered / float(streamer.samplerate) < 0.010
+
+
+def test_playback_waits_for_prebuffer():
+    streamer = make_streamer(frames_per_buffer=128, prebuffer=2)
+    streamer.fifo.write(frames(streamer, 128))
+    assert not play(streamer).any()
+    assert streamer.underruns == 0
+
+    streamer.fifo.write(frames(streamer, 128))
+    block = frames(streamer, 128).reshape(-1)
+    assert np.array_equal(play(streamer), block)
+    assert np.array_equal(play(streamer), block)
+    assert streamer.underruns == 0
+
+
+def test_underrun_counts_and_reprimes():
+    streamer = make_streamer(frames_per_buffer=128, prebuffer=1)
+    streamer.fifo.write(frames(streamer, 200))
+    play(streamer)
+    partial = play(streamer)
+    assert streamer.underruns == 1
+    assert not partial[72 * streamer.channel:].any()
+    assert streamer.primed is False
+
+    play(streamer, fakepyaudio.paOutputUnderflow)
+    assert streamer.underruns == 2
+    assert streamer.stats()['underruns'] == 2
+
+
+def test_overrun_when_fifo_is_full():
+    streamer = make_streamer(frames_per_buffer=128, fifo_buffers=2,
+                             buffersize=64, input_flag=True)
+    in_data = frames(streamer, 128).tobytes()
+    for i in range(2):
+        streamer.record_callback(in_data, 128, {}, 0)
+    assert streamer.overruns == 0
+    streamer.record_callback(in_data, 128, {}, 0)
+    assert streamer.overruns == 1
+    streamer.record_callback(in_data, 128, {}, fakepyaudio.paInputOverflow)
+    assert streamer.overruns == 3
+    assert streamer.stats()['buffered'] == 256
+
+
+def test_fake_device_drives_capture_counters(monkeypatch):
+    '''nobody drains the FIFO, so the device thread must overrun it'''
+    monkeypatch.setattr(fakepyaudio, 'realtime', False)
+    streamer = make_streamer(frames_per_buffer=128, fifo_buffers=4,
+                             buffersize=64, input_flag=True, monitor=True)
+    stream = fakepyaudio.PyAudio().open(format=fakepyaudio.paInt16,
+                                        channels=streamer.channel,
+                                        rate=streamer.samplerate,
+                                        input=True, output=True,
+                                        frames_per_buffer=128,
+                                        stream_callback=streamer.record_callback)
+    deadline = time.monotonic() + 5
+    while((streamer.overruns == 0) and (time.monotonic() < deadline)):
+        time.sleep(0.01)
+    stream.close()
+
+    assert streamer.overruns > 0
+    assert streamer.fifo.available == streamer.fifo.capacity
+    '''monitoring played the captured input straight back'''
+    assert stream.frames_played > 0
+
+
+@pytest.mark.parametrize('monitor', [False, True])
+def test_monitor_returns_input(monitor):
+    streamer = make_streamer(monitor=monitor, input_flag=True)
+    in_data = frames(streamer, 128).tobytes()
+    out, flag = streamer.record_callback(in_data, 128, {}, 0)
+    assert (out == in_data) if monitor else (out is None)
+
+
+def test_fifo_wraps_and_bounds():
+    fifo = ringbuffer.SampleFifo(8, channel=2, dtype=np.int16)
+    out = np.empty((5, 2), dtype=np.int16)
+    sent = np.arange(2 * 40, dtype=np.int16).reshape(40, 2)
+    received = []
+    pos = 0
+    while(len(received) < 40):
+        pos += fifo.write(sent[pos:pos + 6])
+        assert 0 <= fifo.available <= fifo.capacity
+        n = fifo.read(out)
+        received.extend(out[:n].tolist())
+    assert np.array_equal(np.array(received), sent)
+
+
+def test_fifo_write_returns_what_fits():
+    fifo = ringbuffer.SampleFifo(4, channel=1)
+    assert fifo.write(np.arange(6)) == 4
+    assert fifo.free == 0
+    assert fifo.write([1]) == 0
+    out = np.empty((6, 1), dtype=np.int16)
+    assert fifo.read(out) == 4
+    assert np.array_equal(out[:4, 0], np.arange(4))
+
+
+def test_fifo_clear_drops_buffered_frames():
+    fifo = ringbuffer.SampleFifo(4, channel=2)
+    fifo.write(np.ones((3, 2)))
+    fifo.clear()
+    assert (fifo.available, fifo.free) == (0, 4)
+    assert fifo.write(np.full((4, 2), 7)) == 4
+    out = np.empty((4, 2), dtype=np.int16)
+    assert fifo.read(out) == 4
+    assert (out == 7).all()
+
+
+def test_split_channel_is_a_view():
+    interleaved = np.arange(12, dtype=np.int16)
+    planar = ast.split_channel(interleaved, 3)
+    assert planar.shape == (3, 4)
+    assert np.shares_memory(planar, interleaved)
+    np.testing.assert_array_equal(planar[1], [1, 4, 7, 10])
+
+    out = np.empty((3, 4), dtype=np.int16)
+    assert ast.split_channel(interleaved, 3, out=out) is out
+    assert np.shares_memory(out, interleaved) is False
+    np.testing.assert_array_equal(out, planar)
+
+
+def test_merge_channel_of_a_planar_view_is_a_view():
+    interleaved = np.arange(12, dtype=np.int16)
+    merged = ast.as_interleaved(ast.as_planar(interleaved, 3))
+    assert np.shares_memory(merged, interleaved)
+    np.testing.assert_array_equal(merged, interleaved)
+
+    '''a contiguous planar array has to be copied'''
+    planar = np.ascontiguousarray(ast.split_channel(interleaved, 3))
+    np.testing.assert_array_equal(ast.merge_channel(planar), interleaved)
+    out = np.empty(12, dtype=np.int16)
+    assert ast.merge_channel(planar, out=out) is out
+    np.testing.assert_array_equal(out, interleaved)
+
+
+def test_layouts_pass_through_and_keep_metadata():
+    planar = np.zeros((2, 8))
+    interleaved = np.zeros(16)
+    assert ast.as_planar(planar, 2) is planar
+    assert ast.as_interleaved(interleaved) is interleaved
+
+    block = ab.AudioBlock(np.arange(8, dtype=np.int16), seq=3, timestamp=1.5)
+    planar = ast.as_planar(block, 2)
+    assert np.shares_memory(planar, block)
+    assert (planar.seq, planar.timestamp) == (3, 1.5)
+    assert ast.as_interleaved(planar).seq == 3
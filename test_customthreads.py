@@ -0,0 +1,159 @@
+import multiprocessing
+import queue
+import threading
+import time
+import pytest
+
+import customthreads as ct
+
+
+class Consumer(ct.QueueConsumer, ct.StoppableThread):
+    poll_timeout = 0.05
+
+    def __init__(self, queue_size=4, cross_process=False):
+        super(Consumer, self).__init__(daemon=True)
+        if(cross_process):
+            self.in_queue = multiprocessing.Queue(queue_size)
+        else:
+            self.in_queue = queue.Queue(queue_size)
+
+
+def dispatch(dispatcher, blocks):
+    for block in blocks:
+        dispatcher.dispatch(block)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ct.Subscription(queue.Queue(), 'drop_some')
+
+
+def test_block_waits_for_room_until_stopped():
+    subscription = ct.Subscription(queue.Queue(1))
+    subscription.put_timeout = 0.01
+    assert subscription.put(0, lambda: False)
+    threading.Timer(0.05, subscription.queue.get).start()
+    assert subscription.put(1, lambda: False)
+    assert subscription.put(2, lambda: True) is False
+    assert (subscription.dispatched, subscription.dropped) == (2, 0)
+
+
+def test_drop_newest():
+    dispatcher = ct.DispatcherThread()
+    consumer = Consumer()
+    subscription = consumer.subscribe(dispatcher, ct.DROP_NEWEST)
+    dispatch(dispatcher, range(6))
+    blocks = consumer.consume()
+    assert [next(blocks) for i in range(4)] == [0, 1, 2, 3]
+    assert subscription.stats() == {'policy': ct.DROP_NEWEST, 'every': 1,
+                                    'dispatched': 4, 'dropped': 2}
+
+
+def test_drop_oldest_makes_room_on_the_consumer_side():
+    dispatcher = ct.DispatcherThread()
+    consumer = Consumer()
+    subscription = consumer.subscribe(dispatcher, ct.DROP_OLDEST)
+    dispatch(dispatcher, range(6))
+    blocks = consumer.consume()
+    '''4 and 5 found the queue full, the consumer then dropped 0'''
+    assert next(blocks) == 1
+    dispatch(dispatcher, [6])
+    assert [next(blocks) for i in range(3)] == [2, 3, 6]
+    assert (subscription.dispatched, subscription.dropped) == (5, 3)
+
+
+@pytest.mark.parametrize('cross_process', [False, True])
+def test_latest_skips_to_the_newest_block(cross_process):
+    dispatcher = ct.DispatcherThread()
+    consumer = Consumer(cross_process=cross_process)
+    subscription = consumer.subscribe(dispatcher, ct.LATEST)
+    dispatch(dispatcher, range(3))
+    '''let the queue's feeder thread flush'''
+    time.sleep(0.1)
+    assert next(consumer.consume()) == 2
+    assert (subscription.dispatched, subscription.dropped) == (3, 2)
+
+
+def test_dispatcher_never_reads_subscriber_queues():
+    class WriteOnlyQueue(queue.Queue):
+        def get(self, *args, **kwargs):
+            raise AssertionError("the dispatcher took a block")
+
+    dispatcher = ct.DispatcherThread()
+    for policy in ct.POLICIES[1:]:
+        dispatcher.register_queue(WriteOnlyQueue(2), policy)
+    dispatch(dispatcher, range(5))
+    assert [s['dropped'] for s in dispatcher.queue_stats()] == [3, 3, 3]
+
+
+def test_every():
+    dispatcher = ct.DispatcherThread()
+    subscription = dispatcher.register_queue(queue.Queue(), every=3)
+    dispatch(dispatcher, range(7))
+    assert subscription.dispatched == 3
+    assert [subscription.queue.get_nowait() for i in range(3)] == [0, 3, 6]
+
+
+def test_stop_wakes_a_dropping_consumer():
+    dispatcher = ct.DispatcherThread()
+    consumer = Consumer()
+    consumer.poll_timeout = 10
+    consumer.subscribe(dispatcher, ct.LATEST)
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(consumer.consume()))
+    thread.start()
+    dispatch(dispatcher, [1])
+    time.sleep(0.05)
+    consumer.stop()
+    thread.join(1)
+    assert thread.is_alive() is False
+    assert received == [1]
+
+
+def test_counters_are_shared_with_a_consumer_process():
+    dispatcher = ct.DispatcherThread()
+    consumer = Consumer(cross_process=True)
+    subscription = consumer.subscribe(dispatcher, ct.DROP_OLDEST)
+    dispatch(dispatcher, range(5))
+    time.sleep(0.1)
+    process = multiprocessing.Process(target=_take_one, args=(subscription,))
+    process.start()
+    process.join(5)
+    assert subscription.dropped == 2
+
+
+def _take_one(subscription):
+    subscription.get(timeout=5)
+
+
+class Counted(object):
+    '''counts how often it is pickled'''
+    pickled = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce__(self):
+        Counted.pickled += 1
+        return (Counted, (self.value,))
+
+
+def test_cross_process_fan_out_pickles_once():
+    dispatcher = ct.DispatcherThread()
+    local = Consumer()
+    local.subscribe(dispatcher)
+    remote = [Consumer(cross_process=True) for i in range(3)]
+    for consumer in remote:
+        consumer.subscribe(dispatcher)
+
+    Counted.pickled = 0
+    blocks = [Counted(i) for i in range(2)]
+    dispatch(dispatcher, blocks)
+    assert Counted.pickled == 2
+
+    received = local.consume()
+    assert [next(received) for i in range(2)] == blocks
+    for consumer in remote:
+        received = consumer.consume()
+        assert [next(received).value for i in range(2)] == [0, 1]
+    assert [s.dispatched for s in dispatcher._queuelist] == [2, 2, 2, 2]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import decimation
+import mplot
+
+
+def reference(samples, bucket, columns):
+    '''interleaved min/max of the newest complete buckets (aligned to the
+    first sample), per channel'''
+    complete = samples.shape[1] - samples.shape[1] % bucket
+    window = samples[:, complete - columns * bucket:complete]
+    window = window.reshape(samples.shape[0], columns, bucket)
+    expected = np.empty((samples.shape[0], 2 * columns))
+    expected[:, 0::2] = window.min(axis=2)
+    expected[:, 1::2] = window.max(axis=2)
+    return expected
+
+
+@pytest.mark.parametrize('sizes', [[1000], [7], [1, 333, 24, 1500]])
+def test_every_level_matches_a_direct_min_max(sizes):
+    samples = np.random.default_rng(0).standard_normal((2, 5321))
+    envelope = decimation.EnvelopeBuffer(1000, 10, channel=2, levels=3)
+    assert envelope.buckets == [100, 50, 25]
+    pos = 0
+    step = 0
+    while(pos < samples.shape[1]):
+        size = sizes[step % len(sizes)]
+        envelope.extend(samples[:, pos:pos + size])
+        pos += size
+        step += 1
+
+    for level, bucket in enumerate(envelope.buckets):
+        assert np.array_equal(envelope.envelope(level),
+                              reference(samples, bucket, 10))
+
+
+def test_size_is_rounded_to_whole_buckets():
+    envelope = decimation.EnvelopeBuffer(1050, 10, levels=2)
+    assert envelope.size == 1040
+    assert envelope.buckets == [104, 52]
+
+
+def test_x_values_cover_the_zoomed_span():
+    envelope = decimation.EnvelopeBuffer(1000, 10, levels=3)
+    x = envelope.x_values((0, 1000))
+    assert len(x) == 20
+    assert (x[0], x[-1]) == (0, 1000)
+    assert envelope.x_values((0, 1000), level=2)[0] == 750
+
+
+@pytest.mark.parametrize('display_width', [None, 50])
+def test_deque_plot_zooms_with_and_without_an_envelope(display_width):
+    plot = mplot.DequeMPlot(max_size=1000, display_width=display_width,
+                            zoom_levels=2, xlim=(0, 1000), ylim=(-1, 1),
+                            offscreen=True, figsize=(4, 3), dpi=50)
+    plot.init_plot()
+    plot.ingest(np.ones(300))
+    plot.redraw()
+    plot.set_zoom(1)
+    assert plot.axarr[0, 0].get_xlim() == pytest.approx((500, 1000), abs=1)
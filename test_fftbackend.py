@@ -0,0 +1,52 @@
+import pickle
+import numpy as np
+import pytest
+
+import audioanalyzer as aa
+import fftbackend
+
+
+@pytest.mark.parametrize('name', fftbackend.available_backends())
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_backends_match_numpy(name, dtype):
+    backend = fftbackend.get_backend(name)
+    x = np.random.default_rng(0).standard_normal((3, 256)).astype(dtype)
+    out = np.empty((3, 129), dtype=np.result_type(dtype, np.complex64))
+    assert backend.rfft(x, out=out) is out
+    tolerance = 1e-3 if dtype == np.float32 else 1e-9
+    assert np.allclose(out, np.fft.rfft(x), atol=tolerance)
+
+
+def test_options_go_to_the_named_backend():
+    pytest.importorskip('scipy')
+    assert fftbackend.get_backend('scipy', workers=2).workers == 2
+    with pytest.raises(ValueError):
+        fftbackend.get_backend(None, workers=2)
+
+
+def test_analyzer_passes_fft_options():
+    pytest.importorskip('scipy')
+    analyzer = aa.AudioAnalyzer(blocksize=256, channel=2, fft_backend='scipy',
+                                fft_options={'workers': 2})
+    assert analyzer.stft.backend.workers == 2
+
+
+def test_stft_plans_before_the_first_frame():
+    pytest.importorskip('pyfftw')
+    stft = aa.STFT(256, 64, 2, backend='pyfftw',
+                   backend_options={'planner_effort': 'FFTW_ESTIMATE'})
+    assert list(stft.backend.plans) == [(512, np.dtype(np.float64).str, (2,))]
+    plan = next(iter(stft.backend.plans.values()))
+    stft.push(np.ones((2, 320)))
+    stft.compute()
+    assert next(iter(stft.backend.plans.values())) is plan
+
+
+def test_plans_are_rebuilt_on_unpickling():
+    pytest.importorskip('pyfftw')
+    backend = fftbackend.get_backend('pyfftw', planner_effort='FFTW_ESTIMATE')
+    backend.prepare((2, 512), np.float32)
+    clone = pickle.loads(pickle.dumps(backend))
+    assert list(clone.plans) == list(backend.plans)
+    x = np.ones((2, 512), dtype=np.float32)
+    assert np.allclose(clone.rfft(x), np.fft.rfft(x))
@@ -0,0 +1,59 @@
+import json
+import multiprocessing
+
+import instrumentation
+
+
+def record_values(histogram, values):
+    for value in values:
+        histogram.record(value)
+
+
+def test_quantiles_are_bucket_upper_bounds():
+    histogram = instrumentation.Histogram([1, 2, 4, 8])
+    assert histogram.quantile(0.5) is None
+    record_values(histogram, [0.5] * 50 + [3] * 49 + [100])
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.51) == 4
+    assert histogram.quantile(0.99) == 4
+    assert histogram.quantile(1.0) == float('inf')
+
+    snapshot = histogram.snapshot()
+    assert (snapshot['p50'], snapshot['p99']) == (1, 4)
+    assert snapshot['mean'] == (25 + 147 + 100) / 100.0
+    assert snapshot['buckets'] == [(1, 50), (2, 50), (4, 99), (8, 99),
+                                   (float('inf'), 100)]
+
+
+def test_percentiles_recorded_in_another_process():
+    histogram = instrumentation.Histogram(instrumentation.TIME_BOUNDS)
+    values = [1e-3] * 90 + [0.5] * 10
+    process = multiprocessing.Process(target=record_values,
+                                      args=(histogram, values))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 100
+    assert abs(snapshot['sum'] - 5.09) < 1e-9
+    '''the first bounds holding 1 ms and 0.5 s'''
+    assert snapshot['p50'] == 1e-5 * 2 ** 7
+    assert snapshot['p99'] == 1e-5 * 2 ** 16
+
+
+def test_exports():
+    stats = instrumentation.StageStats('analyzer')
+    stats.record_block(instrumentation.now(), in_queue=None)
+    snapshot = {'analyzer': stats.snapshot()}
+
+    loaded = json.loads(instrumentation.to_json(snapshot))
+    assert loaded['analyzer']['process']['count'] == 1
+    assert loaded['analyzer']['process']['buckets'][-1] == ['+Inf', 1]
+    assert loaded['analyzer']['latency']['mean'] is None
+
+    text = instrumentation.to_prometheus(snapshot)
+    assert ('audiovisualizer_process_seconds_bucket{stage="analyzer",le="+Inf"} 1'
+            in text)
+    assert 'audiovisualizer_queue_depth_count{stage="analyzer"} 0' in text
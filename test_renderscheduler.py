@@ -0,0 +1,20 @@
+import renderscheduler
+
+
+def test_due_after_frame_interval():
+    rendered = []
+    scheduler = renderscheduler.RenderScheduler(lambda: rendered.append(1),
+                                                max_fps=10)
+    assert scheduler.due()
+    scheduler.request()
+    assert scheduler.tick()
+    assert scheduler.due() is False
+    assert scheduler.due(scheduler.last_render + scheduler.interval)
+
+    scheduler.request()
+    scheduler.request()
+    assert scheduler.tick() is False
+    scheduler.last_render -= scheduler.interval
+    assert scheduler.tick()
+    assert rendered == [1, 1]
+    assert scheduler.stats() == {'requested': 3, 'rendered': 2, 'dropped': 1}
@@ -0,0 +1,65 @@
+import collections
+import numpy as np
+import pytest
+
+import ringbuffer
+
+
+def reference(blocks, capacity):
+    '''the ring starts out zero filled'''
+    history = collections.deque(np.zeros(capacity), maxlen=capacity)
+    for block in blocks:
+        history.extend(block)
+    return np.array(history)
+
+
+@pytest.mark.parametrize('mirrored', [False, True])
+def test_extend_matches_a_deque(mirrored):
+    rng = np.random.default_rng(0)
+    ring = ringbuffer.RingBuffer(100, mirrored=mirrored)
+    blocks = []
+    '''short blocks, blocks that wrap, blocks longer than the ring'''
+    for size in [30, 50, 40, 7, 250, 99, 1, 100]:
+        blocks.append(rng.standard_normal(size))
+        ring.extend(blocks[-1])
+        expected = reference(blocks, 100)
+        assert np.array_equal(ring.view(), expected)
+        assert np.array_equal(ring.latest(25), expected[-25:])
+        assert np.array_equal(ring.latest(100), expected)
+
+
+def test_mirrored_latest_is_a_view():
+    ring = ringbuffer.RingBuffer(8, channel=2, mirrored=True)
+    ring.extend(np.arange(2 * 13.0).reshape(2, 13))
+    latest = ring.latest(8)
+    assert np.shares_memory(latest, ring.data)
+    assert np.array_equal(latest, np.arange(26.0).reshape(2, 13)[:, -8:])
+
+
+def test_view_unwraps_only_after_new_data():
+    ring = ringbuffer.RingBuffer(10)
+    ring.extend(np.arange(5.0))
+    ring.extend(np.arange(5.0, 13.0))
+    first = ring.view()
+    first_copy = first.copy()
+    assert ring.view() is first
+    ring.extend([99.0])
+    assert ring.view()[-1] == 99.0
+    assert np.array_equal(ring.view()[:-1], first_copy[1:])
+
+
+def test_planar_history_wraps_per_channel():
+    ring = ringbuffer.RingBuffer(6, channel=3)
+    block = np.arange(3 * 10.0).reshape(3, 10)
+    ring.extend(block[:, :4])
+    ring.extend(block[:, 4:])
+    assert np.array_equal(ring.view(), block[:, -6:])
+    assert np.array_equal(ring.latest(5), block[:, -5:])
+
+
+def test_caller_provided_storage():
+    storage = np.zeros((2, 8))
+    ring = ringbuffer.RingBuffer(4, channel=2, mirrored=True, data=storage)
+    ring.extend(np.ones((2, 3)))
+    assert ring.data is storage
+    assert storage[:, :3].all() and storage[:, 4:7].all()
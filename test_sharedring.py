@@ -0,0 +1,172 @@
+import multiprocessing
+import pickle
+import queue
+import time
+import numpy as np
+import pytest
+
+import audioblock as ab
+import audiomanager as am
+import customthreads as ct
+import fakepyaudio
+import sharedring
+
+
+@pytest.fixture
+def ring():
+    ring = sharedring.SharedRing(frame_size=4, dtype=np.float64, capacity=8)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def put_frames(ring, first, count):
+    for i in range(first, first + count):
+        ring.put(ab.AudioBlock(np.full(4, i, dtype=np.float64), seq=i))
+
+
+def test_frames_and_meta_round_trip(ring):
+    reader = ring.reader()
+    ring.put(ab.AudioBlock(np.arange(3.0), seq=7, timestamp=1.5))
+    ring.put(np.arange(4.0))
+    frame = reader.get_nowait()
+    assert np.array_equal(frame, np.arange(3.0))
+    assert (frame.seq, frame.timestamp, frame.sample_index) == (7, 1.5, None)
+    assert isinstance(reader.get_nowait(), ab.AudioBlock) is False
+    with pytest.raises(queue.Empty):
+        reader.get_nowait()
+
+
+def test_wraparound_keeps_order(ring):
+    reader = ring.reader(copy=True)
+    for start in range(0, 40, 5):
+        put_frames(ring, start, 5)
+        assert [reader.get_nowait().seq for i in range(5)] == list(range(start, start + 5))
+    assert reader.overruns == 0
+
+
+def test_lapped_reader_skips_to_oldest_safe_frame(ring):
+    reader = ring.reader()
+    put_frames(ring, 0, 20)
+    first = reader.get_nowait()
+    '''the slot capacity frames back may be being written: skip it too'''
+    assert first.seq == 20 - ring.capacity + 1
+    assert reader.overruns == first.seq
+
+
+class LappingMeta(object):
+    '''ring.meta stand-in that lets the producer lap the reader the first
+    time a reader looks at a slot'''
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.meta = ring.meta
+        self.lapped = False
+
+    def __getitem__(self, slot):
+        if(self.lapped is False):
+            self.lapped = True
+            put_frames(self.ring, 1, self.ring.capacity)
+        return self.meta[slot]
+
+    def __setitem__(self, slot, value):
+        self.meta[slot] = value
+
+
+def test_view_overwritten_while_taken_is_not_returned(ring):
+    reader = ring.reader()
+    put_frames(ring, 0, 1)
+    ring.meta = LappingMeta(ring)
+    frame = reader.get_nowait()
+    ring.meta = ring.meta.meta
+    assert reader.overruns >= 1
+    assert frame.seq != 0
+    assert np.all(np.asarray(frame) == frame.seq)
+
+
+def test_every_and_latest(ring):
+    every = ring.reader(every=3)
+    latest = ring.reader(latest=True)
+    put_frames(ring, 0, 7)
+    assert [every.get_nowait().seq for i in range(3)] == [0, 3, 6]
+    assert latest.get_nowait().seq == 6
+    assert latest.skipped == 6
+
+
+def test_blocking_get_times_out(ring):
+    reader = ring.reader()
+    start = time.monotonic()
+    with pytest.raises(queue.Empty):
+        reader.get(timeout=0.05)
+    assert time.monotonic() - start >= 0.05
+
+
+def _read_one(rings, results):
+    reader = rings.get(timeout=5).reader(copy=True)
+    results.put('ready')
+    frame = reader.get(timeout=5)
+    results.put((frame.seq, time.monotonic()))
+
+
+def test_ring_sent_through_a_queue_reaches_another_process(ring):
+    rings = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_read_one, args=(rings, results))
+    process.start()
+    rings.put(ring)
+    assert results.get(timeout=5) == 'ready'
+    time.sleep(0.3)
+    written = time.monotonic()
+    put_frames(ring, 0, 1)
+    seq, received = results.get(timeout=5)
+    process.join(5)
+    assert seq == 0
+    assert received - written < 0.1
+
+
+def test_ring_pickles_by_name(ring):
+    '''no synchronization primitives, which only pickle while spawning'''
+    attached = pickle.loads(pickle.dumps(ring))
+    put_frames(ring, 0, 1)
+    assert attached.reader(copy=True).qsize() == 0
+    assert attached.write_count == 1
+    attached.close()
+
+
+def test_attached_ring_polls_with_backoff(ring):
+    attached = sharedring.SharedRing(frame_size=4, dtype=np.float64,
+                                     capacity=8, name=ring.shm.name,
+                                     create=False)
+    reader = attached.reader()
+    put_frames(ring, 0, 1)
+    assert reader.get(timeout=1).seq == 0
+    with pytest.raises(queue.Empty):
+        reader.get(timeout=0.05)
+    attached.close()
+
+
+class Plot(ct.QueueConsumer, ct.StoppableThread):
+    def __init__(self):
+        super(Plot, self).__init__(daemon=True)
+        self.in_queue = queue.Queue()
+
+
+def test_manager_streams_into_one_ring_per_source():
+    manager = am.AudioManager(512, shared_memory=True,
+                              streamer_options={'pyaudio_module': fakepyaudio})
+    samples = np.arange(4096, dtype=np.int16)
+    manager.set_play_audiodata(samples, 44100, 1, np.int16)
+    plot = Plot()
+    manager.connect(plot, 'streamer')
+    ring = manager.rings['streamer']
+    assert [s.queue for s in manager.streamer._queuelist] == [ring]
+    assert manager.analyzer.in_queue.ring is ring
+
+    streamer = manager.streamer
+    streamer.dispatch(streamer.ingest(samples[:streamer.buffersize]))
+    assert ring.write_count == 1
+    np.testing.assert_array_equal(plot.in_queue.get_nowait(),
+                                  manager.analyzer.in_queue.get_nowait())
+    assert manager.snapshot()['streamer_ring_write_count'] == 1
+    ring.close()
+    ring.unlink()
@@ -0,0 +1,95 @@
+import pickle
+import numpy as np
+import pytest
+
+import spectrumkernels as sk
+
+samplerate = 44100
+frequencies = sk.bin_frequencies(1024, samplerate)
+
+
+def spectrum(channel=2, bins=1024, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((channel, bins)) +
+            1j * rng.standard_normal((channel, bins)))
+
+
+def test_a_weighting_reference_values():
+    '''IEC 61672 table values'''
+    gains = sk.a_weighting([100.0, 1000.0, 10000.0])
+    assert gains[1] == pytest.approx(0.0, abs=0.01)
+    assert gains == pytest.approx([-19.1, 0.0, -2.5], abs=0.1)
+    assert np.isfinite(sk.a_weighting([0.0])).all()
+
+
+def test_power_and_decibel():
+    data = spectrum()
+    power = sk.Power()(data)
+    assert power.dtype == np.float32
+    assert np.allclose(power, np.abs(data) ** 2, rtol=1e-5)
+    db = sk.PowerDB(floor=-20.0)(data * 1e-3)
+    assert db.min() >= -20.0 - 1e-4
+    expected = np.maximum(10 * np.log10(np.abs(data) ** 2), -120.0)
+    assert np.allclose(sk.PowerDB()(data), expected, atol=1e-3)
+
+
+def test_kernels_write_into_out():
+    data = spectrum()
+    out = np.empty(data.shape, dtype=np.float32)
+    assert sk.Magnitude()(data, out=out) is out
+    assert sk.PowerDB()(data, out=out) is out
+
+
+@pytest.mark.parametrize('make', [
+    lambda: sk.log_bands(frequencies, 64),
+    lambda: sk.octave_bands(frequencies, 3),
+    lambda: sk.octave_bands(frequencies, 1),
+    lambda: sk.mel_bands(frequencies, 40),
+])
+def test_band_matrix_rows_sum_to_one(make):
+    matrix, centers = make()
+    assert matrix.shape == (len(centers), len(frequencies))
+    assert np.allclose(matrix.sum(axis=1), 1.0)
+    assert (matrix >= 0).all()
+    assert (np.diff(centers) > 0).all()
+
+
+def test_octave_bands_without_a_center_in_range():
+    with pytest.raises(ValueError):
+        sk.octave_bands(sk.bin_frequencies(4, 600), 1, fmin=150.0)
+
+
+def test_sparse_and_dense_bands_agree():
+    matrix, centers = sk.log_bands(frequencies, 64)
+    power = sk.Power()(spectrum())
+    dense = sk.Bands(matrix, sparse=False)(power)
+    assert np.allclose(sk.Bands(matrix)(power), dense, rtol=1e-5)
+    assert np.allclose(dense, power @ matrix.T, rtol=1e-5)
+    '''leading axes, as in BatchAnalyzer'''
+    stacked = np.stack([power, power])
+    assert np.allclose(sk.Bands(matrix)(stacked)[1], dense, rtol=1e-5)
+
+
+def test_chain_reuses_buffers_and_reallocates_on_shape_change():
+    matrix, centers = sk.octave_bands(frequencies)
+    chain = sk.Chain(sk.Power(), sk.Bands(matrix), sk.Decibel())
+    first = chain(spectrum())
+    assert chain(spectrum(seed=1)) is first
+
+    other = chain(spectrum(channel=1))
+    assert other.shape == (1, len(centers))
+    assert other is not first
+    assert chain(spectrum(channel=1)) is other
+
+
+def test_kernels_pickle():
+    matrix, centers = sk.octave_bands(frequencies)
+    chain = sk.Chain(sk.Power(), sk.Bands(matrix), sk.Decibel(),
+                     sk.AWeighting(centers))
+    data = spectrum()
+    expected = chain(data).copy()
+    clone = pickle.loads(pickle.dumps(chain))
+    assert clone.buffers is None
+    assert np.array_equal(clone(data), expected)
+    bands = pickle.loads(pickle.dumps(sk.Bands(matrix)))
+    assert (bands.sparse is None) == (sk.scipy_sparse is None)
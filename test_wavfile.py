@@ -0,0 +1,123 @@
+import queue
+import struct
+import numpy as np
+import pytest
+
+import audiostreamer as ast
+import wavfile
+
+
+def fmt_chunk(channel, samplerate, width, format_tag=wavfile.WAVE_FORMAT_PCM,
+              extensible=False):
+    block_align = channel * width
+    body = struct.pack('<HHIIHH', format_tag, channel, samplerate,
+                       samplerate * block_align, block_align, 8 * width)
+    if(extensible):
+        body = struct.pack('<HHIIHH', wavfile.WAVE_FORMAT_EXTENSIBLE, channel,
+                           samplerate, samplerate * block_align, block_align,
+                           8 * width)
+        body += struct.pack('<HHI', 22, 8 * width, 0)
+        body += struct.pack('<H14s', format_tag, b'\x00' * 14)
+    return chunk(b'fmt ', body)
+
+
+def chunk(chunk_id, body, size=None):
+    if(size is None):
+        size = len(body)
+    padding = b'\x00' * (len(body) & 1)
+    return struct.pack('<4sI', chunk_id, size) + body + padding
+
+
+def write_wav(path, fmt, data, extra=(), data_size=None, riff=b'RIFF',
+              first=b''):
+    '''first goes before the fmt chunk, extra after it'''
+    chunks = first + fmt + b''.join(extra) + chunk(b'data', data, data_size)
+    path.write_bytes(struct.pack('<4sI4s', riff, 4 + len(chunks), b'WAVE')
+                     + chunks)
+    return str(path)
+
+
+def test_chunks_before_data_are_skipped(tmp_path):
+    samples = np.arange(20, dtype='<i2').reshape(10, 2)
+    '''an odd sized chunk is padded to an even length'''
+    extra = [chunk(b'LIST', b'abc'), chunk(b'fact', struct.pack('<I', 10))]
+    filename = write_wav(tmp_path / 'a.wav', fmt_chunk(2, 8000, 2),
+                         samples.tobytes(), extra)
+    info, data = wavfile.open_memmap(filename)
+    assert (info.samplerate, info.channel, info.width, info.frames) == (8000, 2, 2, 10)
+    assert info.dtype == np.dtype('<i2')
+    assert info.data_offset == 12 + 24 + 12 + 12 + 8
+    assert isinstance(data, np.memmap)
+    assert np.array_equal(data, samples)
+
+
+def test_24_bit_samples_are_widened_to_int32(tmp_path):
+    values = np.array([[0, -1], [2 ** 23 - 1, -2 ** 23], [1, 12345]])
+    packed = values.astype('<i4').view(np.uint8).reshape(3, 2, 4)[..., :3]
+    filename = write_wav(tmp_path / 'a.wav', fmt_chunk(2, 48000, 3),
+                         packed.tobytes(), [chunk(b'LIST', b'x')])
+    info, data = wavfile.open_memmap(filename)
+    assert (info.width, info.frames, info.dtype) == (3, 3, np.dtype(np.int32))
+    assert data.shape == (3, 2) and len(data) == 3
+    assert np.array_equal(data[:], values << 8)
+    assert np.array_equal(data[1:3], values[1:3] << 8)
+    assert data[2, 1] == 12345 << 8
+    assert ast.normalize(data[1:2])[0] == pytest.approx([1.0, -1.0], abs=1e-6)
+
+
+def test_extensible_float(tmp_path):
+    samples = np.linspace(-1, 1, 12, dtype='<f4').reshape(4, 3)
+    fmt = fmt_chunk(3, 44100, 4, wavfile.WAVE_FORMAT_IEEE_FLOAT,
+                    extensible=True)
+    info, data = wavfile.open_memmap(write_wav(tmp_path / 'a.wav', fmt,
+                                               samples.tobytes()))
+    assert info.format_tag == wavfile.WAVE_FORMAT_IEEE_FLOAT
+    assert np.array_equal(data, samples)
+
+
+@pytest.mark.parametrize('data_size', [0, 0xFFFFFFFF])
+def test_unfinalized_sizes_fall_back_to_the_file_length(tmp_path, data_size):
+    samples = np.arange(8, dtype='<i2')
+    filename = write_wav(tmp_path / 'a.wav', fmt_chunk(1, 8000, 2),
+                         samples.tobytes(), data_size=data_size)
+    info, data = wavfile.open_memmap(filename)
+    assert info.frames == 8
+    assert np.array_equal(data[:, 0], samples)
+
+
+def test_rf64_size_comes_from_ds64(tmp_path):
+    samples = np.arange(6, dtype='<i2')
+    ds64 = chunk(b'ds64', struct.pack('<QQQI', 0, samples.nbytes, 6, 0))
+    filename = write_wav(tmp_path / 'a.wav', fmt_chunk(1, 8000, 2),
+                         samples.tobytes(), data_size=0xFFFFFFFF,
+                         riff=b'RF64', first=ds64)
+    info, data = wavfile.open_memmap(filename)
+    assert info.data_size == samples.nbytes
+    assert np.array_equal(data[:, 0], samples)
+
+
+def test_bad_files_are_rejected(tmp_path):
+    bad = tmp_path / 'bad.wav'
+    bad.write_bytes(b'RIFX' + b'\x00' * 40)
+    with pytest.raises(ValueError):
+        wavfile.read_header(str(bad))
+    with pytest.raises(ValueError):
+        wavfile.read_header(write_wav(tmp_path / 'a.wav',
+                                      fmt_chunk(1, 8000, 5), b''))
+    with pytest.raises(ValueError):
+        wavfile.read_header(write_wav(tmp_path / 'b.wav', b'', b''))
+
+
+def test_wavbuffer_dispatches_views_of_the_map(tmp_path):
+    samples = np.arange(2 * 250, dtype='<i2').reshape(250, 2)
+    filename = write_wav(tmp_path / 'a.wav', fmt_chunk(2, 8000, 2),
+                         samples.tobytes())
+    source = ast.WavBuffer(filename, blocksize=100)
+    blocks = queue.Queue()
+    source.register_queue(blocks)
+    source.seek(50)
+    source.run()
+    received = [blocks.get_nowait() for i in range(blocks.qsize())]
+    assert [len(block) for block in received] == [200, 200]
+    assert all(np.shares_memory(block, source.data) for block in received)
+    assert np.array_equal(np.concatenate(received), samples[50:].reshape(-1))
@@ -0,0 +1,111 @@
+import os
+import struct
+import numpy as np
+import pytest
+
+import audiostreamer as ast
+import fakepyaudio
+import wavfile
+import wavwriter
+
+
+def block(start, frames, channel=2):
+    return np.arange(start * channel, (start + frames) * channel,
+                     dtype=np.int16).reshape(frames, channel)
+
+
+def read_samples(filename):
+    info, data = wavfile.open_memmap(filename)
+    return info, np.array(data)
+
+
+def sizes(filename):
+    with open(filename, 'rb') as f:
+        header = f.read(44)
+    return struct.unpack('<I', header[4:8])[0], struct.unpack('<I', header[40:44])[0]
+
+
+def run_writer(writer, blocks):
+    '''queue all blocks before starting, then stop: the writer drains them'''
+    for b in blocks:
+        writer.in_queue.put(b)
+    writer.stop()
+    writer.start()
+    writer.join()
+
+
+def test_header_is_patched_while_recording(tmp_path):
+    filename = str(tmp_path / 'rec.wav')
+    writer = wavwriter.WavWriter(filename, 8000, 2, np.int16, patch_interval=0)
+    writer.open_segment()
+    writer.write(block(0, 100))
+    '''readable before close, with the sizes of what was written so far'''
+    assert sizes(filename) == (36 + 400, 400)
+    info, data = read_samples(filename)
+    assert info.frames == 100
+    np.testing.assert_array_equal(data, block(0, 100))
+    writer.write(block(100, 50).tobytes())
+    assert sizes(filename) == (36 + 600, 600)
+    writer.close_segment()
+
+
+def test_stop_drains_the_queue(tmp_path):
+    filename = str(tmp_path / 'rec.wav')
+    writer = wavwriter.WavWriter(filename, 8000, 2, np.int16, daemon=True)
+    run_writer(writer, [block(0, 64), block(64, 64), block(128, 64)])
+    info, data = read_samples(filename)
+    assert (info.samplerate, info.channel, info.width) == (8000, 2, 2)
+    np.testing.assert_array_equal(data, block(0, 192))
+    assert sizes(filename) == (36 + 768, 768)
+
+
+def test_rotation_by_bytes_keeps_every_frame(tmp_path):
+    filename = str(tmp_path / 'rec.wav')
+    '''301 bytes round down to 75 whole frames of 4 bytes'''
+    writer = wavwriter.WavWriter(filename, 8000, 2, np.int16, max_bytes=301,
+                                 daemon=True)
+    run_writer(writer, [block(0, 100), block(100, 100)])
+    assert writer.filenames == [filename,
+                                str(tmp_path / 'rec-001.wav'),
+                                str(tmp_path / 'rec-002.wav')]
+    segments = [read_samples(name)[1] for name in writer.filenames]
+    assert [len(s) for s in segments] == [75, 75, 50]
+    np.testing.assert_array_equal(np.concatenate(segments), block(0, 200))
+
+
+def test_rotation_by_seconds(tmp_path):
+    filename = str(tmp_path / 'rec.wav')
+    writer = wavwriter.WavWriter(filename, 100, 1, np.float32, max_seconds=0.5,
+                                 daemon=True)
+    data = np.linspace(-1, 1, 120, dtype=np.float32)
+    run_writer(writer, [data])
+    assert [os.path.basename(n) for n in writer.filenames] == \
+        ['rec.wav', 'rec-001.wav', 'rec-002.wav']
+    info, first = read_samples(writer.filenames[0])
+    assert info.format_tag == wavfile.WAVE_FORMAT_IEEE_FLOAT
+    assert len(first) == 50
+    np.testing.assert_array_equal(
+        np.concatenate([read_samples(n)[1][:, 0] for n in writer.filenames]),
+        data)
+
+
+def test_record_waits_for_the_writer_after_stop(tmp_path):
+    filename = str(tmp_path / 'rec.wav')
+    streamer = ast.AudioStreamer(input_flag=True, filename=filename,
+                                 channel=2, datatype=np.int16,
+                                 pyaudio_module=fakepyaudio, daemon=True,
+                                 writer_options={'queue_size': 2})
+    streamer.start_recording()
+    '''the streamer is stopped first, the writer joined afterwards'''
+    streamer.stop()
+    blocks = [block(64 * i, 64) for i in range(20)]
+    for b in blocks:
+        streamer.record(b.tobytes())
+    streamer.stop_recording()
+    assert streamer.recorder.dropped == 0
+    np.testing.assert_array_equal(read_samples(filename)[1],
+                                  np.concatenate(blocks))
+
+    with pytest.warns(UserWarning):
+        streamer.record(blocks[0].tobytes())
+    assert streamer.recorder.dropped == 1
@@ -0,0 +1,129 @@
+import os
+import struct
+import numpy as np
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+'''24 bit samples are widened to int32 as they are read, see Int24Samples'''
+dic_pcm_width_to_numpy_dtype = {1: np.uint8,
+                                2: np.int16,
+                                3: np.int32,
+                                4: np.int32}
+
+dic_float_width_to_numpy_dtype = {4: np.float32,
+                                  8: np.float64}
+
+
+class WavInfo(object):
+    '''what the header of a WAV file says about its data chunk'''
+
+    def __init__(self, samplerate, channel, width, format_tag,
+                 data_offset, data_size):
+        self.samplerate = samplerate
+        self.channel = channel
+        self.width = width
+        self.format_tag = format_tag
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+        if(format_tag == WAVE_FORMAT_PCM):
+            types = dic_pcm_width_to_numpy_dtype
+        elif(format_tag == WAVE_FORMAT_IEEE_FLOAT):
+            types = dic_float_width_to_numpy_dtype
+        else:
+            raise ValueError("unsupported WAV format tag 0x%04x" % format_tag)
+        if(width not in types):
+            raise ValueError("unsupported sample width %d for format 0x%04x"
+                             % (width, format_tag))
+        self.dtype = np.dtype(types[width]).newbyteorder('<')
+        self.frames = self.data_size // (self.width * self.channel)
+
+
+def read_header(filename):
+    '''parse the RIFF (or RF64) chunk list once, without touching the samples'''
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if((riff not in (b'RIFF', b'RF64')) or (wave != b'WAVE')):
+            raise ValueError("%s is not a WAV file" % filename)
+
+        fmt = None
+        rf64_data_size = None
+        while True:
+            chunk_header = f.read(8)
+            if(len(chunk_header) < 8):
+                raise ValueError("%s has no data chunk" % filename)
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            chunk_start = f.tell()
+
+            if(chunk_id == b'ds64'):
+                _, rf64_data_size = struct.unpack('<QQ', f.read(16))
+            elif(chunk_id == b'fmt '):
+                fmt = f.read(chunk_size)
+            elif(chunk_id == b'data'):
+                if(fmt is None):
+                    raise ValueError("%s has data before fmt chunk" % filename)
+                data_size = chunk_size
+                if((riff == b'RF64') and (rf64_data_size is not None)):
+                    data_size = rf64_data_size
+                '''recordings that were never finalized have a stale or
+                placeholder size; trust the file length instead'''
+                data_size = min(data_size, file_size - chunk_start)
+                if(chunk_size == 0):
+                    data_size = file_size - chunk_start
+                return _parse_fmt(fmt, chunk_start, data_size)
+
+            f.seek(chunk_start + chunk_size + (chunk_size & 1))
+
+
+def _parse_fmt(fmt, data_offset, data_size):
+    format_tag, channel, samplerate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if((format_tag == WAVE_FORMAT_EXTENSIBLE) and (len(fmt) >= 26)):
+        '''the first two bytes of the sub-format GUID are the real tag'''
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    return WavInfo(samplerate, channel, bits // 8, format_tag,
+                   data_offset, data_size)
+
+
+class Int24Samples(object):
+    '''(frames x channel) int32 samples over a memmap of packed 24 bit ones.
+
+    numpy has no 24 bit dtype, so every slice taken is widened to a new
+    int32 array, with the sample in the upper three bytes: full scale stays
+    full scale, as for 32 bit files. Only what is sliced is read.
+    '''
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.shape = raw.shape[:2]
+        self.ndim = 2
+        self.dtype = np.dtype('<i4')
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        raw = self.raw[index]
+        wide = np.zeros(raw.shape[:-1] + (4,), dtype=np.uint8)
+        wide[..., 1:] = raw
+        return wide.view(self.dtype)[..., 0]
+
+
+def open_memmap(filename):
+    '''header info and a read-only (frames x channel) memmap of the samples;
+    Int24Samples for 24 bit files'''
+    info = read_header(filename)
+    if(info.frames == 0):
+        return info, np.zeros((0, info.channel), dtype=info.dtype)
+    if(info.width == 3):
+        raw = np.memmap(filename, dtype=np.uint8, mode='r',
+                        offset=info.data_offset,
+                        shape=(info.frames, info.channel, 3))
+        return info, Int24Samples(raw)
+    data = np.memmap(filename, dtype=info.dtype, mode='r',
+                     offset=info.data_offset,
+                     shape=(info.frames, info.channel))
+    return info, data
@@ -0,0 +1,144 @@
+import os
+import queue
+import struct
+import time
+import numpy as np
+
+import customthreads as ct
+import wavfile
+
+
+'''RIFF sizes are 32 bit; start a new file before the data chunk overflows'''
+MAX_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def pack_header(samplerate, channel, width, format_tag, data_size):
+    '''canonical 44 byte header: RIFF, 16 byte fmt chunk, data chunk header'''
+    block_align = channel * width
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, format_tag, channel, samplerate,
+                       samplerate * block_align, block_align, 8 * width,
+                       b'data', data_size)
+
+
+class WavWriter(ct.QueueConsumer, ct.StoppableThread):
+    '''Streams raw sample blocks from in_queue into WAV files.
+
+    Blocks (bytes or numpy arrays of dtype) are appended to the open file
+    as they arrive, so memory use does not grow with the recording. The
+    RIFF and data sizes are patched in every patch_interval seconds and on
+    close, which leaves a readable file behind even if the process dies.
+
+    With max_bytes or max_seconds set, a new file is started whenever the
+    current one would exceed them: rec.wav, rec-001.wav, rec-002.wav, ...
+    Files are also rotated before reaching the 4 GiB RIFF limit.
+    '''
+
+    def __init__(self, filename, samplerate, channel, dtype,
+                 max_bytes=None, max_seconds=None, patch_interval=1.0,
+                 fsync=False, queue_size=256, *args, **kwargs):
+        super(WavWriter, self).__init__(*args, **kwargs)
+        self.in_queue = queue.Queue(queue_size)
+        self.filename = filename
+        self.samplerate = samplerate
+        self.channel = channel
+        self.dtype = np.dtype(dtype)
+        self.width = self.dtype.itemsize
+        self.format_tag = wavfile.WAVE_FORMAT_PCM
+        if(self.dtype.kind == 'f'):
+            self.format_tag = wavfile.WAVE_FORMAT_IEEE_FLOAT
+        self.frame_bytes = self.width * self.channel
+
+        limit = MAX_DATA_SIZE
+        if(max_bytes is not None):
+            limit = min(limit, max_bytes)
+        if(max_seconds is not None):
+            limit = min(limit, int(max_seconds * self.samplerate) * self.frame_bytes)
+        '''whole frames only, so a block is never split inside a frame'''
+        self.max_data_size = max(self.frame_bytes,
+                                 limit - limit % self.frame_bytes)
+        self.patch_interval = patch_interval
+        self.fsync = fsync
+
+        self.file = None
+        self.segment = 0
+        self.data_size = 0
+        self.last_patch = 0.0
+        self.filenames = []
+
+    def segment_filename(self, index):
+        if(index == 0):
+            return self.filename
+        root, ext = os.path.splitext(self.filename)
+        return '%s-%03d%s' % (root, index, ext)
+
+    def open_segment(self):
+        name = self.segment_filename(self.segment)
+        self.segment += 1
+        self.file = open(name, 'wb')
+        self.data_size = 0
+        self.file.write(pack_header(self.samplerate, self.channel, self.width,
+                                    self.format_tag, 0))
+        self.filenames.append(name)
+        self.last_patch = time.monotonic()
+
+    def patch_header(self):
+        '''write the current sizes into the header and flush'''
+        end = self.file.tell()
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', 36 + self.data_size))
+        self.file.seek(40)
+        self.file.write(struct.pack('<I', self.data_size))
+        self.file.seek(end)
+        self.file.flush()
+        if(self.fsync):
+            os.fsync(self.file.fileno())
+        self.last_patch = time.monotonic()
+
+    def close_segment(self):
+        if(self.file is None):
+            return
+        self.patch_header()
+        self.file.close()
+        self.file = None
+
+    def write(self, block):
+        if(isinstance(block, np.ndarray)):
+            block = block.astype(self.dtype, copy=False).tobytes()
+        data = memoryview(block).cast('B')
+        while(len(data) > 0):
+            if((self.file is None) or (self.data_size >= self.max_data_size)):
+                self.close_segment()
+                self.open_segment()
+            take = min(len(data), self.max_data_size - self.data_size)
+            self.file.write(data[:take])
+            self.data_size += take
+            data = data[take:]
+
+        if(time.monotonic() - self.last_patch >= self.patch_interval):
+            self.patch_header()
+
+    def idle(self):
+        if((self.file is not None) and
+           (time.monotonic() - self.last_patch >= self.patch_interval)):
+            self.patch_header()
+
+    def drain(self):
+        '''write what was queued before stop()'''
+        while True:
+            try:
+                block = self.in_queue.get_nowait()
+            except queue.Empty:
+                return
+            if(block is not ct.WAKEUP):
+                self.write(block)
+
+    def run(self):
+        self.open_segment()
+        try:
+            for block in self.consume():
+                self.write(block)
+            self.drain()
+        finally:
+            self.close_segment()